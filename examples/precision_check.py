@@ -0,0 +1,43 @@
+# Compare single-precision (complex64) simulation against double precision.
+import time
+import numpy as np
+import pqsim as sim
+
+def random_layers(nq, depth, rng):
+    '''
+    Layers of random 1-qubit unitaries followed by a brick of CZ gates.
+    '''
+    names, qargs, parms = [], [], []
+    for layer in range(depth):
+        for qb in range(nq):
+            a = rng.normal(size=(2,2)) + 1j*rng.normal(size=(2,2))
+            q, r = np.linalg.qr(a)
+            names.append('u')
+            qargs.append([qb,-1])
+            parms.append(q)
+        for qb in range(layer%2, nq-1, 2):
+            names.append('cz')
+            qargs.append([qb,qb+1])
+
+    return np.array(names), np.array(qargs), np.array(parms)
+
+rng = np.random.default_rng(1234)
+print("qubits depth  gates   max|err|   1-fidelity  norm drift  t64/t128")
+for nq, depth in [(12, 20), (16, 50), (20, 100), (22, 40)]:
+    names, qargs, parms = random_layers(nq, depth, rng)
+
+    results = {}
+    for dtype in [np.complex128, np.complex64]:
+        mysimulator = sim.qsim(backend='numba', dtype=dtype)
+        mysimulator.run(2, names[:1], qargs[:1], parms[:1]) # Compile first
+        start = time.time()
+        results[dtype] = (mysimulator.run(nq, names, qargs, parms), time.time() - start)
+
+    v128, t128 = results[np.complex128]
+    v64, t64 = results[np.complex64]
+    err = np.max(np.abs(v64 - v128))
+    norm64 = np.linalg.norm(v64.astype(complex))
+    infidelity = 1 - (np.abs(np.vdot(v128, v64.astype(complex)))/norm64)**2
+    drift = abs(norm64 - 1)
+    print("%6d %5d %6d  %9.2e  %11.2e  %10.2e  %8.2f" %\
+        (nq, depth, len(names), err, infidelity, drift, t64/t128))
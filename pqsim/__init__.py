@@ -1,5 +1,22 @@
 __name__='pqsim'
 __package__='pqsim'
 
+import importlib
 from .ui import qsim
-from . import experimental
+from .circuit import circuit
+
+# Submodules that pull in Numba, multiprocessing or the experimental
+# simulators are imported on first access, to keep "import pqsim" fast.
+lazy_modules = ['numbaQC', 'numpyQC', 'jaxQC', 'sparseQC', 'mpsQC', 'sampling', 'observables', 'outofcore',\
+    'distributed', 'startup', 'qiskit_import', 'profiling', 'bench', 'trajectories', 'snapshots', 'adjoint', 'experimental']
+
+def __getattr__(name):
+    if name in lazy_modules:
+        return importlib.import_module('.' + name, __package__)
+    raise AttributeError("module 'pqsim' has no attribute '" + name + "'")
+
+def warmup(**kwargs):
+    '''
+    Compile (or load from the on-disk cache) the standard kernels; see startup.warmup().
+    '''
+    return importlib.import_module('.startup', __package__).warmup(**kwargs)
@@ -0,0 +1,115 @@
+import numpy as np
+from numba import njit, prange, get_num_threads
+from . import numbaQC
+from .circuit import circuit, gatelut
+from .compiler import param_slots
+from .observables import pauli_masks, parity
+
+def gradients(nq, names, qargs=None, parms=None, paulis=None, coeffs=None, dtype=complex):
+    '''
+    Gradient of the energy <psi|H|psi>, where psi is the output of a circuit
+    run from the zero state and H = sum_t coeffs[t]*P_t a sum of Pauli
+    strings (see observables.pauli_masks()), with respect to the entries of
+    the parameters of every u gate, by adjoint differentiation.
+
+    The circuit is run forward once. The gates are then undone one at a time,
+    from the last, on both the state and the co-state H|psi> (two
+    statevectors), and at each u gate the co-state and the state before the
+    gate give that gate's gradient. Gates are undone by their inverses, so
+    they must be unitary (see circuit.inverse()).
+
+    The circuit is given either as the names, qargs and parms lists,
+    or as a compiled circuit object passed in place of names.
+    Args:
+        paulis: List of Pauli strings.
+        coeffs: Optional list of real coefficients, one per Pauli string.
+        dtype:  Precision of the statevectors.
+    Returns the energy, and an array of the shape of parms, (nparams, 2, 2),
+    holding dE/dRe(U) + 1j*dE/dIm(U) for the entries U of the slot of each
+    u gate, and zeros elsewhere. For u gates depending on a real parameter
+    theta, dE/dtheta = sum(np.real(np.conj(grad)*dU/dtheta)).
+    '''
+    if isinstance(names, circuit):
+        circ = names
+    else:
+        circ = circuit.from_lists(names, qargs, parms)
+    circ = circ.astype(dtype)
+    inv = circ.inverse()
+
+    # Slot of parms holding the parameters of each gate
+    nqbs = (circ.qubits>=0).sum(axis=1)
+    slots = np.array([param_slots(gatelut[op], k) for op, k in zip(circ.ops, nqbs)],\
+        dtype=np.int64)
+    first_slot = np.cumsum(slots) - slots
+
+    psi = np.zeros(2**nq, dtype=dtype)
+    psi[0] = 1.
+    numbaQC.do_ops(nq, circ.ops, circ.qubits, circ.poffs, circ.pbuf, psi)
+
+    xmask, zmask, ny = pauli_masks(paulis)
+    if coeffs is None:
+        coeffs = np.ones(len(paulis))
+    lam = np.empty_like(psi)
+    apply_paulis(psi, xmask, zmask, (np.asarray(coeffs)*(1j)**ny).astype(dtype), lam)
+    energy = np.real(np.vdot(psi, lam))
+
+    grads = np.zeros((slots.sum(), 2, 2), dtype=complex)
+    ugates = np.nonzero(circ.ops==1)[0]
+    if len(ugates)==0:
+        return energy, grads
+
+    nblock = get_num_threads()
+    n = len(circ)
+    # Gates before the first u gate need not be undone
+    for k in range(n - ugates[0]):
+        idx = n - 1 - k
+        numbaQC.do_ops(nq, inv.ops[k:k+1], inv.qubits[k:k+1], inv.poffs[k:k+2],\
+            inv.pbuf, psi)
+        if circ.ops[idx]==1: # u
+            grads[first_slot[idx]] = 2*pair_products(nq, circ.qubits[idx,0], lam, psi, nblock)
+        if idx>ugates[0]:
+            numbaQC.do_ops(nq, inv.ops[k:k+1], inv.qubits[k:k+1], inv.poffs[k:k+2],\
+                inv.pbuf, lam)
+
+    return energy, grads
+
+@njit(parallel=True, cache=True)
+def apply_paulis(vec, xmasks, zmasks, factors, out):
+    '''
+    out = sum_t factors[t] * X^x_t Z^z_t vec, for Pauli terms given by their
+    x and z masks. With factors[t] = coeffs[t]*1j**(number of Y factors),
+    this is H vec for the Hamiltonian of observables.expectation().
+    '''
+    for j in prange(len(vec)):
+        acc = vec.dtype.type(0)
+        for t in range(len(xmasks)):
+            i = j ^ xmasks[t]
+            if parity(i & zmasks[t]):
+                acc -= factors[t]*vec[i]
+            else:
+                acc += factors[t]*vec[i]
+        out[j] = acc
+
+@njit(parallel=True, cache=True)
+def pair_products(n, qb0, lam, phi, nblock):
+    '''
+    The 2x2 matrix M[a,b] = sum_j lam[j + a*2**qb0] * conj(phi[j + b*2**qb0]),
+    over the indices j where qb0 is 0, for n-qubit statevectors lam and phi.
+    The pairs are split into nblock blocks, summed in parallel.
+    '''
+    count = 2**(n-1)
+    stripe = 2**qb0
+    stride = 2*stripe
+    size = (count + nblock - 1)//nblock
+    acc = np.zeros((nblock, 2, 2), dtype=lam.dtype)
+
+    for b in prange(nblock):
+        for i in range(b*size, min((b+1)*size, count)):
+            j = i%stripe + (i//stripe)*stride
+            k = j + stripe
+            acc[b,0,0] += lam[j]*np.conj(phi[j])
+            acc[b,0,1] += lam[j]*np.conj(phi[k])
+            acc[b,1,0] += lam[k]*np.conj(phi[j])
+            acc[b,1,1] += lam[k]*np.conj(phi[k])
+
+    return acc.sum(axis=0)
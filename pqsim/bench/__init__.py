@@ -0,0 +1,2 @@
+from .workloads import statevector, repetition_code
+from .runner import run, compare, save, load, table
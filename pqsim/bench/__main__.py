@@ -0,0 +1,49 @@
+# python -m pqsim.bench run [-o results.json] [options]
+# python -m pqsim.bench compare old.json new.json [--tolerance 0.1]
+import sys
+import argparse
+from .runner import run, compare, save, load, table
+
+def ints(text):
+    return [int(x) for x in text.split(',')]
+
+def words(text):
+    return text.split(',')
+
+parser = argparse.ArgumentParser(prog='python -m pqsim.bench',\
+    description='Benchmark pqsim backends, and compare results across commits.')
+sub = parser.add_subparsers(dest='command', required=True)
+
+p = sub.add_parser('run', help='run the benchmark sweep')
+p.add_argument('-o', '--output', help='write results to this JSON file')
+p.add_argument('--workloads', type=words, default=['random', 'qft', 'ghz', 'ansatz', 'qec'])
+p.add_argument('--backends', type=words, default=['numba', 'numpy'])
+p.add_argument('--qubits', type=ints, default=[10, 14, 18])
+p.add_argument('--threads', type=ints, default=None)
+p.add_argument('--distances', type=ints, default=[3, 5, 9])
+p.add_argument('--shots', type=int, default=10000)
+p.add_argument('--repeats', type=int, default=3)
+
+p = sub.add_parser('compare', help='flag regressions between two result files')
+p.add_argument('old')
+p.add_argument('new')
+p.add_argument('--tolerance', type=float, default=0.1,\
+    help='fractional drop in gates/s reported as a regression')
+
+args = parser.parse_args()
+if args.command=='run':
+    report = run(workloads=args.workloads, backends=args.backends, qubits=args.qubits,\
+        threads=args.threads, distances=args.distances, shots=args.shots, repeats=args.repeats)
+    print('\n'.join(table(report)))
+    if args.output:
+        save(report, args.output)
+else:
+    old = load(args.old)
+    new = load(args.new)
+    rows, regressions = compare(old, new, args.tolerance)
+    print("commits: %s -> %s" % (old['meta']['commit'], new['meta']['commit']))
+    print("workload  backend     qubits dtype      threads   old gates/s   new gates/s  ratio")
+    for k, before, after, ratio in rows:
+        flag = '  REGRESSION' if k in regressions else ''
+        print("%-9s %-11s %6d %-10s %7s %13.4g %13.4g %6.2f%s" % (k[:5] + (before, after, ratio, flag)))
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import platform
+import subprocess
+import numpy as np
+import numba
+from ..ui import qsim
+from ..circuit import circuit
+from ..profiling import bytes_touched
+from .workloads import statevector, repetition_code
+
+def best_time(fn, repeats):
+    '''
+    Shortest of repeats timed calls of fn, after one untimed call that
+    absorbs JIT compilation.
+    '''
+    fn()
+    best = np.inf
+    for r in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def time_statevector(workload, backend, nq, dtype=complex, repeats=3):
+    '''
+    Time one statevector workload (see statevector in workloads.py) on a backend.
+    Returns a result record.
+    '''
+    names, qargs, parms = statevector[workload](nq)
+    circ = circuit.from_lists(names, qargs, parms)
+    sim = qsim(backend=backend, dtype=dtype)
+    vec = np.zeros(2**nq, dtype=dtype)
+
+    def fn():
+        vec[:] = 0
+        vec[0] = 1
+        sim.run(nq, circ, vec=vec)
+
+    seconds = best_time(fn, repeats)
+    nbytes = bytes_touched(nq, circ, np.dtype(dtype).itemsize)
+    return {'workload': workload, 'backend': backend, 'qubits': nq,\
+        'dtype': np.dtype(dtype).name, 'gates': len(circ), 'seconds': seconds,\
+        'gates_per_s': len(circ)/seconds, 'bytes': nbytes, 'bandwidth': nbytes/seconds}
+
+def time_stabilizer(backend, distance, rounds=None, shots=10000, p=1e-3, repeats=3):
+    '''
+    Time syndrome extraction rounds of the repetition code (see
+    repetition_code() in workloads.py) under depolarizing CNOT noise, with
+    backend 'stabilizer' (stabilizerQC.propagate_all_samples()) or 'frame'
+    (frameQC.propagate_frames()). Sampling the noise is not timed.
+    Gates per second count every gate of every shot. Returns a result record.
+    '''
+    from ..experimental import stabilizerQC, frameQC
+    from ..experimental.noise import noise
+    if rounds is None:
+        rounds = distance
+    qlen, clen, count, *circ = repetition_code(distance, rounds)
+    probs = [[1 - p] + [p/15]*15]*count
+    ent = noise(count, 16, shots, probs=probs, seed=1234).entropy
+    if backend=='stabilizer':
+        prop = stabilizerQC.propagate_all_samples
+    else:
+        prop = frameQC.propagate_frames
+
+    seconds = best_time(lambda: prop(qlen, clen, ent, *circ), repeats)
+    gates = shots*len(circ[0])
+    return {'workload': 'qec', 'backend': backend, 'qubits': qlen, 'dtype': 'pauli',\
+        'gates': gates, 'seconds': seconds, 'gates_per_s': gates/seconds,\
+        'bytes': None, 'bandwidth': None}
+
+def commit():
+    '''
+    Git commit of the pqsim source tree, if it is a git checkout.
+    '''
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        out = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=root,\
+            capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except Exception:
+        return None
+
+def run(workloads=('random', 'qft', 'ghz', 'ansatz', 'qec'), backends=('numba', 'numpy'),\
+    qubits=(10, 14, 18), threads=None, dtypes=(complex,), distances=(3, 5, 9),\
+    stabilizer_backends=('stabilizer', 'frame'), shots=10000, repeats=3):
+    '''
+    Run the benchmark sweep: every statevector workload on every backend,
+    number of qubits and precision, and the 'qec' workload for every code
+    distance and stabilizer backend. Numba-based runs are repeated for
+    every number of Numba threads in threads (default: the current one).
+    Returns a dictionary holding the run's metadata under 'meta', and a
+    list of result records under 'results'.
+    '''
+    if threads is None:
+        threads = [numba.get_num_threads()]
+    default_threads = numba.get_num_threads()
+    meta = {'commit': commit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),\
+        'machine': platform.machine(), 'processor': platform.processor(),\
+        'cpus': os.cpu_count(), 'python': platform.python_version(),\
+        'numpy': np.__version__, 'numba': numba.__version__}
+
+    results = []
+    try:
+        for wl in workloads:
+            if wl=='qec':
+                for backend in stabilizer_backends:
+                    for t in threads:
+                        numba.set_num_threads(t)
+                        for d in distances:
+                            res = time_stabilizer(backend, d, shots=shots, repeats=repeats)
+                            res['threads'] = t
+                            results.append(res)
+                continue
+
+            for backend in backends:
+                # Only backends with parallel Numba kernels use several threads
+                uses_numba = backend in ['numba', 'distributed']
+                for t in (threads if uses_numba else [None]):
+                    if t is not None:
+                        numba.set_num_threads(t)
+                    for nq in qubits:
+                        for dtype in dtypes:
+                            res = time_statevector(wl, backend, nq, dtype, repeats)
+                            res['threads'] = t
+                            results.append(res)
+    finally:
+        numba.set_num_threads(default_threads)
+
+    return {'meta': meta, 'results': results}
+
+def save(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=1)
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+def key(res):
+    return (res['workload'], res['backend'], res['qubits'], res['dtype'], res['threads'],\
+        res['gates'])
+
+def compare(old, new, tolerance=0.1):
+    '''
+    Compare two reports (see run()), e.g. from two commits. Results are
+    matched on workload, backend, qubits, dtype, threads and gates.
+    Returns a list of (key, old gates/s, new gates/s, ratio) for every
+    matched result, and the list of those keys whose throughput dropped
+    by more than the fraction tolerance.
+    '''
+    before = {key(res): res for res in old['results']}
+    rows = []
+    regressions = []
+    for res in new['results']:
+        k = key(res)
+        if k not in before:
+            continue
+        ratio = res['gates_per_s']/before[k]['gates_per_s']
+        rows.append((k, before[k]['gates_per_s'], res['gates_per_s'], ratio))
+        if ratio<1 - tolerance:
+            regressions.append(k)
+    return rows, regressions
+
+def table(report):
+    '''
+    Results of a report as lines of text.
+    '''
+    lines = ["workload  backend     qubits dtype      threads     gates   seconds"\
+        "     gates/s   GB/s"]
+    for res in report['results']:
+        bw = '-' if res['bandwidth'] is None else '%6.2f' % (res['bandwidth']/1e9)
+        lines.append("%-9s %-11s %6d %-10s %7s %9d %9.4f %11.4g %6s" % (res['workload'],\
+            res['backend'], res['qubits'], res['dtype'], res['threads'], res['gates'],\
+            res['seconds'], res['gates_per_s'], bw))
+    return lines
@@ -0,0 +1,103 @@
+import numpy as np
+from ..compiler import pack_circ
+
+xmat = np.array([[0,1],[1,0]], dtype=complex).reshape(1,2,2)
+
+def random_unitary(rng):
+    q, r = np.linalg.qr(rng.normal(size=(2,2)) + 1j*rng.normal(size=(2,2)))
+    return q.reshape(1,2,2)
+
+def random_layers(nq, depth=20, seed=1234):
+    '''
+    Layers of random 1-qubit unitaries followed by a brick of CZ gates
+    (as in examples/precision_check.py).
+    '''
+    rng = np.random.default_rng(seed)
+    gates = []
+    for layer in range(depth):
+        for qb in range(nq):
+            gates.append(('u', (qb,), random_unitary(rng)))
+        for qb in range(layer%2, nq-1, 2):
+            gates.append(('cz', (qb, qb+1), None))
+    return pack_circ(gates)
+
+def qft(nq):
+    '''
+    Quantum Fourier transform: Hadamards, controlled phases of angle
+    pi/2**k, and the final qubit reversal.
+    '''
+    gates = []
+    for tq in reversed(range(nq)):
+        gates.append(('h', (tq,), None))
+        for k, cq in enumerate(reversed(range(tq))):
+            factor = np.exp(1j*np.pi/2**(k+1))
+            gates.append(('phase', (cq, tq), np.array([[[factor,0],[0,0]]])))
+    for qb in range(nq//2):
+        gates.append(('swap', (qb, nq-1-qb), None))
+    return pack_circ(gates)
+
+def ghz(nq):
+    '''
+    GHZ state preparation: a Hadamard followed by a chain of CNOTs.
+    '''
+    gates = [('h', (0,), None)]
+    for qb in range(nq-1):
+        gates.append(('cu', (qb, qb+1), xmat))
+    return pack_circ(gates)
+
+def ansatz(nq, layers=4, seed=1234):
+    '''
+    Hardware-efficient variational ansatz: per layer, an RY and an RZ
+    rotation on every qubit (with random angles), then a ladder of CZ gates.
+    '''
+    rng = np.random.default_rng(seed)
+    gates = []
+    for layer in range(layers):
+        for qb in range(nq):
+            theta = rng.random()*np.pi
+            c, s = np.cos(theta/2), np.sin(theta/2)
+            gates.append(('u', (qb,), np.array([[[c,-s],[s,c]]])))
+            gates.append(('rz', (qb,), np.array([[[rng.random()*2*np.pi,0],[0,0]]])))
+        for qb in range(nq-1):
+            gates.append(('cz', (qb, qb+1), None))
+    return pack_circ(gates)
+
+# Statevector workloads, each a function of the number of qubits
+# returning the names, qargs and parms lists of a circuit
+statevector = {'random': random_layers, 'qft': qft, 'ghz': ghz, 'ansatz': ansatz}
+
+def repetition_code(distance, rounds):
+    '''
+    Syndrome extraction rounds of the bit-flip repetition code, in the
+    circuit format of experimental/stabilizerQC.py. Data qubits are
+    0..distance-1 and ancilla i (qubit distance+i) measures Z_i Z_{i+1},
+    using two noisy CNOTs; the data qubits are measured at the end.
+    Returns the number of qubits, classical bits and noisy gates, followed
+    by the arguments of propagate_all_samples() after noisearrays.
+    '''
+    nanc = distance - 1
+    ops, qargs, cargs, noisy = [], [], [], []
+    for r in range(rounds):
+        for i in range(nanc):
+            for dq in (i, i+1):
+                ops.append(1) # cx
+                qargs.append((dq, distance+i))
+                cargs.append(0)
+                noisy.append(True)
+        for i in range(nanc):
+            ops.append(9) # measure
+            qargs.append((distance+i, 0))
+            cargs.append(r*nanc + i)
+            noisy.append(False)
+    for dq in range(distance):
+        ops.append(9)
+        qargs.append((dq, 0))
+        cargs.append(rounds*nanc + dq)
+        noisy.append(False)
+
+    n = len(ops)
+    zeros = np.zeros(n, dtype=np.int64)
+    circ = (np.array(ops, dtype=np.int64), np.array(noisy, dtype=np.bool_), zeros, zeros,\
+        np.zeros((n,1), dtype=np.int64), np.array(qargs, dtype=np.int64),\
+        np.array(cargs, dtype=np.int64).reshape(-1,1))
+    return (distance + nanc, rounds*nanc + distance, int(np.sum(noisy))) + circ
@@ -0,0 +1,121 @@
+import numpy as np
+from .circuit import circuit
+
+# Opcodes of diagonal gates, which may act on any qubit inside a block
+diagonal_ops = [2, 3, 4, 5, 9]
+
+def block_qubits_for(cache_bytes=2**20, itemsize=16):
+    '''
+    Largest number of qubits whose amplitudes fit in cache_bytes.
+    '''
+    return int(np.log2(cache_bytes//itemsize))
+
+class blocker():
+    '''
+    Cache-blocking pass. Splits a compiled circuit into segments of gates
+    that only touch qubits below block_qubits (the "block"), so that
+    do_ops_blocked() can apply a whole segment to one cache-sized chunk
+    of the statevector at a time.
+
+    When a non-diagonal gate targets a qubit outside the block, that qubit
+    is swapped with the block qubit whose next use lies furthest ahead,
+    and later gates are relabelled accordingly. Diagonal gates never force
+    a swap, since qubits outside the block are constant within a chunk.
+    A non-diagonal gate on more qubits than the block holds cannot be
+    blocked; it is left where its qubits are, as a segment of its own that
+    is applied to the whole statevector.
+    The original qubit order is restored at the end of the circuit.
+    '''
+    def __init__(self, block_qubits=None):
+        '''
+        Args:
+            block_qubits: Number of qubits in a chunk. Defaults to a chunk
+                          of complex128 amplitudes filling 1 MiB of cache.
+        '''
+        if block_qubits is None:
+            block_qubits = block_qubits_for()
+        self.block_qubits = block_qubits
+        self.stats = {}
+
+    def run(self, nq, circ):
+        '''
+        Plan blocked execution of circ on nq qubits. Returns the relabelled
+        circuit (with swaps inserted) and the segment table for do_ops_blocked().
+        '''
+        nb = min(self.block_qubits, nq)
+
+        # Positions of non-diagonal uses of each qubit, for the lookahead
+        uses = [[] for qb in range(nq)]
+        for idx in range(len(circ)):
+            if circ.ops[idx] not in diagonal_ops:
+                for qb in circ.qubits[idx]:
+                    if qb>=0:
+                        uses[qb].append(idx)
+        ptr = [0]*nq
+
+        def next_use(qb, idx):
+            while ptr[qb]<len(uses[qb]) and uses[qb][ptr[qb]]<idx:
+                ptr[qb] += 1
+            if ptr[qb]<len(uses[qb]):
+                return uses[qb][ptr[qb]]
+            return len(circ)
+
+        l2p = list(range(nq)) # logical -> physical qubit
+        p2l = list(range(nq)) # physical -> logical qubit
+        ops = []
+        qubits = []
+        params = []
+
+        def add_swap(p0, p1):
+            ops.append(7)
+            qubits.append([p0, p1])
+            params.append(np.zeros(0, dtype=circ.pbuf.dtype))
+            l0, l1 = p2l[p0], p2l[p1]
+            p2l[p0], p2l[p1] = l1, l0
+            l2p[l0], l2p[l1] = p1, p0
+
+        for idx in range(len(circ)):
+            op = circ.ops[idx]
+            qbs = [qb for qb in circ.qubits[idx] if qb>=0]
+            if op not in diagonal_ops and len(qbs)<=nb:
+                for qb in qbs:
+                    if l2p[qb]>=nb:
+                        # Evict the block qubit that is needed last
+                        cands = [p for p in range(nb) if p2l[p] not in qbs]
+                        far = max(cands, key=lambda p: next_use(p2l[p], idx))
+                        add_swap(far, l2p[qb])
+
+            ops.append(op)
+            qubits.append([l2p[qb] for qb in qbs])
+            params.append(circ.pbuf[circ.poffs[idx]:circ.poffs[idx+1]])
+
+        # Restore the original qubit order
+        for qb in range(nq):
+            if l2p[qb]!=qb:
+                add_swap(qb, l2p[qb])
+
+        width = max([2] + [len(q) for q in qubits])
+        qarr = np.zeros((len(ops), width), dtype=np.int64) - 1
+        for idx, q in enumerate(qubits):
+            qarr[idx,:len(q)] = q
+        poffs = np.zeros(len(ops)+1, dtype=np.int64)
+        poffs[1:] = np.cumsum([len(p) for p in params])
+        pbuf = np.concatenate([np.zeros(0, dtype=circ.pbuf.dtype)] + params)
+        out = circuit(ops, qarr, poffs, pbuf, dtype=circ.pbuf.dtype)
+
+        # Segment table: runs of in-block gates, and single out-of-block gates
+        segs = []
+        for idx in range(len(out)):
+            inblock = out.ops[idx] in diagonal_ops or all(q<nb for q in qubits[idx])
+            if inblock and len(segs)>0 and segs[-1][2]==1:
+                segs[-1][1] = idx + 1
+            else:
+                segs.append([idx, idx+1, int(inblock)])
+        segs = np.array(segs, dtype=np.int64).reshape(-1,3)
+
+        self.stats = {'gates': len(circ), 'swaps': len(out) - len(circ),
+            'sweeps': len(segs), 'eliminated': len(circ) - len(segs),
+            'unblocked': int(sum(op not in diagonal_ops and len(q)>nb\
+                for op, q in zip(ops, qubits)))}
+
+        return out, segs
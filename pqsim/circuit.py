@@ -0,0 +1,169 @@
+import numpy as np
+from .compiler import param_slots, pack_circ
+
+# Opcodes are positions in gatelut
+gatelut = ['h', 'u', 'cz', 'mod2qb', 'rz', 'diag', 'unitary', 'swap', 'cu', 'phase']
+
+def param_len(op, nqb):
+    '''
+    Number of complex entries of the parameter buffer used by a gate.
+    '''
+    if op==1 or op==3 or op==8: # u, mod2qb, cu
+        return 4
+    elif op==4 or op==9: # rz angle, phase factor
+        return 1
+    elif op==5: # diag
+        return 2**nqb
+    elif op==6: # unitary
+        return 4**nqb
+    return 0
+
+class circuit():
+    '''
+    Compiled, struct-of-arrays form of a circuit, consumed by the do_ops()
+    runner of each backend.
+        ops:    int8 array of opcodes (positions in gatelut).
+        qubits: Integer array of shape (ngates, width), padded with -1.
+        poffs:  Offsets into pbuf; gate i owns pbuf[poffs[i]:poffs[i+1]].
+        pbuf:   Contiguous complex buffer holding all gate parameters,
+                of the same precision (dtype) as the statevector.
+    '''
+    def __init__(self, ops, qubits, poffs, pbuf, dtype=complex):
+        self.ops = np.ascontiguousarray(ops, dtype=np.int8)
+        self.qubits = np.ascontiguousarray(qubits, dtype=np.int64)
+        self.poffs = np.ascontiguousarray(poffs, dtype=np.int64)
+        self.pbuf = np.ascontiguousarray(pbuf, dtype=dtype)
+
+    def __len__(self):
+        return len(self.ops)
+
+    def astype(self, dtype):
+        '''
+        Returns this circuit with parameters of the given precision
+        (np.complex64 or np.complex128).
+        '''
+        if self.pbuf.dtype==dtype:
+            return self
+        return circuit(self.ops, self.qubits, self.poffs, self.pbuf, dtype=dtype)
+
+    def inverse(self):
+        '''
+        Returns the inverse circuit: the gates in reverse order, each replaced
+        by its inverse. Parameters of u, cu and unitary gates are assumed
+        to be unitary, and are replaced by their conjugate transposes. The
+        entries of mod2qb, diag and phase gates are conjugated, so they must
+        have unit modulus; a ValueError is raised otherwise.
+        '''
+        owner = np.repeat(self.ops, np.diff(self.poffs))
+        diag = (owner==3) | (owner==5) | (owner==9)
+        if not np.allclose(np.abs(self.pbuf[diag]), 1):
+            raise ValueError("Only mod2qb, diag and phase gates with unit-modulus "\
+                "entries can be inverted.")
+
+        pbuf = self.pbuf.conj()
+
+        # rz angles change sign, and 2x2 and dense operators are transposed
+        sel = self.poffs[:-1][self.ops==4]
+        pbuf[sel] = -self.pbuf[sel]
+        sel = self.poffs[:-1][(self.ops==1) | (self.ops==8)]
+        pbuf[sel+1], pbuf[sel+2] = pbuf[sel+2], pbuf[sel+1]
+        for idx in np.nonzero(self.ops==6)[0]:
+            p = pbuf[self.poffs[idx]:self.poffs[idx+1]]
+            dim = int(np.sqrt(len(p)))
+            p[:] = p.reshape(dim,dim).T.reshape(-1)
+
+        order = np.arange(len(self.ops))[::-1]
+        plens = np.diff(self.poffs)[order]
+        poffs = np.zeros(len(order)+1, dtype=np.int64)
+        poffs[1:] = np.cumsum(plens)
+        gather = np.repeat(self.poffs[order] - poffs[:-1], plens) + np.arange(poffs[-1])
+        return circuit(self.ops[order], self.qubits[order], poffs, pbuf[gather],\
+            dtype=self.pbuf.dtype)
+
+    @classmethod
+    def from_lists(cls, names, qargs, parms):
+        '''
+        Convert the names, qargs and parms lists accepted by do_circ().
+        '''
+        names = np.asarray(names)
+        qargs = np.asarray(qargs, dtype=np.int64)
+        if len(names)==0:
+            qargs = np.zeros((0,2), dtype=np.int64)
+        parms = np.asarray(parms, dtype=complex).reshape(-1,2,2)
+
+        uniq, inv = np.unique(names, return_inverse=True)
+        for n in uniq:
+            if str(n) not in gatelut:
+                raise ValueError("Unknown gate: " + str(n))
+        ops = np.array([gatelut.index(str(n)) for n in uniq], dtype=np.int8)[inv]
+
+        nqbs = (qargs>=0).sum(axis=1)
+        plens = np.zeros(len(ops), dtype=np.int64)
+        slots = np.zeros(len(ops), dtype=np.int64)
+        for op in range(len(gatelut)):
+            sel = ops==op
+            for k in np.unique(nqbs[sel]):
+                plens[sel & (nqbs==k)] = param_len(op, k)
+                slots[sel & (nqbs==k)] = param_slots(gatelut[op], k)
+
+        poffs = np.zeros(len(ops)+1, dtype=np.int64)
+        poffs[1:] = np.cumsum(plens)
+        first_slot = np.cumsum(slots) - slots
+        pbuf = np.zeros(poffs[-1], dtype=complex)
+
+        # 2x2 parameters (u, mod2qb, cu)
+        sel = np.nonzero((ops==1) | (ops==3) | (ops==8))[0]
+        pbuf[poffs[sel][:,None] + np.arange(4)] = parms[first_slot[sel]].reshape(-1,4)
+
+        # rz angles and phase factors
+        sel = np.nonzero((ops==4) | (ops==9))[0]
+        pbuf[poffs[sel]] = parms[first_slot[sel],0,0]
+
+        # diag and unitary, which span several slots of parms
+        for idx in np.nonzero((ops==5) | (ops==6))[0]:
+            flat = parms[first_slot[idx]:first_slot[idx]+slots[idx]].reshape(-1)
+            pbuf[poffs[idx]:poffs[idx+1]] = flat[:plens[idx]]
+
+        return cls(ops, qargs, poffs, pbuf)
+
+    def to_lists(self):
+        '''
+        Convert back to the names, qargs and parms lists accepted by do_circ().
+        '''
+        gates = []
+        for idx, op in enumerate(self.ops):
+            qbs = tuple(int(qb) for qb in self.qubits[idx] if qb>=0)
+            p = self.pbuf[self.poffs[idx]:self.poffs[idx+1]]
+            data = None
+            nslot = param_slots(gatelut[op], len(qbs))
+            if nslot>0:
+                data = np.zeros(4*nslot, dtype=complex)
+                data[:len(p)] = p
+                data = data.reshape(nslot,2,2)
+            gates.append((gatelut[op], qbs, data))
+
+        return pack_circ(gates)
+
+def batch_params(names, qargs, parms):
+    '''
+    Compile a circuit whose parameters vary over a batch.
+    Args:
+        parms: Array of shape (batch, nparams, 2, 2); entry b holds
+               the parameters of the circuit for batch element b.
+    Returns the compiled circuit (holding the parameters of batch element 0)
+    and an array of shape (batch, len(pbuf)) with one pbuf per batch element.
+    '''
+    parms = np.asarray(parms, dtype=complex)
+    batch = len(parms)
+    flat = parms.reshape(batch, -1)
+
+    # Compile once with parameters replaced by their own flat index,
+    # which tells us where each pbuf entry is taken from.
+    index = np.arange(flat.shape[1]).reshape(-1,2,2)
+    circ = circuit.from_lists(names, qargs, index)
+    src = circ.pbuf.real.astype(np.int64)
+
+    pbufs = np.ascontiguousarray(flat[:,src])
+    circ.pbuf = pbufs[0].copy()
+
+    return circ, pbufs
@@ -0,0 +1,288 @@
+import numpy as np
+
+def param_slots(name, nqb):
+    '''
+    Number of 2x2 entries of parms consumed by a gate.
+    Larger operators are packed into consecutive 2x2 entries.
+    '''
+    if name in ['u', 'mod2qb', 'rz', 'cu', 'phase']:
+        return 1
+    elif name=='diag':
+        return max(1, 2**nqb//4)
+    elif name=='unitary':
+        return 4**(nqb-1)
+    return 0
+
+def unpack_circ(names, qargs, parms):
+    '''
+    Splits the names, qargs and parms lists into a list of gates.
+    Each gate is a tuple (name, qubits, data), where data holds the
+    slice of parms belonging to the gate (None for h and cz).
+    '''
+    gates = []
+    idx_parm = 0
+    for idx, n in enumerate(names):
+        n = str(n)
+        qbs = tuple(int(qb) for qb in qargs[idx] if qb>=0)
+        nslot = param_slots(n, len(qbs))
+        data = None
+        if nslot>0:
+            data = np.array(parms[idx_parm:idx_parm+nslot])
+            idx_parm += nslot
+        gates.append((n, qbs, data))
+
+    return gates
+
+def pack_circ(gates):
+    '''
+    Inverse of unpack_circ(). Builds the names, qargs and parms
+    lists that are passed to do_circ().
+    '''
+    width = max([2] + [len(g[1]) for g in gates])
+    names = np.array([g[0] for g in gates], dtype=str)
+    qargs = np.zeros((len(gates), width), dtype=int) - 1
+    plist = []
+    for idx, (n, qbs, data) in enumerate(gates):
+        qargs[idx,:len(qbs)] = qbs
+        if data is not None:
+            plist.append(data.reshape(-1,2,2))
+
+    if len(plist)>0:
+        parms = np.concatenate(plist).astype(complex)
+    else:
+        parms = np.zeros((0,2,2), dtype=complex)
+
+    return names, qargs, parms
+
+def gate_matrix(name, qbs, data):
+    '''
+    Returns the operator of a gate. Diagonal gates return only the
+    diagonal, indexed little-endian over qbs (as in modulate_diag()).
+    '''
+    if name=='h':
+        return np.array([[1,1],[1,-1]], dtype=complex)/np.sqrt(2.)
+    elif name=='u':
+        return data[0].astype(complex)
+    elif name=='cz':
+        return np.array([1,1,1,-1], dtype=complex)
+    elif name=='mod2qb':
+        return data[0].reshape(4).astype(complex)
+    elif name=='rz':
+        theta = data[0,0,0].real
+        return np.array([np.exp(-0.5j*theta), np.exp(0.5j*theta)])
+    elif name=='diag':
+        return data.reshape(-1)[:2**len(qbs)].astype(complex)
+    elif name=='unitary':
+        dim = 2**len(qbs)
+        return data.reshape(dim,dim).astype(complex)
+    elif name=='swap':
+        return np.eye(4, dtype=complex)[[0,2,1,3]]
+    elif name=='cu':
+        # Controls are qbs[:-1], the target is qbs[-1]
+        dim = 2**len(qbs)
+        full = np.eye(dim, dtype=complex)
+        on = dim//2 - 1
+        full[on::dim//2, on::dim//2] = data[0]
+        return full
+    elif name=='phase':
+        diag = np.ones(2**len(qbs), dtype=complex)
+        diag[-1] = data[0,0,0]
+        return diag
+    raise ValueError("Unknown gate: " + name)
+
+def pack_diag(qbs, diag):
+    '''
+    Builds a gate (name, qubits, data) for a diagonal operator.
+    '''
+    if len(qbs)==2:
+        return ('mod2qb', qbs, diag.reshape(1,2,2))
+
+    nslot = max(1, len(diag)//4)
+    data = np.zeros(4*nslot, dtype=complex)
+    data[:len(diag)] = diag
+    return ('diag', qbs, data.reshape(nslot,2,2))
+
+def expand_diag(qbs, diag, new_qbs):
+    '''
+    Re-index a diagonal over qbs onto the (larger) qubit list new_qbs.
+    '''
+    states = np.arange(2**len(new_qbs))
+    idx = np.zeros(len(states), dtype=int)
+    for j, qb in enumerate(qbs):
+        idx += ((states >> new_qbs.index(qb)) & 1) << j
+    return diag[idx]
+
+def embed(op, qbs, block_qbs):
+    '''
+    Expand a gate operator on qbs to a dense operator on block_qbs.
+    '''
+    m = len(block_qbs)
+    dim = 2**m
+    if op.ndim==1:
+        return np.diag(expand_diag(qbs, op, block_qbs))
+
+    # Apply op to each column of the identity. Tensor axes are
+    # big-endian, so qubit position j is axis m-1-j.
+    k = len(qbs)
+    cols = np.eye(dim, dtype=complex).reshape((2,)*m + (dim,))
+    axes = [m-1-block_qbs.index(qb) for qb in qbs]
+    op_t = op.reshape((2,)*(2*k))
+    # Axes of op_t are big-endian too: (out_{k-1},...,out_0,in_{k-1},...,in_0)
+    in_axes = list(range(2*k-1, k-1, -1))
+    out = np.tensordot(op_t, cols, axes=(in_axes, axes))
+    out = np.moveaxis(out, list(range(k-1, -1, -1)), axes)
+    return out.reshape(dim, dim)
+
+class fuser():
+    '''
+    Gate-fusion pass. Consecutive 1-qubit gates acting on the same qubit
+    are multiplied into a single 2x2 operator, and diagonal gates are
+    folded into a single diagonal operator, so that each fused group
+    costs one sweep over the statevector instead of one per gate.
+    '''
+    def __init__(self, max_qubits=1, max_diag=8):
+        '''
+        Args:
+            max_qubits: If 2 or more, additionally fuse runs of gates touching
+                        at most this many qubits into one dense operator.
+            max_diag:   Maximum number of qubits in a fused diagonal operator.
+        '''
+        self.max_qubits = max_qubits
+        self.max_diag = max_diag
+        self.stats = {}
+
+    def run(self, names, qargs, parms):
+        '''
+        Fuse a circuit given as names, qargs and parms, and return the
+        fused circuit in the same form. Counts are left in self.stats.
+        '''
+        gates = unpack_circ(names, qargs, parms)
+        fused = self.fuse_local(gates)
+        if self.max_qubits>=2:
+            fused = self.fuse_blocks(fused)
+
+        self.stats = {'gates': len(gates), 'sweeps': len(fused),
+            'eliminated': len(gates) - len(fused)}
+
+        return pack_circ(fused)
+
+    def fuse_local(self, gates):
+        '''
+        Fuse 1-qubit gate runs and diagonal gate runs.
+        '''
+        out = []
+        pending = {} # qubit -> [operator, first gate, count]
+        diag_qbs = []
+        diag = np.ones(1, dtype=complex)
+        diag_gates = []
+
+        def flush_diag():
+            nonlocal diag_qbs, diag, diag_gates
+            if len(diag_gates)==1:
+                out.append(diag_gates[0])
+            elif len(diag_gates)>1:
+                out.append(pack_diag(tuple(diag_qbs), diag))
+            diag_qbs = []
+            diag = np.ones(1, dtype=complex)
+            diag_gates = []
+
+        def flush_1qb(qb):
+            op, first, count = pending.pop(qb)
+            if count==1:
+                out.append(first)
+            else:
+                out.append(('u', (qb,), op.reshape(1,2,2)))
+
+        def fold_diag(gate, op):
+            nonlocal diag_qbs, diag
+            qbs = gate[1]
+            new_qbs = diag_qbs + [qb for qb in qbs if qb not in diag_qbs]
+            if len(new_qbs)>self.max_diag:
+                flush_diag()
+                new_qbs = list(qbs)
+            diag = expand_diag(diag_qbs, diag, new_qbs)*expand_diag(list(qbs), op, new_qbs)
+            diag_qbs = new_qbs
+            diag_gates.append(gate)
+
+        for gate in gates:
+            name, qbs, data = gate
+            op = gate_matrix(name, qbs, data)
+
+            if len(qbs)==1 and (op.ndim==2 or qbs[0] in pending):
+                qb = qbs[0]
+                if op.ndim==1:
+                    op = np.diag(op)
+                if qb in diag_qbs:
+                    flush_diag()
+                if qb in pending:
+                    pending[qb][0] = op @ pending[qb][0]
+                    pending[qb][2] += 1
+                else:
+                    pending[qb] = [op, gate, 1]
+
+            elif op.ndim==1:
+                for qb in qbs:
+                    if qb in pending:
+                        pop = pending[qb][0]
+                        if pop[0,1]==0 and pop[1,0]==0:
+                            # A pending diagonal 1-qubit operator joins the diagonal
+                            op1, first, count = pending.pop(qb)
+                            if count>1:
+                                first = ('u', (qb,), op1.reshape(1,2,2))
+                            fold_diag(first, np.diag(op1))
+                        else:
+                            flush_1qb(qb)
+                fold_diag(gate, op)
+
+            else:
+                for qb in qbs:
+                    if qb in pending:
+                        flush_1qb(qb)
+                if any(qb in diag_qbs for qb in qbs):
+                    flush_diag()
+                out.append(gate)
+
+        flush_diag()
+        for qb in list(pending.keys()):
+            flush_1qb(qb)
+
+        return out
+
+    def fuse_blocks(self, gates):
+        '''
+        Greedily fuse runs of consecutive gates touching at most
+        max_qubits qubits into one dense operator.
+        '''
+        out = []
+        block = []
+        block_qbs = []
+
+        def flush():
+            if len(block)==1:
+                out.append(block[0])
+            elif len(block)>1:
+                ops = [gate_matrix(*g) for g in block]
+                if all(op.ndim==1 for op in ops):
+                    diag = np.ones(2**len(block_qbs), dtype=complex)
+                    for g, op in zip(block, ops):
+                        diag *= expand_diag(list(g[1]), op, block_qbs)
+                    out.append(pack_diag(tuple(block_qbs), diag))
+                else:
+                    dim = 2**len(block_qbs)
+                    full = np.eye(dim, dtype=complex)
+                    for g, op in zip(block, ops):
+                        full = embed(op, list(g[1]), block_qbs) @ full
+                    out.append(('unitary', tuple(block_qbs), full.reshape(-1,2,2)))
+
+        for gate in gates:
+            new_qbs = block_qbs + [qb for qb in gate[1] if qb not in block_qbs]
+            if len(new_qbs)>self.max_qubits:
+                flush()
+                block = []
+                new_qbs = list(gate[1])
+            block.append(gate)
+            block_qbs = new_qbs
+
+        flush()
+
+        return out
@@ -0,0 +1,372 @@
+import os
+import weakref
+import traceback
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from multiprocessing.connection import Listener, Client, wait
+from numba import njit
+from . import numbaQC
+from .circuit import circuit
+from .blocking import blocker
+
+@njit(cache=True)
+def gather_half(nl, qb, bit, vec):
+    '''
+    Copy out the half of vec, an nl-qubit slice, where qubit qb equals bit.
+    '''
+    stripe = 2**qb
+    out = np.empty(2**(nl-1), dtype=vec.dtype)
+    for i in range(2**(nl-1)):
+        low = i % stripe
+        out[i] = vec[(i - low)*2 + low + bit*stripe]
+    return out
+
+@njit(cache=True)
+def scatter_half(nl, qb, bit, vec, data):
+    '''
+    Inverse of gather_half(): overwrite the half of vec where qubit qb equals bit.
+    '''
+    stripe = 2**qb
+    for i in range(2**(nl-1)):
+        low = i % stripe
+        vec[(i - low)*2 + low + bit*stripe] = data[i]
+
+class shm_transport():
+    '''
+    Exchanges between workers on one node. Every slice lives in shared memory,
+    so one worker of a pair can swap amplitudes in both slices directly.
+    '''
+    def __init__(self, rank, names, nl, dtype):
+        self.shms = [shared_memory.SharedMemory(name=name) for name in names]
+        self.slices = [np.ndarray(2**nl, dtype=dtype, buffer=shm.buf) for shm in self.shms]
+        self.vec = self.slices[rank]
+
+    def exchange_half(self, rank, partner, nl, qb):
+        # The member of the pair with the lower rank does the work
+        if rank<partner:
+            mine = self.vec
+            theirs = self.slices[partner]
+            temp = gather_half(nl, qb, 1, mine)
+            scatter_half(nl, qb, 1, mine, gather_half(nl, qb, 0, theirs))
+            scatter_half(nl, qb, 0, theirs, temp)
+
+    def exchange_all(self, rank, partner):
+        if rank<partner:
+            temp = self.vec.copy()
+            self.vec[:] = self.slices[partner]
+            self.slices[partner][:] = temp
+
+    def close(self):
+        self.vec = None
+        self.slices = []
+        for shm in self.shms:
+            shm.close()
+
+class socket_transport():
+    '''
+    Stand-in for exchanges between nodes. Every worker keeps its slice in
+    private memory, and amplitudes are sent to the partner over a socket.
+    '''
+    def __init__(self, rank, listener, addresses, authkey, nl, dtype):
+        self.vec = np.zeros(2**nl, dtype=dtype)
+        self.listener = listener
+        self.addresses = addresses
+        self.authkey = authkey
+        self.conns = {}
+
+    def connect(self, rank, partner):
+        # The lower rank dials, the higher rank accepts
+        if partner not in self.conns:
+            if rank<partner:
+                self.conns[partner] = Client(self.addresses[partner], authkey=self.authkey)
+            else:
+                self.conns[partner] = self.listener.accept()
+        return self.conns[partner]
+
+    def send_recv(self, rank, partner, data):
+        conn = self.connect(rank, partner)
+        if rank<partner:
+            conn.send_bytes(data)
+            out = conn.recv_bytes()
+        else:
+            out = conn.recv_bytes()
+            conn.send_bytes(data)
+        return np.frombuffer(out, dtype=self.vec.dtype)
+
+    def exchange_half(self, rank, partner, nl, qb):
+        # The lower rank gives away its qb=1 half, the higher rank its qb=0 half
+        bit = 1 if rank<partner else 0
+        data = self.send_recv(rank, partner, gather_half(nl, qb, bit, self.vec).tobytes())
+        scatter_half(nl, qb, bit, self.vec, data)
+
+    def exchange_all(self, rank, partner):
+        self.vec[:] = self.send_recv(rank, partner, self.vec.tobytes())
+
+    def close(self):
+        for conn in self.conns.values():
+            conn.close()
+        self.listener.close()
+
+def worker(rank, nl, dtype, kind, shm_names, conn, barrier):
+    '''
+    Main loop of a worker process, owning slice "rank" of the statevector.
+    Every request is answered with ('done', result), or with ('error', traceback)
+    if it raised. The barrier is then aborted, so that the other workers do not
+    wait for this one forever.
+    '''
+    if kind=='shm':
+        tp = shm_transport(rank, shm_names, nl, dtype)
+    else:
+        authkey = conn.recv()
+        listener = Listener(('localhost', 0), authkey=authkey)
+        conn.send(('done', listener.address))
+        tp = socket_transport(rank, listener, conn.recv(), authkey, nl, dtype)
+
+    while True:
+        msg = conn.recv()
+        out = None
+        try:
+            if msg[0]=='run':
+                ops, qubits, poffs, pbuf, segs = msg[1:]
+                for start, stop, inblock in segs:
+                    if inblock:
+                        numbaQC.do_ops_chunk(nl, rank*2**nl, ops[start:stop],\
+                            qubits[start:stop], poffs[start:stop+1], pbuf, tp.vec)
+                    else:
+                        for idx in range(start, stop):
+                            barrier.wait()
+                            exchange(tp, rank, nl, qubits[idx])
+                            barrier.wait()
+            elif msg[0]=='get':
+                out = tp.vec.tobytes()
+            elif msg[0]=='set':
+                tp.vec[:] = np.frombuffer(conn.recv_bytes(), dtype=dtype)
+            elif msg[0]=='stop':
+                tp.close()
+        except Exception:
+            barrier.abort()
+            conn.send(('error', traceback.format_exc()))
+            continue
+        conn.send(('done', out))
+        if msg[0]=='stop':
+            break
+
+def exchange(tp, rank, nl, qargs):
+    '''
+    Carry out a swap of two qubits, at least one of which is global.
+    '''
+    q0, q1 = max(qargs[0], qargs[1]), min(qargs[0], qargs[1])
+    if q1<nl:
+        # Global-local swap: pairs differing in the global bit trade halves
+        partner = rank ^ (1 << (q0-nl))
+        tp.exchange_half(rank, partner, nl, q1)
+    else:
+        # Global-global swap: slices move between ranks
+        b0 = (rank >> (q0-nl)) & 1
+        b1 = (rank >> (q1-nl)) & 1
+        if b0!=b1:
+            partner = rank ^ (1 << (q0-nl)) ^ (1 << (q1-nl))
+            tp.exchange_all(rank, partner)
+
+def release(procs, conns, shms):
+    '''
+    Stop the workers of a distributed statevector, and release its shared
+    memory. Workers that do not stop within a few seconds are terminated.
+    '''
+    for conn in conns:
+        try:
+            conn.send(('stop',))
+        except (OSError, ValueError):
+            pass
+    for proc in procs:
+        proc.join(timeout=5)
+        if proc.is_alive():
+            proc.terminate()
+            proc.join()
+    for conn in conns:
+        conn.close()
+    for shm in shms:
+        shm.close()
+        shm.unlink()
+
+class distributed():
+    '''
+    Distributed statevector, split into 2**global_qubits slices owned by
+    worker processes. The top global_qubits qubits select the slice and
+    are "global"; the rest are local to each worker.
+
+    Gates on local qubits, and diagonal gates on any qubit, are applied by
+    all workers in parallel. A non-diagonal gate on a global qubit is
+    preceded by a swap that brings the qubit into the local range (planned
+    as in blocking.py); the swap is carried out by pairwise exchange of
+    half-slices between workers. The qubit order is restored at the end
+    of each run.
+
+    Workers are spawned rather than forked: a process forked after Numba's
+    thread pool has started may hang. Scripts therefore need the usual
+    "if __name__=='__main__':" guard. Workers and shared memory are released
+    by close(), or else when the object is garbage collected or at exit.
+    An exception in a worker is raised in the parent as a RuntimeError,
+    after which the engine is closed.
+    '''
+    def __init__(self, nq, global_qubits=2, transport='shm', dtype=complex):
+        '''
+        Args:
+            nq:            Number of qubits of the statevector.
+            global_qubits: The statevector is split over 2**global_qubits workers.
+            transport:     'shm' for shared memory on one node, or 'socket' for
+                           a socket-based exchange standing in for multiple nodes.
+        '''
+        self.nq = nq
+        self.nl = nq - global_qubits
+        self.nworkers = 2**global_qubits
+        self.dtype = np.dtype(dtype)
+        self.transport = transport
+        self.stats = {}
+
+        # Compile worker kernels once, so that workers load them from the cache
+        empty = circuit([], np.zeros((0,2)), [0], [], dtype=self.dtype)
+        numbaQC.do_ops_chunk(1, 0, empty.ops, empty.qubits, empty.poffs,\
+            empty.pbuf, np.zeros(2, dtype=self.dtype))
+        scatter_half(1, 0, 0, np.zeros(2, dtype=self.dtype),\
+            gather_half(1, 0, 0, np.zeros(2, dtype=self.dtype)))
+
+        self.shms = []
+        if transport=='shm':
+            nbytes = 2**self.nl * self.dtype.itemsize
+            self.shms = [shared_memory.SharedMemory(create=True, size=nbytes)\
+                for r in range(self.nworkers)]
+        names = [shm.name for shm in self.shms]
+
+        ctx = mp.get_context('spawn')
+        barrier = ctx.Barrier(self.nworkers)
+        self.conns = []
+        self.procs = []
+        for rank in range(self.nworkers):
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(target=worker, daemon=True,\
+                args=(rank, self.nl, self.dtype, transport, names, child, barrier))
+            proc.start()
+            self.conns.append(parent)
+            self.procs.append(proc)
+        self.finalizer = weakref.finalize(self, release, self.procs, self.conns, self.shms)
+
+        if transport=='socket':
+            authkey = os.urandom(16)
+            for rank in range(self.nworkers):
+                self.post(rank, authkey)
+            addresses = self.replies()
+            for rank in range(self.nworkers):
+                self.post(rank, addresses)
+
+        self.reset()
+
+    def run(self, names, qargs, parms):
+        '''
+        Apply a circuit to the distributed statevector.
+        '''
+        circ = circuit.from_lists(names, qargs, parms).astype(self.dtype)
+        bl = blocker(block_qubits=self.nl)
+        circ, segs = bl.run(self.nq, circ)
+        self.stats = bl.stats
+        if self.stats['unblocked']>0:
+            raise ValueError("Non-diagonal gates may act on at most " + str(self.nl)\
+                + " qubits, the number of local qubits of each worker.")
+
+        for rank in range(self.nworkers):
+            self.post(rank, ('run', circ.ops, circ.qubits, circ.poffs, circ.pbuf, segs))
+        self.replies()
+
+    def post(self, rank, msg, data=None):
+        '''
+        Send a request, and optionally a buffer of bytes, to a worker.
+        '''
+        try:
+            self.conns[rank].send(msg)
+            if data is not None:
+                self.conns[rank].send_bytes(data)
+        except OSError:
+            self.failed(rank)
+
+    def replies(self):
+        '''
+        Collect one reply from every worker, in rank order. If a worker
+        reports an error or exits, the engine is closed and RuntimeError raised.
+        '''
+        out = [None]*self.nworkers
+        pending = dict(zip(self.conns, range(self.nworkers)))
+        while pending:
+            for conn in wait(list(pending), timeout=1.):
+                rank = pending.pop(conn)
+                try:
+                    status, res = conn.recv()
+                except (EOFError, OSError):
+                    self.failed(rank)
+                if status=='error':
+                    self.abort()
+                    raise RuntimeError("Worker " + str(rank) + " failed:\n" + res)
+                out[rank] = res
+            for conn, rank in pending.items():
+                if not self.procs[rank].is_alive():
+                    self.failed(rank)
+        return out
+
+    def failed(self, rank):
+        '''
+        Close the engine after worker "rank" exited, and raise RuntimeError.
+        '''
+        self.procs[rank].join(timeout=1)
+        code = self.procs[rank].exitcode
+        self.abort()
+        raise RuntimeError("Worker " + str(rank) + " exited with code " + str(code) + ".")
+
+    def abort(self):
+        '''
+        Terminate the workers, whose state is lost, and close the engine.
+        '''
+        for proc in self.procs:
+            proc.terminate()
+        self.close()
+
+    def set_state(self, vec):
+        '''
+        Scatter a full statevector to the workers.
+        '''
+        vec = np.asarray(vec, dtype=self.dtype)
+        size = 2**self.nl
+        for rank in range(self.nworkers):
+            self.post(rank, ('set',), vec[rank*size:(rank+1)*size].tobytes())
+        self.replies()
+
+    def get_state(self):
+        '''
+        Gather the full statevector from the workers.
+        '''
+        if len(self.shms)>0:
+            return np.concatenate([np.ndarray(2**self.nl, dtype=self.dtype,\
+                buffer=shm.buf) for shm in self.shms])
+
+        for rank in range(self.nworkers):
+            self.post(rank, ('get',))
+        return np.concatenate([np.frombuffer(data, dtype=self.dtype)\
+            for data in self.replies()])
+
+    def reset(self):
+        '''
+        Put the statevector in the zero state.
+        '''
+        vec = np.zeros(2**self.nl, dtype=self.dtype)
+        for rank in range(self.nworkers):
+            vec[0] = 1. if rank==0 else 0.
+            self.post(rank, ('set',), vec.tobytes())
+        self.replies()
+
+    def close(self):
+        '''
+        Stop the workers and release shared memory.
+        '''
+        self.finalizer()
+        self.conns = []
+        self.procs = []
+        self.shms = []
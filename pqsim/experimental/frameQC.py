@@ -0,0 +1,194 @@
+# gatelut = ['h','cx','cz','x','y','z','s','sdg'], as in stabilizerQC.py
+from numba import njit, prange
+import numpy as np
+
+# Each uint64 word holds one bit for each of 64 shots
+word_bits = 64
+all_ones = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+@njit(cache=True)
+def condition_mask(cw, condval, contype, conbits):
+    '''
+    Bit-packed check_condition() of stabilizerQC.py: returns a word whose
+    bit s is set if the gate is to be applied in shot s.
+    Args:
+        cw: Classical bits of 64 shots, one word per classical bit.
+    '''
+    if contype==0:
+        return all_ones
+
+    # Shots where the controlling bits read condval
+    eq = all_ones
+    for idx in range(len(conbits)):
+        if (condval >> idx) & 1:
+            eq &= cw[conbits[idx]]
+        else:
+            eq &= ~cw[conbits[idx]]
+    if (condval >> len(conbits))!=0:
+        eq = np.uint64(0)
+
+    if contype==1:
+        return eq
+    elif contype==2:
+        return ~eq
+    return np.uint64(0)
+
+@njit(cache=True)
+def frame_commute(xw, zw, op, qargs, m, paulimode=0):
+    '''
+    Bit-packed pauli_commute() of stabilizerQC.py: propagates the Pauli
+    frames of 64 shots, held as X bits xw and Z bits zw per qubit,
+    through Clifford "op". Only shots whose bit is set in m are updated.
+    Global phases are not tracked.
+    '''
+    if op==0: # h
+        qb = qargs[0]
+        flip = (xw[qb] ^ zw[qb]) & m
+        xw[qb] ^= flip
+        zw[qb] ^= flip
+
+    elif op==1: # cx
+        src = qargs[0]
+        trg = qargs[1]
+        xs = xw[src]
+        zt = zw[trg]
+        xw[trg] ^= xs & m
+        zw[src] ^= zt & m
+
+    elif op==2: # cz
+        src = qargs[0]
+        trg = qargs[1]
+        xs = xw[src]
+        xt = xw[trg]
+        zw[trg] ^= xs & m
+        zw[src] ^= xt & m
+
+    elif op==3 or op==4 or op==5: # x, y, z
+        # Cancelled against the frame only in paulimode 1
+        if paulimode==1:
+            if op==3 or op==4:
+                xw[qargs[0]] ^= m
+            if op==4 or op==5:
+                zw[qargs[0]] ^= m
+
+    elif op==6 or op==7: # s, sdg
+        zw[qargs[0]] ^= xw[qargs[0]] & m
+
+@njit(cache=True)
+def propagate_word(w, shots, xw, zw, cw, noisearrays, opnames, noiseid,\
+    condval, contype, conbits, opqargs, opcargs, paulimode=0):
+    '''
+    Bit-packed propagate() of stabilizerQC.py for shots 64*w to 64*w+63,
+    starting from the frames in xw, zw and classical bits in cw.
+    Args:
+        shots: Total number of shots, the length of noisearrays.
+    Other arguments are as in propagate().
+    '''
+    first = w*word_bits
+    nlanes = min(word_bits, shots - first)
+    valid = all_ones >> np.uint64(word_bits - nlanes)
+    idx_noise = 0
+
+    for idx in range(len(opnames)):
+        name = opnames[idx]
+        if name<9:
+            m = condition_mask(cw, condval[idx], contype[idx], conbits[idx])
+            frame_commute(xw, zw, name, opqargs[idx], m, paulimode)
+
+        elif name==9: # measure
+            cw[opcargs[idx][0]] = xw[opqargs[idx][0]]
+            xw[opqargs[idx][0]] = 0
+            zw[opqargs[idx][0]] = 0
+
+        elif name==10: # check
+            qb = opqargs[idx][0]
+            for pterm in conbits[idx]: # Fail if a frame term is one of conbits
+                xm = xw[qb] if pterm & 1 else ~xw[qb]
+                zm = zw[qb] if (pterm >> 1) & 1 else ~zw[qb]
+                if xm & zm & valid:
+                    raise Exception("Does not commute!")
+
+        if noiseid[idx]:
+            # Pack the Pauli error of each shot into words, one qubit at a time
+            for lane in range(nlanes):
+                p = noisearrays[first + lane, idx_noise]
+                bit = np.uint64(1) << np.uint64(lane)
+                idx_char = 0
+                while p>0 and idx_char<opqargs.shape[1]:
+                    qb = opqargs[idx,idx_char]
+                    if p & 1:
+                        xw[qb] ^= bit
+                    if p & 2:
+                        zw[qb] ^= bit
+                    p = p >> 2
+                    idx_char += 1
+            idx_noise = idx_noise + 1
+
+@njit(parallel=True, cache=True)
+def propagate_frames(qlen, clen, noisearrays,\
+    opnames, noiseid, condval, contype, conbits, opqargs, opcargs, paulimode=0):
+    '''
+    Bit-packed propagate_all_samples() of stabilizerQC.py. Pauli frames
+    and classical bits are stored as bit planes, with 64 shots per uint64
+    word, so that every gate is applied to 64 shots at once with bitwise
+    operations. Groups of 64 shots are processed in parallel.
+    Returns packed arrays xs, zs of shape (words, qlen) and cs of shape
+    (words, clen); bit s of word w belongs to shot 64*w+s. The X bit of
+    qubit q is pvec[q]%2 and the Z bit pvec[q]//2, as in stabilizerQC.py.
+    See unpack_frames() for the pvecs and carrs of propagate_all_samples().
+    '''
+    shots = len(noisearrays)
+    nwords = (shots + word_bits - 1)//word_bits
+    xs = np.zeros((nwords, qlen), dtype=np.uint64)
+    zs = np.zeros((nwords, qlen), dtype=np.uint64)
+    cs = np.zeros((nwords, clen), dtype=np.uint64)
+
+    for w in prange(nwords):
+        propagate_word(w, shots, xs[w], zs[w], cs[w], noisearrays, opnames,\
+            noiseid, condval, contype, conbits, opqargs, opcargs, paulimode)
+
+    return xs, zs, cs
+
+@njit(parallel=True, cache=True)
+def unpack_bits(words, shots):
+    '''
+    Unpack bit planes of shape (words, n) into an int16 array of shape (shots, n).
+    '''
+    out = np.zeros((shots, words.shape[1]), dtype=np.int16)
+    for s in prange(shots):
+        w = s//word_bits
+        lane = np.uint64(s % word_bits)
+        for j in range(words.shape[1]):
+            out[s,j] = (words[w,j] >> lane) & np.uint64(1)
+    return out
+
+def unpack_frames(xs, zs, cs, shots):
+    '''
+    Convert the output of propagate_frames() to the pvecs and carrs
+    arrays returned by propagate_all_samples().
+    '''
+    pvecs = unpack_bits(xs, shots) + 2*unpack_bits(zs, shots)
+    return pvecs, unpack_bits(cs, shots)
+
+@njit(cache=True)
+def popcount(x):
+    '''
+    Number of set bits of a uint64 word.
+    '''
+    x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return (x*np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+@njit(parallel=True, cache=True)
+def count_ones(words):
+    '''
+    Number of shots in which each bit of packed planes (words, n) is set,
+    e.g. the number of shots flipping each measurement.
+    '''
+    n = words.shape[1]
+    out = np.zeros(n, dtype=np.int64)
+    for j in prange(n):
+        for w in range(len(words)):
+            out[j] += popcount(words[w,j])
+    return out
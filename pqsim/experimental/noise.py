@@ -1,25 +1,276 @@
 import numpy as np
 
 class noise():
-    def __init__(self, count, cardinality, shots):
+    def __init__(self, count, cardinality, shots, probs=None, chunk=2**16, seed=None):
         '''
-        Instantiates a noise class.
+        Instantiates a noise class. Samples are drawn in chunks of shots,
+        so that shots need not be held in memory all at once.
         Args:
             count: Number of noise channels to implement.
             cardinality: A list of cardinalities of the kraus set defining each noise channel.
             shots: Number of shots over which to simulate the noisy channels.
+            probs: Optional list of probability vectors, one per channel; entry k of
+                   probs[i] is the probability of kraus operator k of channel i.
+                   Defaults to uniform probabilities.
+            chunk: Number of shots drawn at a time.
+            seed:  Seed of the random number generator. If None, a seed is drawn
+                   once here, so that every pass over the samples (entropy,
+                   stats, propagate(), ...) sees the same shots.
         '''
-        card_max = np.max(cardinality)
-        self.entropy = np.random.randint(0,card_max+1,size=(shots,count))
-        self.entropy = np.mod(self.entropy, cardinality)
+        self.count = count
+        self.cardinality = np.broadcast_to(np.asarray(cardinality, dtype=np.int64), (count,))
+        self.shots = shots
+        self.chunk = chunk
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+        self.seed = seed
+        self.samples = None
 
-        self.stats = {}
-        for idx in range(shots):
-            str_temp = ''
-            for val in self.entropy[idx]:
-                str_temp = str_temp + str(val)
+        if probs is None:
+            probs = [np.ones(c)/c for c in self.cardinality]
+        self.probs = [np.asarray(p, dtype=float) for p in probs]
+        for p, c in zip(self.probs, self.cardinality):
+            if len(p)!=c or abs(p.sum() - 1)>1e-9:
+                raise ValueError("Each probability vector must have one entry per kraus "\
+                    "operator, and sum to 1.")
 
-            if str_temp in self.stats.keys():
-                self.stats[str_temp] += 1
+        # Inner cumulative probabilities, one row per channel, padded with inf
+        self.cdf = np.full((count, max(1, np.max(self.cardinality) - 1)), np.inf)
+        for i, p in enumerate(self.probs):
+            self.cdf[i,:len(p)-1] = np.cumsum(p)[:-1]
+
+        # For sparse sampling (kraus index 0 being the identity): the
+        # probability of an error per channel, and inner cumulative
+        # probabilities of the non-identity indices given an error
+        self.perr = np.array([1 - p[0] for p in self.probs])
+        self.ecdf = np.full((count, max(1, np.max(self.cardinality) - 2)), np.inf)
+        for i, p in enumerate(self.probs):
+            if len(p)>2 and self.perr[i]>0:
+                self.ecdf[i,:len(p)-2] = np.cumsum(p[1:])[:-1]/self.perr[i]
+
+        # Bits of the packed integer key taken by each channel
+        self.key_bits = np.ceil(np.log2(np.maximum(self.cardinality, 2))).astype(np.int64)
+
+    def sample(self, n, rng):
+        '''
+        Draw the kraus indices of n shots, an array of shape (n, count).
+        '''
+        # The index is the number of inner cumulative probabilities below u
+        u = rng.random((n, self.count))
+        idx = np.zeros((n, self.count), dtype=np.min_scalar_type(self.cdf.shape[1]))
+        for k in range(self.cdf.shape[1]):
+            idx += u>=self.cdf[:,k]
+        return idx.astype(np.int64)
+
+    def chunks(self):
+        '''
+        Iterate over arrays of kraus indices of shape (shots in chunk, count),
+        covering all shots. Every pass over the chunks yields the same samples.
+        '''
+        rng = np.random.default_rng(self.seed)
+        for start in range(0, self.shots, self.chunk):
+            yield self.sample(min(self.chunk, self.shots - start), rng)
+
+    def sample_sparse(self, n, rng):
+        '''
+        Draw the non-identity kraus indices of n shots, by geometric skipping:
+        the gaps between errors over the (n, count) grid of shots and channels
+        are drawn directly, at the largest error probability of any channel,
+        and errors are then kept with probability perr[i]/perr.max() for
+        channel i. The work done scales with the number of errors.
+        Returns arrays of the shot, channel and kraus index of each error.
+        '''
+        qmax = self.perr.max()
+        cells = n*self.count
+        if qmax<=0:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty
+
+        pos = np.zeros(0, dtype=np.int64)
+        last = -1
+        while last<cells:
+            expect = (cells - last)*qmax
+            gaps = rng.geometric(qmax, size=int(expect + 5*np.sqrt(expect) + 16))
+            new = last + np.cumsum(gaps)
+            pos = np.concatenate([pos, new])
+            last = new[-1]
+        pos = pos[pos<cells]
+
+        shot = pos//self.count
+        channel = pos % self.count
+        keep = rng.random(len(pos))*qmax<self.perr[channel]
+        shot = shot[keep]
+        channel = channel[keep]
+
+        u = rng.random(len(channel))
+        kraus = np.ones(len(channel), dtype=np.int64)
+        for k in range(self.ecdf.shape[1]):
+            kraus += u>=self.ecdf[channel,k]
+
+        return shot, channel, kraus
+
+    def sparse_chunks(self):
+        '''
+        Like chunks(), but sampling sparsely (see sample_sparse()), which
+        assumes kraus index 0 of every channel is the identity. Yields the
+        number of shots in a chunk, and the shot (within the chunk), channel
+        and kraus index of each error. The samples are distributed as those
+        of chunks(), but are not the same samples.
+        '''
+        rng = np.random.default_rng(self.seed)
+        for start in range(0, self.shots, self.chunk):
+            n = min(self.chunk, self.shots - start)
+            yield (n,) + self.sample_sparse(n, rng)
+
+    @property
+    def entropy(self):
+        '''
+        Kraus indices of all shots, an array of shape (shots, count).
+        It is drawn on first access, and kept.
+        '''
+        if self.samples is None:
+            self.samples = np.concatenate([np.zeros((0, self.count), dtype=np.int64)]\
+                + list(self.chunks()))
+        return self.samples
+
+    def pack(self, entropy):
+        '''
+        Pack rows of kraus indices into integer keys, key_bits[i] bits per
+        channel. Returns an array of shape (rows, words) of uint64.
+        '''
+        keys = []
+        word = np.zeros(len(entropy), dtype=np.uint64)
+        used = 0
+        for i in range(self.count):
+            b = int(self.key_bits[i])
+            if used + b>64:
+                keys.append(word)
+                word = np.zeros(len(entropy), dtype=np.uint64)
+                used = 0
+            word |= entropy[:,i].astype(np.uint64) << np.uint64(used)
+            used += b
+        keys.append(word)
+        return np.stack(keys, axis=1)
+
+    def pack_sparse(self, shot, channel, kraus):
+        '''
+        Like pack(), for errors given as arrays of their shot, channel and
+        kraus index. Returns the keys of the shots with at least one error,
+        without forming their rows of kraus indices.
+        '''
+        # Word and bit offset of each channel in a key
+        word = np.zeros(self.count, dtype=np.int64)
+        used = np.zeros(self.count, dtype=np.int64)
+        for i in range(1, self.count):
+            word[i] = word[i-1]
+            used[i] = used[i-1] + self.key_bits[i-1]
+            if used[i] + self.key_bits[i]>64:
+                word[i] += 1
+                used[i] = 0
+
+        noisy, row = np.unique(shot, return_inverse=True)
+        keys = np.zeros((len(noisy), word[-1] + 1), dtype=np.uint64)
+        # Errors of a shot sit in distinct bits, so adding them packs them
+        np.add.at(keys, (row, word[channel]),\
+            kraus.astype(np.uint64) << used[channel].astype(np.uint64))
+        return keys
+
+    def unpack(self, keys):
+        '''
+        Inverse of pack(): rows of kraus indices from packed keys, in the
+        smallest integer type that holds them.
+        '''
+        dtype = np.min_scalar_type(np.max(self.cardinality) - 1)
+        # Filled channel by channel, so held transposed while filling
+        entropy = np.zeros((self.count, len(keys)), dtype=dtype)
+        w = 0
+        used = 0
+        for i in range(self.count):
+            b = int(self.key_bits[i])
+            if used + b>64:
+                w += 1
+                used = 0
+            mask = np.uint64((1 << b) - 1)
+            entropy[i] = (keys[:,w] >> np.uint64(used)) & mask
+            used += b
+        return np.ascontiguousarray(entropy.T)
+
+    def histogram(self, sparse=False):
+        '''
+        Count the distinct patterns of kraus indices over all shots, using
+        packed integer keys. Returns the patterns, an array of shape
+        (distinct, count), and the number of shots showing each pattern.
+        Args:
+            sparse: If True, sample with sparse_chunks(), so that runtime
+                    scales with the number of errors rather than shots.
+        '''
+        keys = []
+        counts = []
+        if sparse:
+            for n, shot, channel, kraus in self.sparse_chunks():
+                k, c = np.unique(self.pack_sparse(shot, channel, kraus), axis=0,\
+                    return_counts=True)
+                keys += [k, self.pack(np.zeros((1, self.count), dtype=np.int64))]
+                counts += [c, [n - c.sum()]]
+        else:
+            for ent in self.chunks():
+                k, c = np.unique(self.pack(ent), axis=0, return_counts=True)
+                keys.append(k)
+                counts.append(c)
+
+        keys = np.concatenate(keys)
+        uniq, inv = np.unique(keys, axis=0, return_inverse=True)
+        counts = np.bincount(inv.reshape(-1), weights=np.concatenate(counts)).astype(np.int64)
+        return self.unpack(uniq[counts>0]), counts[counts>0]
+
+    @property
+    def stats(self):
+        '''
+        Histogram of patterns as a dictionary, keyed by the string of kraus
+        indices of each pattern.
+        '''
+        patterns, counts = self.histogram()
+        return {''.join(str(v) for v in row): int(c) for row, c in zip(patterns, counts)}
+
+    def propagate(self, qlen, clen, opnames, noiseid, condval, contype, conbits,\
+        opqargs, opcargs, packed=False):
+        '''
+        Stream the samples through a Clifford circuit, one chunk at a time, with
+        stabilizerQC.propagate_all_samples(), treating kraus index k of a channel
+        as the Pauli error encoded by k (see stabilizerQC.py). Channels
+        correspond to the noisy gates of the circuit, in order.
+        Args:
+            packed: If True, use frameQC.propagate_frames() instead, and yield its
+                    bit-packed output.
+        Yields the kraus indices of each chunk, followed by the output of the
+        propagation for that chunk.
+        '''
+        from . import stabilizerQC, frameQC
+        for ent in self.chunks():
+            args = (qlen, clen, ent, opnames, noiseid, condval, contype, conbits,\
+                opqargs, opcargs)
+            if packed:
+                yield (ent,) + frameQC.propagate_frames(*args)
             else:
-                self.stats.update({str_temp:1})
\ No newline at end of file
+                yield (ent,) + stabilizerQC.propagate_all_samples(*args)
+
+    def propagate_unique(self, qlen, clen, opnames, noiseid, condval, contype, conbits,\
+        opqargs, opcargs, sparse=True, packed=False):
+        '''
+        Propagate each distinct error pattern through a Clifford circuit once,
+        instead of once per shot (see propagate() for the arguments).
+        Args:
+            sparse: Sample with sparse_chunks() (see histogram()).
+            packed: Use frameQC.propagate_frames() instead of
+                    stabilizerQC.propagate_all_samples().
+        Returns the patterns, their multiplicities (number of shots), and the
+        output of the propagation with one entry (row, or bit for packed
+        output) per pattern.
+        '''
+        from . import stabilizerQC, frameQC
+        patterns, counts = self.histogram(sparse=sparse)
+        args = (qlen, clen, patterns, opnames, noiseid, condval, contype, conbits,\
+            opqargs, opcargs)
+        if packed:
+            return (patterns, counts) + frameQC.propagate_frames(*args)
+        return (patterns, counts) + stabilizerQC.propagate_all_samples(*args)
@@ -0,0 +1,191 @@
+# gatelut = ['h','cx','cz','x','y','z','s','sdg'], as in stabilizerQC.py
+# Further opcodes: 9 = measure (qubit opqargs[0] into bit opcargs[0]), 11 = reset
+from numba import njit, prange
+import numpy as np
+from .stabilizerQC import check_condition
+from .frameQC import popcount
+
+@njit(cache=True)
+def new_tableau(n):
+    '''
+    Tableau of the n-qubit zero state, in the form of Aaronson and Gottesman
+    ("CHP"). Rows 0..n-1 are destabilizers, rows n..2n-1 stabilizers, and
+    row 2n is scratch space. Row i is the Pauli operator with X part xs[i],
+    Z part zs[i] (bit q of the packed uint64 words for qubit q), and sign
+    (-1)**r[i]. Destabilizer i is X_i, and stabilizer i is Z_i.
+    '''
+    nw = (n + 63)//64
+    xs = np.zeros((2*n+1, nw), dtype=np.uint64)
+    zs = np.zeros((2*n+1, nw), dtype=np.uint64)
+    r = np.zeros(2*n+1, dtype=np.uint8)
+    for q in range(n):
+        xs[q, q//64] = np.uint64(1) << np.uint64(q % 64)
+        zs[n+q, q//64] = np.uint64(1) << np.uint64(q % 64)
+    return xs, zs, r
+
+@njit(cache=True)
+def get_bit(words, q):
+    return np.uint8((words[q//64] >> np.uint64(q % 64)) & np.uint64(1))
+
+@njit(cache=True)
+def flip_bit(words, q):
+    words[q//64] ^= np.uint64(1) << np.uint64(q % 64)
+
+@njit(parallel=True, cache=True)
+def apply_gate(xs, zs, r, op, qargs):
+    '''
+    Conjugate every row of the tableau by Clifford "op" (see gatelut),
+    acting on qargs[0], or on qargs[0] (control) and qargs[1].
+    Each row only updates its own words and sign, so the 2n rows are
+    updated in parallel; the scratch row 2n is skipped.
+    '''
+    a = qargs[0]
+    b = qargs[1]
+    for i in prange(len(r) - 1):
+        xa = get_bit(xs[i], a)
+        za = get_bit(zs[i], a)
+        if op==0: # h
+            r[i] ^= xa & za
+            if xa!=za:
+                flip_bit(xs[i], a)
+                flip_bit(zs[i], a)
+        elif op==1: # cx
+            xb = get_bit(xs[i], b)
+            zb = get_bit(zs[i], b)
+            r[i] ^= xa & zb & (xb ^ za ^ 1)
+            if xa:
+                flip_bit(xs[i], b)
+            if zb:
+                flip_bit(zs[i], a)
+        elif op==2: # cz
+            xb = get_bit(xs[i], b)
+            zb = get_bit(zs[i], b)
+            r[i] ^= xa & xb & (za ^ zb)
+            if xb:
+                flip_bit(zs[i], a)
+            if xa:
+                flip_bit(zs[i], b)
+        elif op==3: # x
+            r[i] ^= za
+        elif op==4: # y
+            r[i] ^= xa ^ za
+        elif op==5: # z
+            r[i] ^= xa
+        elif op==6: # s
+            r[i] ^= xa & za
+            if xa:
+                flip_bit(zs[i], a)
+        elif op==7: # sdg
+            r[i] ^= xa & (za ^ 1)
+            if xa:
+                flip_bit(zs[i], a)
+
+@njit(cache=True)
+def rowsum(xs, zs, r, h, i):
+    '''
+    Replace row h by the product of rows i and h, tracking the sign.
+    The phase exponent of the product is summed over 64 qubits at a time,
+    counting the qubits contributing +1 and -1 with bitwise masks.
+    '''
+    plus = np.uint64(0)
+    minus = np.uint64(0)
+    for w in range(xs.shape[1]):
+        x1 = xs[i,w]
+        z1 = zs[i,w]
+        x2 = xs[h,w]
+        z2 = zs[h,w]
+        y1 = x1 & z1
+        xo = x1 & ~z1
+        zo = z1 & ~x1
+        plus += popcount((y1 & z2 & ~x2) | (xo & z2 & x2) | (zo & x2 & ~z2))
+        minus += popcount((y1 & x2 & ~z2) | (xo & z2 & ~x2) | (zo & x2 & z2))
+        xs[h,w] = x2 ^ x1
+        zs[h,w] = z2 ^ z1
+
+    total = 2*int(r[h]) + 2*int(r[i]) + int(plus) - int(minus)
+    r[h] = np.uint8(1) if total % 4==2 else np.uint8(0)
+
+@njit(parallel=True, cache=True)
+def rowsum_all(xs, zs, r, n, a, p):
+    '''
+    rowsum(i, p) for every row i!=p of the tableau that anticommutes with
+    Z_a, in parallel over rows; row p is only read.
+    '''
+    for i in prange(2*n):
+        if i!=p and get_bit(xs[i], a):
+            rowsum(xs, zs, r, i, p)
+
+@njit(cache=True)
+def measure(xs, zs, r, a):
+    '''
+    Measure qubit a in the Z basis, updating the tableau.
+    Returns the outcome (0 or 1).
+    '''
+    n = (len(r) - 1)//2
+    p = -1
+    for i in range(n, 2*n):
+        if get_bit(xs[i], a):
+            p = i
+            break
+
+    if p>=0:
+        # Random outcome: Z_a anticommutes with stabilizer p
+        rowsum_all(xs, zs, r, n, a, p)
+        xs[p-n] = xs[p]
+        zs[p-n] = zs[p]
+        r[p-n] = r[p]
+        xs[p] = 0
+        zs[p] = 0
+        flip_bit(zs[p], a)
+        r[p] = np.uint8(1) if np.random.random()<0.5 else np.uint8(0)
+        return int(r[p])
+
+    # Deterministic outcome, read off the product of stabilizers in row 2n
+    s = 2*n
+    xs[s] = 0
+    zs[s] = 0
+    r[s] = 0
+    for i in range(n):
+        if get_bit(xs[i], a):
+            rowsum(xs, zs, r, s, i+n)
+    return int(r[s])
+
+@njit(cache=True)
+def seed_rng(seed):
+    np.random.seed(seed)
+
+@njit(cache=True)
+def run_tableau(xs, zs, r, carr, opnames, condval, contype, conbits, opqargs, opcargs):
+    '''
+    Run a Clifford circuit on a tableau, recording measurements in carr.
+    The circuit is given as in stabilizerQC.propagate(), without noise:
+        opnames : Opcodes of gatelut, 9 to measure or 11 to reset.
+        condval, contype, conbits : Classical control of gates (see check_condition()).
+        opqargs : Qubits acted upon by each operation.
+        opcargs : Classical bit receiving each measurement.
+    '''
+    for idx in range(len(opnames)):
+        name = opnames[idx]
+        if name<9:
+            if check_condition(carr, condval[idx], contype[idx], conbits[idx]):
+                apply_gate(xs, zs, r, name, opqargs[idx])
+        elif name==9: # measure
+            carr[opcargs[idx][0]] = measure(xs, zs, r, opqargs[idx][0])
+        elif name==11: # reset
+            if measure(xs, zs, r, opqargs[idx][0]):
+                apply_gate(xs, zs, r, 3, opqargs[idx])
+        else:
+            raise Exception("Unsupported operation for the tableau simulator.")
+
+def sample(nq, clen, shots, opnames, condval, contype, conbits, opqargs, opcargs, seed=None):
+    '''
+    Run a Clifford circuit "shots" times from the zero state (see run_tableau()).
+    Returns the classical bits of each shot, an int16 array of shape (shots, clen).
+    '''
+    if seed is not None:
+        seed_rng(seed)
+    carrs = np.zeros((shots, clen), dtype=np.int16)
+    for s in range(shots):
+        xs, zs, r = new_tableau(nq)
+        run_tableau(xs, zs, r, carrs[s], opnames, condval, contype, conbits, opqargs, opcargs)
+    return carrs
@@ -0,0 +1,330 @@
+import contextlib
+import numpy as np
+import jax
+import jax.numpy as jnp
+from jax import lax
+from .circuit import circuit, batch_params
+from .observables import pauli_masks
+
+# Programs are compiled for, and run on, the host CPU
+cpu = jax.devices('cpu')[0]
+
+# Compiled programs, keyed by the number of qubits and the opcodes used
+# (see program()). Each is compiled again by jax.jit for every distinct
+# shape of its arguments: number of gates, qubit width and parameter width.
+programs = {}
+
+sq2d = 1/np.sqrt(2.)
+
+def bit(nq, qb):
+    '''
+    Value of qubit qb in each basis state of an nq-qubit statevector, or 0
+    for a placeholder qubit (-1). The index array is generated inside the
+    fused elementwise loop, and is never stored. Indices are 32-bit
+    unless 64-bit types are enabled (see precision()).
+    '''
+    idx = lax.iota(jnp.int64 if jax.config.jax_enable_x64 else jnp.int32, 2**nq)
+    return jnp.where(qb>=0, (idx >> jnp.maximum(qb, 0)) & 1, 0)
+
+def apply_axis(nq, qb, op, vec):
+    '''
+    Applies a 1-qubit operator "op" targeting qb (a Python integer), on vec,
+    by viewing vec as an array of shape (2**(nq-qb-1), 2, 2**qb).
+    '''
+    t = vec.reshape(-1, 2, 2**qb)
+    t0 = t[:,0]
+    t1 = t[:,1]
+    return jnp.stack([op[0,0]*t0 + op[0,1]*t1, op[1,0]*t0 + op[1,1]*t1], axis=1).reshape(-1)
+
+def apply_1qb(nq, op, qb, vec):
+    '''
+    Applies a 1-qubit operator "op" targeting qb, which is only known when the
+    program runs, by switching to the reshape for that qubit.
+    '''
+    return lax.switch(qb, [lambda o, v, q=q: apply_axis(nq, q, o, v) for q in range(nq)], op, vec)
+
+def transpose_axes(nq, lo, hi, vec):
+    '''
+    Exchanges qubits lo<hi (Python integers) of vec by transposing two
+    axes of a 5-dimensional view of it.
+    '''
+    if lo==hi:
+        return vec
+    t = vec.reshape(2**(nq-hi-1), 2, 2**(hi-lo-1), 2, 2**lo)
+    return t.swapaxes(1, 3).reshape(-1)
+
+def transpose(nq, lo, qb, vec):
+    '''
+    Exchanges qubit lo (a Python integer) with qubit qb>=lo, which is only
+    known when the program runs.
+    '''
+    return lax.switch(qb - lo,\
+        [lambda v, q=q: transpose_axes(nq, lo, q, v) for q in range(lo, nq)], vec)
+
+def apply_kqb(nq, k, op, qbs, vec):
+    '''
+    Applies a dense k-qubit operator "op" targeting qbs[:k], on vec. The
+    targeted qubits are first moved to the lowest k positions, so that the
+    operator is a matrix product on a (2**(nq-k), 2**k) view of vec, and are
+    then moved back. Rows and columns of op are indexed little-endian,
+    i.e. bit j of the index is the value of qubit qbs[j].
+    '''
+    pos = qbs[:k]
+    moves = []
+    for j in range(k):
+        p = pos[j]
+        vec = transpose(nq, j, p, vec)
+        moves.append(p)
+        # The qubit that was at position j is now at p
+        pos = jnp.where(pos==j, p, pos)
+
+    vec = (vec.reshape(-1, 2**k) @ op.T).reshape(-1)
+
+    for j in reversed(range(k)):
+        vec = transpose(nq, j, moves[j], vec)
+    return vec
+
+def kernels(nq, width, plen, present):
+    '''
+    One function (vec, qbs, p) -> vec per opcode in present, where qbs is a
+    row of the circuit's qubits and p the gate's parameters, zero-padded
+    to plen entries. Kernels never gather amplitudes: dense gates act on
+    reshaped views, and diagonal gates multiply by a factor selected from
+    the bits of each basis state.
+    '''
+    def nactive(qbs):
+        return jnp.sum(qbs>=0)
+
+    def h(vec, qbs, p):
+        op = jnp.array([[sq2d, sq2d], [sq2d, -sq2d]], dtype=vec.dtype)
+        return apply_1qb(nq, op, qbs[0], vec)
+
+    def u(vec, qbs, p):
+        return apply_1qb(nq, p[:4].reshape(2,2), qbs[0], vec)
+
+    def cz(vec, qbs, p):
+        return jnp.where(bit(nq, qbs[0]) & bit(nq, qbs[1]), -vec, vec)
+
+    def mod2qb(vec, qbs, p):
+        m = (bit(nq, qbs[0]) + 2*bit(nq, qbs[1])).astype(jnp.int32)
+        return vec*lax.select_n(m, *[jnp.broadcast_to(p[j], vec.shape) for j in range(4)])
+
+    def rz(vec, qbs, p):
+        theta = jnp.real(p[0])
+        mod = jnp.exp(jnp.array([-0.5j, 0.5j])*theta).astype(vec.dtype)
+        return vec*jnp.where(bit(nq, qbs[0]), mod[1], mod[0])
+
+    def diag(vec, qbs, p):
+        m = 0
+        for j in range(width):
+            m = m + (bit(nq, qbs[j]) << j)
+        cases = [jnp.broadcast_to(p[j], vec.shape) for j in range(min(2**width, plen))]
+        return vec*lax.select_n(m.astype(jnp.int32), *cases)
+
+    def unitary(vec, qbs, p):
+        branches = []
+        for k in range(1, width+1):
+            dim = 2**k
+            if dim*dim<=plen:
+                branches.append(lambda v, k=k, dim=dim:\
+                    apply_kqb(nq, k, p[:dim*dim].reshape(dim,dim), qbs, v))
+            else:
+                branches.append(lambda v: v)
+        return lax.switch(nactive(qbs) - 1, branches, vec)
+
+    def swap(vec, qbs, p):
+        # Transpositions (0 a)(0 b)(0 a) exchange qubits a<b
+        a = jnp.minimum(qbs[0], qbs[1])
+        b = jnp.maximum(qbs[0], qbs[1])
+        vec = transpose(nq, 0, a, vec)
+        vec = transpose(nq, 0, b, vec)
+        return transpose(nq, 0, a, vec)
+
+    def cu(vec, qbs, p):
+        k = nactive(qbs)
+        ctrl = True
+        for j in range(width - 1):
+            ctrl = ctrl & ((j>=k - 1) | (bit(nq, qbs[j])==1))
+        new = apply_1qb(nq, p[:4].reshape(2,2), qbs[k-1], vec)
+        return jnp.where(ctrl, new, vec)
+
+    def phase(vec, qbs, p):
+        on = True
+        for j in range(width):
+            on = on & ((qbs[j]<0) | (bit(nq, qbs[j])==1))
+        return jnp.where(on, p[0]*vec, vec)
+
+    table = [h, u, cz, mod2qb, rz, diag, unitary, swap, cu, phase]
+    return [table[op] for op in present]
+
+def program(nq, present):
+    '''
+    Returns the jitted program running compiled circuits with opcodes in
+    present on nq qubits. The whole circuit is one XLA program: a lax.scan
+    over the gates, whose body switches on the opcode. Opcodes, qubits and
+    parameters are inputs of the program rather than constants, so that it
+    is reused by every circuit of the same shape, and can be differentiated
+    and vmapped with respect to the parameters.
+    '''
+    key = (nq, present)
+    if key not in programs:
+        def run(ops, qubits, pidx, pbuf, vec):
+            '''
+            Args:
+                ops:    Branch of each gate, its opcode's position in present.
+                qubits: Qubits of each gate, padded with -1.
+                pidx:   Positions of each gate's parameters in pbuf,
+                        padded with len(pbuf).
+                pbuf:   Parameter buffer of the circuit.
+                vec:    Input statevector.
+            '''
+            table = kernels(nq, qubits.shape[1], pidx.shape[1], present)
+            p = jnp.concatenate([pbuf, jnp.zeros(1, dtype=pbuf.dtype)])[pidx]
+            p = p.astype(vec.dtype)
+
+            def step(v, gate):
+                op, qbs, pg = gate
+                return lax.switch(op, table, v, qbs, pg), None
+
+            out, _ = lax.scan(step, vec, (ops, qubits, p))
+            return out
+
+        programs[key] = jax.jit(run)
+    return programs[key]
+
+def layout(circ):
+    '''
+    Arrays scanned over by a program (see program()), from a compiled circuit,
+    and the tuple of opcodes it uses.
+    '''
+    present = tuple(int(op) for op in np.unique(circ.ops))
+    ops = np.searchsorted(present, circ.ops).astype(np.int32)
+
+    plens = np.diff(circ.poffs)
+    plen = max(1, int(plens.max())) if len(plens) else 1
+    pidx = circ.poffs[:-1,None] + np.arange(plen)
+    pidx = np.where(np.arange(plen)<plens[:,None], pidx, len(circ.pbuf))
+
+    args = (ops, circ.qubits.astype(np.int32), pidx.astype(np.int32))
+    return jax.device_put(args, cpu), present
+
+def precision(dtype):
+    '''
+    Context in which JAX keeps arrays of dtype at full precision: 64-bit
+    types are enabled for complex128 within it, leaving the process-wide
+    jax_enable_x64 setting of the caller unchanged.
+    '''
+    if np.dtype(dtype)==np.complex128:
+        return jax.enable_x64(True)
+    return contextlib.nullcontext()
+
+def check_precision(dtype):
+    '''
+    JAX silently turns complex128 into complex64 unless 64-bit types are
+    enabled, so refuse complex128 runs without them.
+    '''
+    if np.dtype(dtype)==np.complex128 and not jax.config.jax_enable_x64:
+        raise ValueError("complex128 statevectors need 64-bit types in JAX: run "\
+            "under jax.enable_x64(True), set jax_enable_x64, or use complex64.")
+
+def zero_state(nq, dtype=complex):
+    return jnp.zeros(2**nq, dtype=dtype).at[0].set(1)
+
+def simulate(nq, circ, pbuf=None, vec=None):
+    '''
+    Run a compiled circuit, returning the output statevector as a JAX array.
+    This is a pure function of pbuf and vec, so it can be used under jax.grad,
+    jax.vmap or jax.jit.
+    Args:
+        circ: A compiled circuit, whose opcodes and qubits fix the program.
+        pbuf: Parameter buffer replacing circ.pbuf, e.g. a traced array.
+        vec:  Input statevector; the zero state if omitted.
+    For complex128 circuits, 64-bit types must be enabled in JAX (see
+    check_precision()).
+    '''
+    check_precision(circ.pbuf.dtype)
+    args, present = layout(circ)
+    if pbuf is None:
+        pbuf = jax.device_put(circ.pbuf, cpu)
+    if vec is None:
+        vec = zero_state(nq, circ.pbuf.dtype)
+    if len(circ)==0:
+        return vec
+    return program(nq, present)(*args, pbuf, vec)
+
+def simulate_batch(nq, circ, pbufs, vecs=None):
+    '''
+    Run a compiled circuit over a batch of parameter buffers, an array of
+    shape (batch, len(pbuf)), with jax.vmap. vecs is an optional batch of
+    input statevectors. Returns the output statevectors, shape (batch, 2**nq).
+    '''
+    check_precision(circ.pbuf.dtype)
+    args, present = layout(circ)
+    run = program(nq, present)
+    if vecs is None:
+        vecs = jnp.broadcast_to(zero_state(nq, pbufs.dtype), (len(pbufs), 2**nq))
+    if len(circ)==0:
+        return vecs
+    return jax.vmap(run, in_axes=(None, None, None, 0, 0))(*args, pbufs, vecs)
+
+def angle_slots(circ):
+    '''
+    Positions in pbuf of the angles of the rz gates of a compiled circuit,
+    which are the natural variational parameters: see README for how to
+    differentiate with respect to them.
+    '''
+    return circ.poffs[:-1][circ.ops==4]
+
+def expectation(nq, vec, paulis, coeffs=None):
+    '''
+    Sum of coeffs[t]*<vec|P_t|vec> over Pauli strings P_t (see
+    observables.pauli_masks()), as a differentiable JAX scalar. Each term
+    flips axes of vec viewed as a (2,)*nq array, and applies signs.
+    '''
+    xmask, zmask, ny = pauli_masks(paulis)
+    if coeffs is None:
+        coeffs = np.ones(len(paulis))
+
+    t = vec.reshape((2,)*nq)
+    total = 0.
+    for x, z, y, c in zip(xmask, zmask, ny, coeffs):
+        # Axis nq-1-q of t is qubit q
+        pv = t
+        for q in range(nq):
+            if (z >> q) & 1:
+                sign = jnp.array([1, -1], dtype=vec.real.dtype)
+                pv = pv*sign.reshape((2,) + (1,)*q)
+        flip = tuple(nq-1-q for q in range(nq) if (x >> q) & 1)
+        if flip:
+            pv = jnp.flip(pv, axis=flip)
+        total = total + c*jnp.real((1j)**int(y)*jnp.vdot(t, pv))
+    return total
+
+def do_ops(nq, ops, qubits, poffs, pbuf, vec):
+    '''
+    Runner function for a compiled circuit (see circuit.py), with the same
+    arguments as numbaQC.do_ops(). The result is copied back into vec.
+    64-bit types are enabled in JAX for the duration of complex128 runs.
+    '''
+    circ = circuit(ops, qubits, poffs, pbuf, dtype=vec.dtype)
+    with precision(vec.dtype):
+        vec[:] = np.asarray(simulate(nq, circ, vec=jax.device_put(vec, cpu)))
+
+def do_circ(nq, names, qargs, parms, vec):
+    '''
+    Runner function taking the names, qargs and parms lists (see numbaQC.do_circ()).
+    '''
+    circ = circuit.from_lists(names, qargs, parms)
+    do_ops(nq, circ.ops, circ.qubits, circ.poffs, circ.pbuf, vec)
+
+def do_circ_batch(nq, names, qargs, parms, vecs):
+    '''
+    Batched runner function (see numbaQC.do_circ_batch()); the batch is
+    run by one vmapped program.
+    '''
+    circ, pbufs = batch_params(names, qargs, parms)
+    circ = circ.astype(vecs.dtype)
+    with precision(vecs.dtype):
+        out = simulate_batch(nq, circ, jax.device_put(pbufs.astype(vecs.dtype), cpu),\
+            jax.device_put(vecs, cpu))
+        vecs[:] = np.asarray(out)
@@ -0,0 +1,300 @@
+import numpy as np
+from .circuit import circuit, batch_params
+from .compiler import unpack_circ, gate_matrix
+
+swap_op = np.eye(4, dtype=complex)[[0,2,1,3]]
+
+# Pauli operators, as characters of a Pauli string (see observables.py)
+pauli_ops = {'I': np.eye(2, dtype=complex), 'X': np.array([[0,1],[1,0]], dtype=complex),\
+    'Y': np.array([[0,-1j],[1j,0]]), 'Z': np.array([[1,0],[0,-1]], dtype=complex)}
+
+def do_circ(nq, names, qargs, parms, vec):
+    '''
+    Runner function. Converts the gate lists to a compiled circuit
+    and calls do_ops() to effect gates as listed in names, qargs, and parms.
+
+    Args:
+        names: List of strings indicating which gate to perform.
+        qargs: List of integer 2-tuples, indicating which qubit(s) the gate is acting on.
+        parms: List of parameter(s) where required, i.e. when a gate is parameterized.
+        vec:   An input statevector.
+    '''
+    circ = circuit.from_lists(names, qargs, parms)
+    do_ops(nq, circ.ops, circ.qubits, circ.poffs, circ.pbuf.astype(vec.dtype), vec)
+
+def do_ops(nq, ops, qubits, poffs, pbuf, vec):
+    '''
+    Runner function for a compiled circuit (see circuit.py), on a dense
+    statevector vec: vec is converted to a matrix product state, which is
+    run (see state) without truncation, and the result is written back into vec.
+
+    Args:
+        ops:    Integer opcodes, indexing gatelut in circuit.py.
+        qubits: Qubit(s) each gate is acting on, padded with -1.
+        poffs:  Offsets of each gate's parameters in pbuf.
+        pbuf:   Contiguous buffer of gate parameters.
+        vec:    An input statevector.
+    '''
+    # Bonds of nq qubits are at most 2**(nq//2), so nothing is truncated
+    st = state(nq, dtype=vec.dtype, max_bond=2**(nq//2), cutoff=0.)
+    st.set_dense(vec)
+    st.run(circuit(ops, qubits, poffs, pbuf, dtype=vec.dtype))
+    vec[:] = st.todense()
+
+class state():
+    '''
+    Matrix product state: one tensor of shape (left bond, 2, right bond) per
+    qubit, so that the amplitude of basis state i is the product of the
+    matrices tensors[q][:, bit q of i, :] over q = 0, ..., nq-1.
+
+    The state is kept in mixed canonical form around the site "center". A
+    gate on k qubits is applied to k neighbouring sites: qubits that are not
+    neighbours are first moved next to each other with swap gates, and moved
+    back after the gate. The sites are contracted, multiplied by the gate's
+    operator, and split again by singular value decompositions, keeping at
+    most max_bond singular values, and dropping the smallest ones as long as
+    their total weight stays below cutoff. Kept singular values are
+    renormalised, and the discarded weight is reported in self.stats.
+
+    Memory and time grow with the bond dimension, not with 2**nq, so states
+    of 1D circuits with limited entanglement can have 100 qubits or more.
+    '''
+    def __init__(self, nq, dtype=complex, max_bond=64, cutoff=1e-12):
+        '''
+        Args:
+            nq:       Number of qubits. The state starts as the zero state.
+            dtype:    Precision of the tensors.
+            max_bond: Largest bond dimension kept by truncation.
+            cutoff:   Largest weight (sum of squared singular values, relative
+                      to the total) dropped by one truncation.
+        '''
+        self.nq = nq
+        self.dtype = np.dtype(dtype)
+        self.max_bond = max_bond
+        self.cutoff = cutoff
+        self.tensors = [np.zeros((1,2,1), dtype=self.dtype) for q in range(nq)]
+        for t in self.tensors:
+            t[0,0,0] = 1.
+        self.center = 0
+        self.stats = {}
+
+    @property
+    def bonds(self):
+        '''
+        Dimensions of the nq-1 bonds between neighbouring sites.
+        '''
+        return [t.shape[2] for t in self.tensors[:-1]]
+
+    def set_dense(self, vec):
+        '''
+        Set the state to a dense statevector, split site by site with
+        (untruncated) singular value decompositions.
+        '''
+        n = self.nq
+        # Axis q of rest holds qubit q
+        rest = vec.reshape((2,)*n).transpose(range(n-1, -1, -1)).reshape(1, -1)
+        self.tensors = []
+        for q in range(n-1):
+            left = rest.shape[0]
+            u, s, vh = np.linalg.svd(rest.reshape(left*2, -1), full_matrices=False)
+            r = max(1, int(np.sum(s>0)))
+            self.tensors.append(u[:,:r].reshape(left, 2, r).astype(self.dtype))
+            rest = s[:r,None]*vh[:r]
+        self.tensors.append(rest.reshape(-1, 2, 1).astype(self.dtype))
+        self.center = n - 1
+
+    def todense(self):
+        '''
+        The state as a dense statevector, of 2**nq amplitudes.
+        '''
+        out = np.ones((1,1), dtype=self.dtype)
+        for t in self.tensors:
+            out = np.tensordot(out, t, axes=(-1, 0))
+        # Axis q of out (after the leading bond) holds qubit q
+        out = out.reshape((2,)*self.nq)
+        return out.transpose(range(self.nq-1, -1, -1)).reshape(-1)
+
+    def move_center(self, site):
+        '''
+        Move the orthogonality center to site, by QR decompositions.
+        '''
+        while self.center<site:
+            c = self.center
+            t = self.tensors[c]
+            q, r = np.linalg.qr(t.reshape(-1, t.shape[2]))
+            self.tensors[c] = q.reshape(t.shape[0], 2, -1)
+            self.tensors[c+1] = np.tensordot(r, self.tensors[c+1], axes=(1, 0))
+            self.center += 1
+        while self.center>site:
+            c = self.center
+            t = self.tensors[c]
+            q, r = np.linalg.qr(t.reshape(t.shape[0], -1).T)
+            self.tensors[c] = q.T.reshape(-1, 2, t.shape[2])
+            self.tensors[c-1] = np.tensordot(self.tensors[c-1], r.T, axes=(2, 0))
+            self.center -= 1
+
+    def truncate(self, s):
+        '''
+        Number of singular values (in decreasing order) to keep.
+        '''
+        w = s**2
+        # tail[r] is the weight dropped when keeping r values
+        tail = np.concatenate([np.cumsum(w[::-1])[::-1], [0.]])
+        keep = int(np.argmax(tail<=self.cutoff*w.sum()))
+        keep = max(1, min(keep, self.max_bond))
+        self.stats['discarded'] += float(tail[keep]/max(w.sum(), 1e-300))
+        return keep
+
+    def apply_sites(self, site, k, op):
+        '''
+        Apply a 2**k x 2**k operator to the k sites starting at site. Rows and
+        columns of op are indexed with bit j for site site+j.
+        '''
+        self.move_center(site)
+        theta = self.tensors[site]
+        for j in range(1, k):
+            theta = np.tensordot(theta, self.tensors[site+j], axes=(-1, 0))
+
+        # Operator axes: outputs then inputs, highest bit (last site) first
+        opt = op.astype(self.dtype).reshape((2,)*2*k)
+        theta = np.tensordot(opt, theta, axes=(list(range(2*k-1, k-1, -1)),\
+            list(range(1, k+1))))
+        # Back to (left, site, ..., site+k-1, right)
+        theta = theta.transpose([k] + list(range(k-1, -1, -1)) + [k+1])
+
+        for j in range(k-1):
+            left = theta.shape[0]
+            m = theta.reshape(left*2, -1)
+            u, s, vh = np.linalg.svd(m, full_matrices=False)
+            r = self.truncate(s)
+            s = s[:r]/np.linalg.norm(s[:r])*np.linalg.norm(s)
+            self.tensors[site+j] = u[:,:r].reshape(left, 2, r)
+            theta = (s[:,None]*vh[:r]).reshape((r,) + theta.shape[2:])
+            self.center = site + j + 1
+        self.tensors[site+k-1] = theta.reshape(theta.shape[0], 2, -1)
+
+    def apply(self, qbs, op):
+        '''
+        Apply an operator on the qubits listed in qbs, indexed little-endian
+        (bit j of the index is the value of qubit qbs[j]). Qubits are moved
+        next to the lowest of them with swaps, which are undone afterwards.
+        '''
+        k = len(qbs)
+        if k==1:
+            q = qbs[0]
+            self.tensors[q] = np.einsum('st,atb->asb', op.astype(self.dtype), self.tensors[q])
+            return
+
+        order = np.argsort(qbs)
+        sites = np.array(qbs)[order]
+        swaps = []
+        for j in range(1, k):
+            # Move the qubit at sites[j] down to sites[0]+j
+            for s in range(sites[j]-1, sites[0]+j-1, -1):
+                self.apply_sites(s, 2, swap_op)
+                swaps.append(s)
+                self.stats['swaps'] += 1
+
+        # Reorder the bits of op so that bit j is for site sites[0]+j
+        opt = op.reshape((2,)*2*k)
+        perm = [k-1-order[k-1-j] for j in range(k)]
+        opt = opt.transpose(perm + [k + p for p in perm]).reshape(2**k, 2**k)
+        self.apply_sites(int(sites[0]), k, opt)
+
+        for s in reversed(swaps):
+            self.apply_sites(s, 2, swap_op)
+
+    def run(self, circ):
+        '''
+        Apply a compiled circuit. Swaps inserted for gates on qubits that are
+        not neighbours, the total discarded weight of truncations, and the
+        largest bond dimension are reported in self.stats.
+        '''
+        self.stats = {'swaps': 0, 'discarded': 0., 'max_bond': 0}
+        if isinstance(circ, circuit):
+            circ = circ.to_lists()
+        for name, qbs, data in unpack_circ(*circ):
+            op = gate_matrix(name, qbs, data)
+            if op.ndim==1:
+                op = np.diag(op)
+            self.apply(qbs, op)
+        self.stats['max_bond'] = max(self.bonds, default=1)
+
+    def norm(self):
+        return np.linalg.norm(self.tensors[self.center])
+
+    def amplitude(self, bits):
+        '''
+        Amplitude of a basis state, given by its list of nq bits (bit q
+        being the value of qubit q), or as an integer for up to 62 qubits.
+        '''
+        if np.isscalar(bits):
+            bits = [(int(bits) >> q) & 1 for q in range(self.nq)]
+        out = np.ones((1,1), dtype=self.dtype)
+        for t, b in zip(self.tensors, bits):
+            out = out @ t[:,b,:]
+        return out[0,0]
+
+    def expectation(self, paulis, coeffs=None):
+        '''
+        Expectation values of a list of Pauli strings (see observables.py),
+        contracted site by site from the left. Returns an array holding
+        coeffs[t]*<P_t>, as observables.expectation().
+        '''
+        if coeffs is None:
+            coeffs = np.ones(len(paulis))
+        vals = np.zeros(len(paulis))
+        for t, ps in enumerate(paulis):
+            ps = ps.upper().ljust(self.nq, 'I')
+            env = np.ones((1,1), dtype=self.dtype)
+            for q, a in enumerate(self.tensors):
+                if ps[q] not in pauli_ops:
+                    raise ValueError("Unknown Pauli operator: " + ps[q])
+                if ps[q]=='I':
+                    b = a
+                else:
+                    b = np.einsum('st,atb->asb', pauli_ops[ps[q]], a)
+                # env[ket bond, bra bond]
+                env = np.einsum('ab,asc,bsd->cd', env, b, a.conj())
+            vals[t] = np.real(coeffs[t]*env[0,0])
+        return vals/self.norm()**2
+
+    def sample(self, shots, qubits=None, seed=None):
+        '''
+        Draw measurement outcomes, one site at a time: with the state in
+        right canonical form, the probabilities of each bit given the bits
+        already drawn follow from the contraction of those bits' matrices.
+        Returns an array of shape (shots, len(qubits)) of the bits of each
+        outcome (all qubits by default), since outcomes may have more bits
+        than an integer.
+        '''
+        rng = np.random.default_rng(seed)
+        self.move_center(0)
+        vecs = np.ones((shots, 1), dtype=self.dtype)
+        bits = np.zeros((shots, self.nq), dtype=np.uint8)
+        for q, t in enumerate(self.tensors):
+            # Unnormalised conditional states for each value of the bit
+            w = np.einsum('na,asb->nsb', vecs, t)
+            p = np.sum(np.abs(w)**2, axis=2)
+            p1 = p[:,1]/p.sum(axis=1)
+            bits[:,q] = rng.random(shots)<p1
+            vecs = w[np.arange(shots), bits[:,q]]
+            vecs /= np.linalg.norm(vecs, axis=1)[:,None]
+        if qubits is not None:
+            bits = bits[:, np.asarray(qubits, dtype=np.int64)]
+        return bits
+
+def do_circ_batch(nq, names, qargs, parms, vecs):
+    '''
+    Batched runner function. Applies the same circuit, with different
+    parameters, to each statevector of a batch.
+
+    Args:
+        names: List of strings indicating which gate to perform.
+        qargs: List of integer 2-tuples, indicating which qubit(s) the gate is acting on.
+        parms: Array of shape (batch, nparams, 2, 2), one parameter list per batch element.
+        vecs:  Input statevectors, an array of shape (batch, 2**nq).
+    '''
+    circ, pbufs = batch_params(names, qargs, parms)
+    for b in range(len(vecs)):
+        do_ops(nq, circ.ops, circ.qubits, circ.poffs, pbufs[b].astype(vecs.dtype), vecs[b])
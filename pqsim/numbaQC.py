@@ -1,11 +1,12 @@
 import numpy as np
+from types import FunctionType
 from numba import njit, prange
+from .circuit import circuit, batch_params
 
-@njit
 def do_circ(nq, names, qargs, parms, vec):
     '''
-    Runner function. Calls appropriate numerical routines below
-    to effect gates as listed in names, qargs, and parms.
+    Runner function. Converts the gate lists to a compiled circuit
+    and calls do_ops() to effect gates as listed in names, qargs, and parms.
 
     Args:
         names: List of strings indicating which gate to perform.
@@ -13,22 +14,76 @@ def do_circ(nq, names, qargs, parms, vec):
         parms: List of parameter(s) where required, i.e. when a gate is parameterized.
         vec:   An input statevector.
     '''
-    idx_parm = 0
-    for idx, n in enumerate(names):
-        if n=='cz':
-            cz(nq, qargs[idx][0], qargs[idx][1], vec)
-        elif n=='h':
-            h(nq, qargs[idx][0], vec)
-        elif n=='u':
-            op = parms[idx_parm]
-            idx_parm += 1
-            apply_1qb(nq, op, qargs[idx][0], vec)
-        elif n=='mod2qb':
-            mod = parms[idx_parm].reshape(4)
-            idx_parm += 1
-            modulate_2qb(nq, qargs[idx][0], qargs[idx][1], mod, vec)
-
-@njit(parallel=True)
+    circ = circuit.from_lists(names, qargs, parms)
+    do_ops(nq, circ.ops, circ.qubits, circ.poffs, circ.pbuf.astype(vec.dtype), vec)
+
+@njit(cache=True)
+def do_ops(nq, ops, qubits, poffs, pbuf, vec):
+    '''
+    Runner function for a compiled circuit (see circuit.py). Calls
+    appropriate numerical routines below to effect each opcode.
+
+    Args:
+        ops:    Integer opcodes, indexing gatelut in circuit.py.
+        qubits: Qubit(s) each gate is acting on, padded with -1.
+        poffs:  Offsets of each gate's parameters in pbuf.
+        pbuf:   Contiguous buffer of gate parameters.
+        vec:    An input statevector.
+    '''
+    for idx in range(len(ops)):
+        op = ops[idx]
+        qargs = qubits[idx]
+        p = pbuf[poffs[idx]:poffs[idx+1]]
+        if op==0: # h
+            h(nq, qargs[0], vec)
+        elif op==1: # u
+            apply_1qb(nq, p.reshape(2,2), qargs[0], vec)
+        elif op==2: # cz
+            cz(nq, qargs[0], qargs[1], vec)
+        elif op==3: # mod2qb
+            modulate_2qb(nq, qargs[0], qargs[1], p, vec)
+        elif op==4: # rz
+            theta = p[0].real
+            mod = np.array([np.exp(-0.5j*theta), np.exp(0.5j*theta)]).astype(vec.dtype)
+            modulate_diag(nq, qargs[:1], mod, vec)
+        elif op==5: # diag
+            modulate_diag(nq, active_qubits(qargs), p, vec)
+        elif op==6: # unitary
+            qbs = active_qubits(qargs)
+            dim = 2**len(qbs)
+            if len(qbs)==2:
+                apply_2qb(nq, p.reshape(4,4), qbs[0], qbs[1], vec)
+            else:
+                apply_kqb(nq, p.reshape(dim,dim), qbs, vec)
+        elif op==7: # swap
+            swap(nq, qargs[0], qargs[1], vec)
+        elif op==8: # cu
+            qbs = active_qubits(qargs)
+            controlled_1qb(nq, p.reshape(2,2), qbs[:-1], qbs[-1], vec)
+        elif op==9: # phase
+            phase(nq, active_qubits(qargs), p[0], vec)
+
+@njit(cache=True)
+def active_qubits(qarg):
+    '''
+    Returns the qubits listed in one row of qargs,
+    dropping the "-1" placeholders.
+    '''
+    count = 0
+    for qb in qarg:
+        if qb>=0:
+            count += 1
+    return qarg[:count]
+
+@njit(cache=True)
+def as_real(vec, x):
+    '''
+    Returns x as a real number of the same precision as vec,
+    so that kernels do not promote single-precision statevectors.
+    '''
+    return np.full(1, x, dtype=vec.real.dtype)[0]
+
+@njit(parallel=True, cache=True)
 def cz(n, qb0, qb1, vec):
     '''
     Does a controlled-Z operation between qb0 and qb1,
@@ -56,7 +111,7 @@ def cz(n, qb0, qb1, vec):
         
         vec[l] = -vec[l]
 
-@njit(parallel=True)
+@njit(parallel=True, cache=True)
 def h(n, qb0, vec):
     '''
     Does a Hadamard operation targeting qb0,
@@ -65,7 +120,7 @@ def h(n, qb0, vec):
     count = 2**(n-1)
     stripe = 2**qb0
     stride = 2*stripe
-    sq2d = 1/np.sqrt(2.)
+    sq2d = as_real(vec, 1/np.sqrt(2.))
     
     for i in prange(count):
         quot = i//stripe
@@ -75,7 +130,7 @@ def h(n, qb0, vec):
         vec[k] = (vec[j] - vec[k])*sq2d
         vec[j] = temp0
 
-@njit(parallel=True)
+@njit(parallel=True, cache=True)
 def apply_1qb(n, op, qb0, vec):
     '''
     Applies a 1-qubit operator "op" targeting qb0,
@@ -93,7 +148,7 @@ def apply_1qb(n, op, qb0, vec):
         vec[k] = (op[1,0]*vec[j] + op[1,1]*vec[k])
         vec[j] = temp0
 
-@njit(parallel=True)
+@njit(parallel=True, cache=True)
 def modulate_2qb(n, qb0, qb1, modulator, vec):
     '''
     Modulates vec, an n-qubit statevector,
@@ -106,8 +161,320 @@ def modulate_2qb(n, qb0, qb1, modulator, vec):
     stripe_0 = 2**(qb0)
     
     for i in prange(2**n):
-        i0 = i%(2**qb0) # qb0 value
-        i1 = i%(2**qb1) # qb1 value
+        i0 = (i//stripe_0)%2 # qb0 value
+        i1 = (i//stripe_1)%2 # qb1 value
 
         # Modulate
-        vec[i] = modulator[2*i1 + i0]*vec[i]
\ No newline at end of file
+        vec[i] = modulator[2*i1 + i0]*vec[i]
+
+@njit(parallel=True, cache=True)
+def modulate_diag(n, qbs, modulator, vec):
+    '''
+    Modulates vec, an n-qubit statevector, with a diagonal
+    operator acting on the qubits listed in qbs.
+
+    Entries of the modulator are indexed little-endian,
+    i.e. bit j of the index is the value of qubit qbs[j].
+    '''
+    for i in prange(2**n):
+        m = 0
+        for j in range(len(qbs)):
+            m += ((i >> qbs[j]) & 1) << j
+
+        vec[i] = modulator[m]*vec[i]
+
+@njit(parallel=True, cache=True)
+def apply_kqb(n, op, qbs, vec):
+    '''
+    Applies a dense k-qubit operator "op" targeting the qubits
+    listed in qbs, on vec, an n-qubit statevector.
+
+    Rows and columns of op are indexed little-endian,
+    i.e. bit j of the index is the value of qubit qbs[j].
+    '''
+    k = len(qbs)
+    dim = 2**k
+    count = 2**(n-k)
+
+    # Sorted target qubits, used to splice zeros into the loop index
+    srt = np.sort(qbs)
+
+    # Offset of each basis state of the targeted qubits
+    offs = np.zeros(dim, dtype=np.int64)
+    for m in range(dim):
+        for j in range(k):
+            offs[m] += ((m >> j) & 1) << qbs[j]
+
+    # Work in chunks, so that scratch space is allocated once per chunk
+    zero = as_real(vec, 0.)*vec[0]
+    chunk = min(count, 1024)
+    for c in prange(count//chunk):
+        temp_in = np.empty(dim, dtype=vec.dtype)
+        for i in range(c*chunk, (c+1)*chunk):
+            base = i
+            for j in range(k):
+                low = base & ((1 << srt[j]) - 1)
+                base = ((base - low) << 1) + low
+
+            for m in range(dim):
+                temp_in[m] = vec[base + offs[m]]
+            for r in range(dim):
+                acc = zero
+                for m in range(dim):
+                    acc += op[r,m]*temp_in[m]
+                vec[base + offs[r]] = acc
+
+@njit(parallel=True, cache=True)
+def swap(n, qb0, qb1, vec):
+    '''
+    Swaps qubits qb0 and qb1 of vec, an n-qubit statevector.
+    '''
+    q0 = min(qb0,qb1)
+    q1 = max(qb0,qb1)
+    stripe_0 = 2**q0
+    stripe_1 = 2**q1
+
+    for i in prange(2**(n-2)):
+        # Splice zeros into i at q0 and then q1
+        low = i % stripe_0
+        j = (i - low)*2 + low
+        low = j % stripe_1
+        j = (j - low)*2 + low
+
+        temp = vec[j + stripe_0]
+        vec[j + stripe_0] = vec[j + stripe_1]
+        vec[j + stripe_1] = temp
+
+@njit(parallel=True, cache=True)
+def apply_2qb(n, op, qb0, qb1, vec):
+    '''
+    Applies a dense 2-qubit operator "op" targeting qb0 and qb1,
+    on vec, an n-qubit statevector.
+
+    Rows and columns of op are indexed little-endian,
+    i.e. index 2*b1 + b0 for values b0 of qb0 and b1 of qb1.
+    '''
+    q0 = min(qb0,qb1)
+    q1 = max(qb0,qb1)
+    stripe_0 = 2**q0
+    stripe_1 = 2**q1
+    s0 = 2**qb0
+    s1 = 2**qb1
+
+    for i in prange(2**(n-2)):
+        # Splice zeros into i at q0 and then q1
+        low = i % stripe_0
+        j = (i - low)*2 + low
+        low = j % stripe_1
+        j = (j - low)*2 + low
+
+        v0 = vec[j]
+        v1 = vec[j + s0]
+        v2 = vec[j + s1]
+        v3 = vec[j + s0 + s1]
+        vec[j] = op[0,0]*v0 + op[0,1]*v1 + op[0,2]*v2 + op[0,3]*v3
+        vec[j + s0] = op[1,0]*v0 + op[1,1]*v1 + op[1,2]*v2 + op[1,3]*v3
+        vec[j + s1] = op[2,0]*v0 + op[2,1]*v1 + op[2,2]*v2 + op[2,3]*v3
+        vec[j + s0 + s1] = op[3,0]*v0 + op[3,1]*v1 + op[3,2]*v2 + op[3,3]*v3
+
+@njit(cache=True)
+def splice_zeros(i, srt):
+    '''
+    Inserts a zero bit into i at each of the (ascending) positions in srt.
+    '''
+    out = np.int64(i)
+    for j in range(len(srt)):
+        low = out & ((1 << srt[j]) - 1)
+        out = ((out - low) << 1) + low
+    return out
+
+@njit(parallel=True, cache=True)
+def controlled_1qb(n, op, ctrls, qb, vec):
+    '''
+    Applies a 1-qubit operator "op" targeting qb, controlled on all
+    qubits in ctrls being set, on vec, an n-qubit statevector.
+    Only the amplitudes where the controls are set are touched.
+    '''
+    srt = np.sort(np.append(ctrls, qb))
+    mask = 0
+    for c in ctrls:
+        mask |= 1 << c
+    stripe = 2**qb
+
+    for i in prange(2**(n-len(srt))):
+        j = splice_zeros(i, srt) | mask
+        k = j + stripe
+        temp0 = (op[0,0]*vec[j] + op[0,1]*vec[k])
+        vec[k] = (op[1,0]*vec[j] + op[1,1]*vec[k])
+        vec[j] = temp0
+
+@njit(parallel=True, cache=True)
+def phase(n, qbs, factor, vec):
+    '''
+    Multiplies the amplitudes of vec, an n-qubit statevector, in which
+    all qubits in qbs are set by factor. This is the diagonal gate
+    diag(1, ..., 1, factor) on qbs, e.g. a (multi-)controlled phase.
+    '''
+    srt = np.sort(qbs)
+    mask = 0
+    for qb in qbs:
+        mask |= 1 << qb
+
+    for i in prange(2**(n-len(srt))):
+        j = splice_zeros(i, srt) | mask
+        vec[j] = factor*vec[j]
+
+@njit(parallel=True, cache=True)
+def modulate_offset(nb, offset, qbs, modulator, chunk):
+    '''
+    Like modulate_diag(), but acting on a chunk of 2**nb amplitudes
+    that starts at index "offset" of the full statevector. Qubits in
+    qbs may lie outside the chunk; their values are then fixed by offset.
+    '''
+    for i in prange(2**nb):
+        m = 0
+        for j in range(len(qbs)):
+            m += (((offset + i) >> qbs[j]) & 1) << j
+
+        chunk[i] = modulator[m]*chunk[i]
+
+def serial(kernel, name):
+    '''
+    Compile a serial copy of a parallel kernel, in which prange runs as range.
+    The copy is renamed so that it gets its own entry in the on-disk cache.
+    '''
+    func = kernel.py_func
+    func = FunctionType(func.__code__, func.__globals__, name, func.__defaults__)
+    func.__qualname__ = name
+    return njit(cache=True)(func)
+
+# Serial variants of the kernels above, applied to cache-resident
+# chunks of the statevector from inside an outer parallel loop.
+h_serial = serial(h, 'h_serial')
+apply_1qb_serial = serial(apply_1qb, 'apply_1qb_serial')
+cz_serial = serial(cz, 'cz_serial')
+modulate_2qb_serial = serial(modulate_2qb, 'modulate_2qb_serial')
+apply_kqb_serial = serial(apply_kqb, 'apply_kqb_serial')
+swap_serial = serial(swap, 'swap_serial')
+apply_2qb_serial = serial(apply_2qb, 'apply_2qb_serial')
+controlled_1qb_serial = serial(controlled_1qb, 'controlled_1qb_serial')
+phase_serial = serial(phase, 'phase_serial')
+modulate_chunk = serial(modulate_offset, 'modulate_chunk')
+
+@njit(cache=True)
+def do_op_chunk(nb, offset, op, qargs, p, chunk):
+    '''
+    Applies one gate of a compiled circuit to a chunk of 2**nb amplitudes
+    starting at index "offset". Non-diagonal gates must act on qubits below nb.
+    '''
+    qbs = active_qubits(qargs)
+    high = False
+    for qb in qbs:
+        if qb>=nb:
+            high = True
+
+    if op==0: # h
+        h_serial(nb, qargs[0], chunk)
+    elif op==1: # u
+        apply_1qb_serial(nb, p.reshape(2,2), qargs[0], chunk)
+    elif op==2: # cz
+        if high:
+            modulate_chunk(nb, offset, qbs, np.array([1.,1.,1.,-1.]).astype(chunk.dtype), chunk)
+        else:
+            cz_serial(nb, qargs[0], qargs[1], chunk)
+    elif op==3: # mod2qb
+        if high:
+            modulate_chunk(nb, offset, qbs, p, chunk)
+        else:
+            modulate_2qb_serial(nb, qargs[0], qargs[1], p, chunk)
+    elif op==4: # rz
+        theta = p[0].real
+        mod = np.array([np.exp(-0.5j*theta), np.exp(0.5j*theta)]).astype(chunk.dtype)
+        modulate_chunk(nb, offset, qbs, mod, chunk)
+    elif op==5: # diag
+        modulate_chunk(nb, offset, qbs, p, chunk)
+    elif op==6: # unitary
+        dim = 2**len(qbs)
+        if len(qbs)==2:
+            apply_2qb_serial(nb, p.reshape(4,4), qbs[0], qbs[1], chunk)
+        else:
+            apply_kqb_serial(nb, p.reshape(dim,dim), qbs, chunk)
+    elif op==7: # swap
+        swap_serial(nb, qargs[0], qargs[1], chunk)
+    elif op==8: # cu
+        controlled_1qb_serial(nb, p.reshape(2,2), qbs[:-1], qbs[-1], chunk)
+    elif op==9: # phase
+        # Qubits above the chunk are fixed by offset; all must be set
+        for qb in qbs:
+            if qb>=nb and ((offset >> qb) & 1)==0:
+                return
+        phase_serial(nb, qbs[qbs<nb], p[0], chunk)
+
+@njit(cache=True)
+def do_ops_chunk(nb, offset, ops, qubits, poffs, pbuf, chunk):
+    '''
+    Serially applies a compiled circuit to a chunk of 2**nb amplitudes
+    starting at index "offset" (see do_op_chunk()).
+    '''
+    for idx in range(len(ops)):
+        do_op_chunk(nb, offset, ops[idx], qubits[idx],\
+            pbuf[poffs[idx]:poffs[idx+1]], chunk)
+
+@njit(parallel=True, cache=True)
+def do_ops_blocked(nq, nb, ops, qubits, poffs, pbuf, segs, vec):
+    '''
+    Cache-blocked runner for a compiled circuit. The circuit is split
+    into segments (see blocking.py), each a row (start, stop, blocked) of segs.
+    A blocked segment is applied in full to one chunk of 2**nb amplitudes
+    before moving on to the next chunk, so that the chunk stays in cache.
+    Other segments are run gate-by-gate over the whole statevector.
+    '''
+    size = 2**nb
+    for s in range(len(segs)):
+        start = segs[s,0]
+        stop = segs[s,1]
+        if segs[s,2]==1:
+            for c in prange(2**(nq-nb)):
+                do_ops_chunk(nb, c*size, ops[start:stop], qubits[start:stop],\
+                    poffs[start:stop+1], pbuf, vec[c*size:(c+1)*size])
+        else:
+            do_ops(nq, ops[start:stop], qubits[start:stop],\
+                poffs[start:stop+1], pbuf, vec)
+
+# Largest statevector for which do_ops_batch() parallelises over the batch
+batch_qubits = 16
+
+def do_circ_batch(nq, names, qargs, parms, vecs):
+    '''
+    Batched runner function. Applies the same circuit, with different
+    parameters, to each statevector of a batch.
+
+    Args:
+        names: List of strings indicating which gate to perform.
+        qargs: List of integer 2-tuples, indicating which qubit(s) the gate is acting on.
+        parms: Array of shape (batch, nparams, 2, 2), one parameter list per batch element.
+        vecs:  Input statevectors, an array of shape (batch, 2**nq).
+    '''
+    circ, pbufs = batch_params(names, qargs, parms)
+    do_ops_batch(nq, circ.ops, circ.qubits, circ.poffs, pbufs.astype(vecs.dtype), vecs)
+
+def do_ops_batch(nq, ops, qubits, poffs, pbufs, vecs):
+    '''
+    Batched runner for a compiled circuit; pbufs holds one parameter buffer
+    per statevector in vecs. Small statevectors are processed in parallel
+    across the batch, large ones one at a time with parallel kernels.
+    '''
+    if nq<=batch_qubits and len(vecs)>1:
+        do_ops_batch_parallel(nq, ops, qubits, poffs, pbufs, vecs)
+    else:
+        for b in range(len(vecs)):
+            do_ops(nq, ops, qubits, poffs, pbufs[b], vecs[b])
+
+@njit(parallel=True, cache=True)
+def do_ops_batch_parallel(nq, ops, qubits, poffs, pbufs, vecs):
+    '''
+    Applies a compiled circuit to each statevector in vecs, in parallel
+    over the batch, using the serial kernels.
+    '''
+    for b in prange(len(vecs)):
+        do_ops_chunk(nq, 0, ops, qubits, poffs, pbufs[b], vecs[b])
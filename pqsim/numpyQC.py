@@ -1,11 +1,15 @@
+import itertools
 import numpy as np
-from numba import njit
+from .circuit import circuit, batch_params
+
+# Gates needing scratch space work on slabs of at most 2**slab_qubits
+# amplitudes at a time, so scratch buffers stay small and in cache.
+slab_qubits = 14
 
-@njit
 def do_circ(nq, names, qargs, parms, vec):
     '''
-    Runner function. Calls appropriate numerical routines below
-    to effect gates as listed in names, qargs, and parms.
+    Runner function. Converts the gate lists to a compiled circuit
+    and calls do_ops() to effect gates as listed in names, qargs, and parms.
 
     Args:
         names: List of strings indicating which gate to perform.
@@ -13,106 +17,254 @@ def do_circ(nq, names, qargs, parms, vec):
         parms: List of parameter(s) where required, i.e. when a gate is parameterized.
         vec:   An input statevector.
     '''
-    idx_parm = 0
-    for idx, n in enumerate(names):
-        if n=='cz':
-            cz(nq, qargs[idx][0], qargs[idx][1], vec)
-        elif n=='h':
-            h(nq, qargs[idx][0], vec)
-        elif n=='u':
-            op = parms[idx_parm]
-            idx_parm += 1
-            apply_1qb(nq, op, qargs[idx][0], vec)
-        elif n=='mod2qb':
-            mod = parms[idx_parm].reshape(4)
-            idx_parm += 1
-            modulate_2qb(nq, qargs[idx][0], qargs[idx][1], mod, vec)
-
-@njit
-def cz(n, qb0, qb1, vec):
+    circ = circuit.from_lists(names, qargs, parms)
+    do_ops(nq, circ.ops, circ.qubits, circ.poffs, circ.pbuf.astype(vec.dtype), vec)
+
+def do_ops(nq, ops, qubits, poffs, pbuf, vec):
     '''
-    Does a controlled-Z operation between qb0 and qb1,
-    on vec, an n-qubit statevector.
+    Runner function for a compiled circuit (see circuit.py). Calls
+    appropriate numerical routines below to effect each opcode.
+
+    This backend uses NumPy only. Gates act in place on reshaped views
+    of vec, and the only other memory used is a pair of scratch buffers
+    of 2**slab_qubits amplitudes, allocated once per call.
+
+    Args:
+        ops:    Integer opcodes, indexing gatelut in circuit.py.
+        qubits: Qubit(s) each gate is acting on, padded with -1.
+        poffs:  Offsets of each gate's parameters in pbuf.
+        pbuf:   Contiguous buffer of gate parameters.
+        vec:    An input statevector.
+    '''
+    size = min(2**nq, 2**slab_qubits)
+    scratch = (np.empty(size, dtype=vec.dtype), np.empty(size, dtype=vec.dtype))
+    pbuf = pbuf.astype(vec.dtype, copy=False)
+
+    for idx in range(len(ops)):
+        op = ops[idx]
+        qargs = qubits[idx]
+        p = pbuf[poffs[idx]:poffs[idx+1]]
+        if op==0: # h
+            h(nq, qargs[0], vec, scratch)
+        elif op==1: # u
+            apply_1qb(nq, p.reshape(2,2), qargs[0], vec, scratch)
+        elif op==2: # cz
+            cz(nq, qargs[0], qargs[1], vec)
+        elif op==3: # mod2qb
+            modulate_diag(nq, qargs[:2], p, vec)
+        elif op==4: # rz
+            theta = p[0].real
+            mod = np.exp(np.array([-0.5j, 0.5j])*theta).astype(vec.dtype)
+            modulate_diag(nq, qargs[:1], mod, vec)
+        elif op==5: # diag
+            modulate_diag(nq, active_qubits(qargs), p, vec)
+        elif op==6: # unitary
+            qbs = active_qubits(qargs)
+            dim = 2**len(qbs)
+            if len(qbs)==1:
+                apply_1qb(nq, p.reshape(2,2), qbs[0], vec, scratch)
+            else:
+                apply_kqb(nq, p.reshape(dim,dim), qbs, vec, scratch)
+        elif op==7: # swap
+            swap(nq, qargs[0], qargs[1], vec, scratch)
+        elif op==8: # cu
+            qbs = active_qubits(qargs)
+            controlled_1qb(nq, p.reshape(2,2), qbs[:-1], qbs[-1], vec, scratch)
+        elif op==9: # phase
+            phase(nq, active_qubits(qargs), p[0], vec)
+
+def active_qubits(qarg):
+    '''
+    Returns the qubits listed in one row of qargs,
+    dropping the "-1" placeholders.
+    '''
+    return qarg[qarg>=0]
+
+def tensor(n, vec):
+    '''
+    View of vec, an n-qubit statevector, as an n-dimensional array
+    of shape (2,)*n. Axis n-1-q holds qubit q.
     '''
-    q0, q1 = (max(qb0,qb1), min(qb0,qb1))
+    return vec.reshape((2,)*n)
 
-    count_large = 2**(n-q0-1)
-    count_small = 2**(q0-q1-1)
+def select(ndim, values):
+    '''
+    Index into an ndim-dimensional array fixing axis a to values[a], for
+    each axis a in the dictionary values. The trailing Ellipsis makes the
+    result a view even when every axis is fixed.
+    '''
+    idx = [slice(None)]*ndim
+    for a, b in values.items():
+        idx[a] = b
+    return tuple(idx) + (Ellipsis,)
 
-    vec.reshape(count_large,2,count_small,2,-1)[:,1,:,1,:] = \
-        -vec.reshape(count_large,2,count_small,2,-1)[:,1,:,1,:]
+def fixed(n, values):
+    '''
+    Index into tensor(n, vec) fixing qubit q to values[q], for each
+    qubit q in the dictionary values.
+    '''
+    return select(n, {n-1-q: b for q, b in values.items()})
 
-@njit
-def z(n, qb0, vec):
-    count = 2**(n-qb0-1)
-    count_r = 2**(qb0)
+def slabs(n, qbs, ctrls, vec):
+    '''
+    Split the amplitudes of vec, an n-qubit statevector, in which all qubits
+    in ctrls are set into slabs of at most 2**slab_qubits amplitudes, by
+    fixing the values of the highest qubits that are in neither qbs nor ctrls.
+    Yields each slab as an array view, and a function giving the axis of
+    qubit q (in qbs) in that view.
+    '''
+    others = [q for q in range(n-1, -1, -1) if q not in qbs and q not in ctrls]
+    nfix = min(len(others), max(0, n - len(ctrls) - slab_qubits))
+    outer = others[:nfix]
+    kept = [q for q in range(n-1, -1, -1) if q not in outer and q not in ctrls]
+
+    def axis(q):
+        return kept.index(q)
 
-    vin = vec.reshape(count,2,count_r)
+    t = tensor(n, vec)
+    values = {c: 1 for c in ctrls}
+    for bits in itertools.product((0, 1), repeat=nfix):
+        values.update(zip(outer, bits))
+        yield t[fixed(n, values)], axis
 
-    vin[:,1,:] = -vin[:,1,:]
+def pair(slab, ax):
+    '''
+    Views of a slab with the qubit at axis ax set to 0 and to 1.
+    '''
+    return slab[select(slab.ndim, {ax: 0})], slab[select(slab.ndim, {ax: 1})]
 
-    return vin.reshape(2**n)
+def scratch_like(buf, view):
+    return buf[:view.size].reshape(view.shape)
 
-@njit
-def h(n, qb0, vec):
+def cz(n, qb0, qb1, vec):
     '''
-    Does a Hadamard operation targeting qb0,
+    Does a controlled-Z operation between qb0 and qb1,
     on vec, an n-qubit statevector.
     '''
-    count = 2**(n-qb0-1)
-    count_r = 2**(qb0)
+    v = tensor(n, vec)[fixed(n, {qb0: 1, qb1: 1})]
+    np.negative(v, out=v)
 
-    sq2d= 1/np.sqrt(2)
-    sq2 = np.sqrt(2)
+def h(n, qb0, vec, scratch):
+    '''
+    Does a Hadamard operation targeting qb0,
+    on vec, an n-qubit statevector.
+    '''
+    sq2d = 1/np.sqrt(2.)
+    for slab, axis in slabs(n, [qb0], [], vec):
+        v0, v1 = pair(slab, axis(qb0))
+        t = scratch_like(scratch[0], v0)
+        np.add(v0, v1, out=t)
+        np.subtract(v0, v1, out=v1)
+        np.multiply(t, sq2d, out=v0)
+        np.multiply(v1, sq2d, out=v1)
 
-    vec.reshape(count,2,count_r)[:,0,:] =\
-        (vec.reshape(count,2,count_r)[:,0,:] + vec.reshape(count,2,count_r)[:,1,:])*sq2d
-    vec.reshape(count,2,count_r)[:,1,:] = \
-        vec.reshape(count,2,count_r)[:,0,:] - sq2*vec.reshape(count,2,count_r)[:,1,:]
+def rotate_pair(op, v0, v1, scratch):
+    '''
+    (v0, v1) <- (op[0,0]*v0 + op[0,1]*v1, op[1,0]*v0 + op[1,1]*v1), in place.
+    '''
+    t0 = scratch_like(scratch[0], v0)
+    t1 = scratch_like(scratch[1], v0)
+    np.multiply(v0, op[0,0], out=t0)
+    np.multiply(v1, op[0,1], out=t1)
+    np.add(t0, t1, out=t0)
+    np.multiply(v0, op[1,0], out=t1)
+    np.multiply(v1, op[1,1], out=v1)
+    np.add(v1, t1, out=v1)
+    np.copyto(v0, t0)
 
-@njit
-def apply_1qb(n, op, qb0, vec):
+def apply_1qb(n, op, qb0, vec, scratch):
     '''
     Applies a 1-qubit operator "op" targeting qb0,
     on vec, an n-qubit statevector.
     '''
-    count = 2**(n-qb0-1)
-    count_r = 2**(qb0)
+    for slab, axis in slabs(n, [qb0], [], vec):
+        v0, v1 = pair(slab, axis(qb0))
+        rotate_pair(op, v0, v1, scratch)
 
-    temp0 = op[0,0]*vec.reshape(count,2,count_r)[:,0,:] + op[0,1]*vec.reshape(count,2,count_r)[:,1,:]
-    
-    vec.reshape(count,2,count_r)[:,1,:] = \
-        op[1,0]*vec.reshape(count,2,count_r)[:,0,:] + op[1,1]*vec.reshape(count,2,count_r)[:,1,:]
+def controlled_1qb(n, op, ctrls, qb, vec, scratch):
+    '''
+    Applies a 1-qubit operator "op" targeting qb, controlled on all
+    qubits in ctrls being set, on vec, an n-qubit statevector.
+    Only the amplitudes where the controls are set are touched.
+    '''
+    for slab, axis in slabs(n, [qb], list(ctrls), vec):
+        v0, v1 = pair(slab, axis(qb))
+        rotate_pair(op, v0, v1, scratch)
 
-    vec.reshape(count,2,count_r)[:,0,:] = temp0
+def modulate_diag(n, qbs, modulator, vec):
+    '''
+    Modulates vec, an n-qubit statevector, with a diagonal
+    operator acting on the qubits listed in qbs.
 
-@njit
-def modulate_2qb(n, qb0, qb1, modulator, vec):
+    Entries of the modulator are indexed little-endian,
+    i.e. bit j of the index is the value of qubit qbs[j].
     '''
-    Modulates vec, an n-qubit statevector,
-    with a 2-qubit modulator pattern.
+    t = tensor(n, vec)
+    for m in range(2**len(qbs)):
+        v = t[fixed(n, {q: (m >> j) & 1 for j, q in enumerate(qbs)})]
+        np.multiply(v, modulator[m], out=v)
 
-    This is equivalent to treating the modulator as
-    a diagonal 2-qubit operator acting on qb0 and qb1.
+def phase(n, qbs, factor, vec):
     '''
-    q0, q1 = (max(qb0,qb1), min(qb0,qb1))
+    Multiplies the amplitudes of vec, an n-qubit statevector, in which
+    all qubits in qbs are set by factor. This is the diagonal gate
+    diag(1, ..., 1, factor) on qbs, e.g. a (multi-)controlled phase.
+    '''
+    v = tensor(n, vec)[fixed(n, {q: 1 for q in qbs})]
+    np.multiply(v, factor, out=v)
 
-    if qb1>qb0:
-        temp = modulator[2]
-        modulator[2] = modulator[1]
-        modulator[1] = temp
+def swap(n, qb0, qb1, vec, scratch):
+    '''
+    Swaps qubits qb0 and qb1 of vec, an n-qubit statevector.
+    '''
+    for slab, axis in slabs(n, [qb0, qb1], [], vec):
+        v01 = slab[select(slab.ndim, {axis(qb0): 1, axis(qb1): 0})]
+        v10 = slab[select(slab.ndim, {axis(qb0): 0, axis(qb1): 1})]
+        t = scratch_like(scratch[0], v01)
+        np.copyto(t, v01)
+        np.copyto(v01, v10)
+        np.copyto(v10, t)
 
-    count_large = 2**(n-q0-1)
-    count_small = 2**(q0-q1-1)
+def apply_kqb(n, op, qbs, vec, scratch):
+    '''
+    Applies a dense k-qubit operator "op" targeting the qubits
+    listed in qbs, on vec, an n-qubit statevector.
+
+    Rows and columns of op are indexed little-endian,
+    i.e. bit j of the index is the value of qubit qbs[j].
+
+    Each slab is copied into scratch with the targeted qubits as its leading
+    axes, multiplied by op as a (2**k, 2**k) by (2**k, rest) matrix product,
+    and copied back.
+    '''
+    k = len(qbs)
+    for slab, axis in slabs(n, list(qbs), [], vec):
+        # Leading axes in the order of the bits of op's index, highest first
+        v = np.moveaxis(slab, [axis(q) for q in qbs[::-1]], range(k))
+        a = scratch_like(scratch[0], v)
+        b = scratch_like(scratch[1], v)
+        np.copyto(a, v)
+        np.matmul(op, a.reshape(2**k, -1), out=b.reshape(2**k, -1))
+        np.copyto(v, b)
+
+def do_circ_batch(nq, names, qargs, parms, vecs):
+    '''
+    Batched runner function. Applies the same circuit, with different
+    parameters, to each statevector of a batch.
 
-    vec.reshape(count_large,2,count_small,2,-1)[:,0,:,0,:] = \
-        modulator[0]*vec.reshape(count_large,2,count_small,2,-1)[:,0,:,0,:]
+    Args:
+        names: List of strings indicating which gate to perform.
+        qargs: List of integer 2-tuples, indicating which qubit(s) the gate is acting on.
+        parms: Array of shape (batch, nparams, 2, 2), one parameter list per batch element.
+        vecs:  Input statevectors, an array of shape (batch, 2**nq).
+    '''
+    circ, pbufs = batch_params(names, qargs, parms)
+    do_ops_batch(nq, circ.ops, circ.qubits, circ.poffs, pbufs.astype(vecs.dtype), vecs)
 
-    vec.reshape(count_large,2,count_small,2,-1)[:,1,:,0,:] = \
-        modulator[1]*vec.reshape(count_large,2,count_small,2,-1)[:,1,:,0,:]
-        
-    vec.reshape(count_large,2,count_small,2,-1)[:,0,:,1,:] = \
-        modulator[2]*vec.reshape(count_large,2,count_small,2,-1)[:,0,:,1,:]
-    
-    vec.reshape(count_large,2,count_small,2,-1)[:,1,:,1,:] = \
-        modulator[3]*vec.reshape(count_large,2,count_small,2,-1)[:,1,:,1,:]
\ No newline at end of file
+def do_ops_batch(nq, ops, qubits, poffs, pbufs, vecs):
+    '''
+    Batched runner for a compiled circuit; pbufs holds one parameter buffer
+    per statevector in vecs.
+    '''
+    for b in range(len(vecs)):
+        do_ops(nq, ops, qubits, poffs, pbufs[b], vecs[b])
@@ -0,0 +1,95 @@
+import numpy as np
+from numba import njit, prange, get_num_threads
+
+def pauli_masks(paulis):
+    '''
+    Encode Pauli strings as bit masks. Character j of a string is the
+    Pauli operator ('I', 'X', 'Y' or 'Z') acting on qubit j.
+    Returns arrays xmask, zmask and the number of Y factors per string.
+    A Y factor sets both the x and the z bit of its qubit.
+    '''
+    xmask = np.zeros(len(paulis), dtype=np.int64)
+    zmask = np.zeros(len(paulis), dtype=np.int64)
+    ny = np.zeros(len(paulis), dtype=np.int64)
+    for t, ps in enumerate(paulis):
+        for qb, c in enumerate(ps.upper()):
+            if c in 'XY':
+                xmask[t] |= 1 << qb
+            if c in 'ZY':
+                zmask[t] |= 1 << qb
+            if c=='Y':
+                ny[t] += 1
+            elif c not in 'IXZ':
+                raise ValueError("Unknown Pauli operator: " + c)
+
+    return xmask, zmask, ny
+
+def expectation(vec, paulis, coeffs=None):
+    '''
+    Expectation values <vec|P|vec> of a list of Pauli strings, computed
+    from vec in read-only passes, without copying the statevector.
+    Args:
+        vec:    A statevector.
+        paulis: List of Pauli strings (see pauli_masks()).
+        coeffs: Optional list of real coefficients, one per Pauli string.
+    Returns an array holding coeffs[t]*<P_t> for each term; its sum is
+    the expectation value of the Hamiltonian sum_t coeffs[t]*P_t.
+    '''
+    xmask, zmask, ny = pauli_masks(paulis)
+    if coeffs is None:
+        coeffs = np.ones(len(paulis))
+
+    # Terms with the same x mask share a pass over the statevector
+    order = np.argsort(xmask, kind='stable')
+    xgroups, gstart = np.unique(xmask[order], return_index=True)
+    gstart = np.append(gstart, len(order)).astype(np.int64)
+
+    vals = np.empty(len(paulis), dtype=complex)
+    vals[order] = expect_masks(vec, xgroups, gstart, zmask[order], get_num_threads())
+
+    return np.real(np.asarray(coeffs)*vals*(1j)**ny)
+
+@njit(cache=True)
+def parity(x):
+    '''
+    Parity of the number of set bits of x.
+    '''
+    x ^= x >> 32
+    x ^= x >> 16
+    x ^= x >> 8
+    x ^= x >> 4
+    x ^= x >> 2
+    x ^= x >> 1
+    return x & 1
+
+@njit(parallel=True, cache=True)
+def expect_masks(vec, xgroups, gstart, zmasks, nblock):
+    '''
+    For each Pauli term t, sum over basis states i of
+        (-1)**parity(i & zmasks[t]) * conj(vec[i ^ x]) * vec[i],
+    where x is the x mask of the term's group. Terms of group g are
+    zmasks[gstart[g]:gstart[g+1]], and all share x = xgroups[g].
+    This is <vec|P|vec> up to the phase i**(number of Y factors).
+    The statevector is split into nblock blocks, summed in parallel.
+    '''
+    out = np.zeros(len(zmasks), dtype=vec.dtype)
+    size = (len(vec) + nblock - 1)//nblock
+
+    for g in range(len(xgroups)):
+        x = xgroups[g]
+        start = gstart[g]
+        stop = gstart[g+1]
+        acc = np.zeros((nblock, stop-start), dtype=vec.dtype)
+
+        for b in prange(nblock):
+            for i in range(b*size, min((b+1)*size, len(vec))):
+                prod = np.conj(vec[i ^ x])*vec[i]
+                for t in range(start, stop):
+                    if parity(i & zmasks[t]):
+                        acc[b,t-start] -= prod
+                    else:
+                        acc[b,t-start] += prod
+
+        out[start:stop] = acc.sum(axis=0)
+
+    return out
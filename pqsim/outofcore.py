@@ -0,0 +1,139 @@
+import numpy as np
+from . import numbaQC
+from .circuit import circuit
+from .compiler import unpack_circ, pack_circ, gate_matrix
+
+def open_state(path, nq, dtype=complex, mode='w+'):
+    '''
+    Open a statevector of nq qubits stored in the file at path, as an
+    np.memmap. With the default mode 'w+', a new file is created and
+    initialized to the zero state; use mode 'r+' to reopen an existing one.
+    '''
+    vec = np.memmap(path, dtype=dtype, mode=mode, shape=(2**nq,))
+    if mode=='w+':
+        vec[0] = 1.
+    return vec
+
+class outofcore():
+    '''
+    Out-of-core runner, for statevectors that are np.memmap arrays on disk.
+
+    Only a few chunks of 2**chunk_qubits amplitudes are held in memory at
+    once. The circuit is split into segments; each segment is applied in
+    one pass over the file. Gates on qubits below chunk_qubits are applied
+    to each chunk in turn. A segment may also contain gates on up to
+    max_high higher qubits: the chunks that differ only in those qubits are
+    then loaded together into one buffer, in which the higher qubits
+    become ordinary qubits, so that the existing kernels apply as usual.
+    Diagonal gates never require extra chunks, since higher qubits have
+    a fixed value within a chunk.
+    '''
+    def __init__(self, chunk_qubits=24, max_high=2):
+        '''
+        Args:
+            chunk_qubits: Number of qubits in a chunk held in memory.
+            max_high:     Maximum number of higher qubits per segment. Up to
+                          2**max_high chunks are held in memory at once.
+        '''
+        self.chunk_qubits = chunk_qubits
+        self.max_high = max_high
+        self.stats = {}
+
+    def plan(self, nq, names, qargs, parms):
+        '''
+        Split a circuit into segments. Each segment is a pair (high, steps):
+        "high" lists the higher qubits loaded together in the buffer, and
+        each step is either ('ops', circ), a compiled circuit on the buffer's
+        qubits, or ('diag', qbs, diag), a diagonal gate acting on higher qubits.
+        '''
+        nc = self.chunk_qubits
+        gates = unpack_circ(names, qargs, parms)
+
+        segments = []
+        high = []
+        seg_gates = []
+        for gate in gates:
+            diagonal = gate_matrix(*gate).ndim==1
+            need = [] if diagonal else [qb for qb in gate[1] if qb>=nc]
+            new_high = high + [qb for qb in need if qb not in high]
+            if len(new_high)>max(self.max_high, len(need)):
+                segments.append((high, seg_gates))
+                new_high = need
+                seg_gates = []
+            high = new_high
+            seg_gates.append(gate)
+        if len(seg_gates)>0:
+            segments.append((high, seg_gates))
+
+        return [(high, self.plan_steps(high, seg_gates)) for high, seg_gates in segments]
+
+    def plan_steps(self, high, gates):
+        '''
+        Relabel the gates of one segment onto the qubits of its buffer,
+        where higher qubit high[i] becomes qubit chunk_qubits + i.
+        '''
+        nc = self.chunk_qubits
+        relabel = lambda qb: qb if qb<nc else nc + high.index(qb)
+
+        steps = []
+        run = []
+        for gate in gates:
+            name, qbs, data = gate
+            if all(qb<nc or qb in high for qb in qbs):
+                run.append((name, tuple(relabel(qb) for qb in qbs), data))
+            else:
+                if len(run)>0:
+                    steps.append(('ops', circuit.from_lists(*pack_circ(run))))
+                    run = []
+                steps.append(('diag', np.array(qbs, dtype=np.int64), gate_matrix(*gate)))
+        if len(run)>0:
+            steps.append(('ops', circuit.from_lists(*pack_circ(run))))
+
+        return steps
+
+    def run(self, nq, names, qargs, parms, vec):
+        '''
+        Apply a circuit to vec, an np.memmap holding an nq-qubit statevector.
+        Bytes read from and written to vec are reported in self.stats.
+        '''
+        nc = min(self.chunk_qubits, nq)
+        size = 2**nc
+        nchunk = 2**(nq-nc)
+        itemsize = vec.dtype.itemsize
+        segments = self.plan(nq, names, qargs, parms)
+
+        nread = 0
+        nwritten = 0
+        for high, steps in segments:
+            nh = len(high)
+            hmask = sum(1 << (qb-nc) for qb in high)
+            buf = np.empty(size*2**nh, dtype=vec.dtype)
+            steps = [(s[0], s[1].astype(vec.dtype)) if s[0]=='ops' else s for s in steps]
+
+            for base in range(nchunk):
+                if base & hmask:
+                    continue
+                cids = [base + sum(((j >> i) & 1) << (high[i]-nc) for i in range(nh))\
+                    for j in range(2**nh)]
+
+                for j, cid in enumerate(cids):
+                    buf[j*size:(j+1)*size] = vec[cid*size:(cid+1)*size]
+                nread += len(buf)*itemsize
+
+                for step in steps:
+                    if step[0]=='ops':
+                        c = step[1]
+                        numbaQC.do_ops(nc+nh, c.ops, c.qubits, c.poffs, c.pbuf, buf)
+                    else:
+                        mod = step[2].astype(vec.dtype)
+                        for j, cid in enumerate(cids):
+                            numbaQC.modulate_offset(nc, cid*size, step[1], mod,\
+                                buf[j*size:(j+1)*size])
+
+                for j, cid in enumerate(cids):
+                    vec[cid*size:(cid+1)*size] = buf[j*size:(j+1)*size]
+                nwritten += len(buf)*itemsize
+
+        vec.flush()
+        self.stats = {'gates': len(names), 'passes': len(segments),
+            'bytes_read': nread, 'bytes_written': nwritten}
@@ -0,0 +1,114 @@
+import time
+import numpy as np
+from .circuit import gatelut
+
+def touched_fraction(op, nqb):
+    '''
+    Fraction of the statevector a gate's kernel reads and writes, for
+    opcode op acting on nqb qubits (see gatelut in circuit.py).
+    '''
+    if op==2: # cz
+        return 0.25
+    elif op==7: # swap
+        return 0.5
+    elif op==8: # cu, touching amplitudes where the controls are set
+        return 0.5**(nqb - 1)
+    elif op==9: # phase
+        return 0.5**nqb
+    return 1.
+
+def bytes_touched(nq, circ, itemsize):
+    '''
+    Bytes of statevector that the gates of a compiled circuit read and
+    write, each amplitude touched by a gate being read and written once.
+    This is the minimum memory traffic of the Numba kernels.
+    '''
+    nqbs = (circ.qubits>=0).sum(axis=1)
+    frac = np.array([touched_fraction(op, k) for op, k in zip(circ.ops, nqbs)])
+    return int(2*itemsize*2**nq*frac.sum())
+
+class profiler():
+    '''
+    Instrumented runner for compiled circuits. Gates are run one at a time
+    through the backend's usual do_ops(), and timed from Python, so that
+    neither the kernels nor the uninstrumented runner are changed.
+
+    Gates are grouped by name and by position: the highest qubit they act
+    on, which sets the stride of the kernel's memory accesses. Each group
+    records the number of calls, wall time, and bytes touched (see
+    bytes_touched()). Timings include the dispatch of one do_ops() call per
+    gate, of a few microseconds, which the report gives as 'overhead'.
+    '''
+    def __init__(self):
+        self.stats = {}
+
+    def run(self, nq, circ, vec, nQC):
+        '''
+        Run a compiled circuit on vec with backend module nQC, timing every gate.
+        The aggregate report is left in self.stats (see report()).
+        '''
+        ops, qubits, poffs, pbuf = circ.ops, circ.qubits, circ.poffs, circ.pbuf
+
+        # An empty call compiles the runner, and measures the dispatch overhead
+        nQC.do_ops(nq, ops[:0], qubits[:0], poffs[:1], pbuf, vec)
+        start = time.perf_counter()
+        nQC.do_ops(nq, ops[:0], qubits[:0], poffs[:1], pbuf, vec)
+        overhead = time.perf_counter() - start
+
+        seconds = np.zeros(len(ops))
+        for idx in range(len(ops)):
+            start = time.perf_counter()
+            nQC.do_ops(nq, ops[idx:idx+1], qubits[idx:idx+1], poffs[idx:idx+2], pbuf, vec)
+            seconds[idx] = time.perf_counter() - start
+
+        self.stats = self.report(nq, circ, seconds, vec.dtype.itemsize, overhead)
+
+    @staticmethod
+    def report(nq, circ, seconds, itemsize, overhead=0.):
+        '''
+        Aggregate per-gate timings into a dictionary holding
+            total:    calls, seconds, bytes and bandwidth (bytes/s) of the run.
+            gates:    the same per gate name, slowest first.
+            position: the same per gate name and highest qubit, slowest first.
+            overhead: seconds of dispatch included in every call's timing.
+        '''
+        nqbs = (circ.qubits>=0).sum(axis=1)
+        top = circ.qubits.max(axis=1) if len(circ) else np.zeros(0, dtype=np.int64)
+        nbytes = np.array([2*itemsize*2**nq*touched_fraction(op, k)\
+            for op, k in zip(circ.ops, nqbs)])
+
+        def group(keys):
+            rows = {}
+            for idx, k in enumerate(keys):
+                row = rows.setdefault(k, {'calls': 0, 'seconds': 0., 'bytes': 0})
+                row['calls'] += 1
+                row['seconds'] += float(seconds[idx])
+                row['bytes'] += int(nbytes[idx])
+            for row in rows.values():
+                row['bandwidth'] = row['bytes']/row['seconds'] if row['seconds']>0 else 0.
+            return rows
+
+        gates = group([gatelut[op] for op in circ.ops])
+        position = group([(gatelut[op], int(qb)) for op, qb in zip(circ.ops, top)])
+        total = group(['all']*len(circ)).get('all',\
+            {'calls': 0, 'seconds': 0., 'bytes': 0, 'bandwidth': 0.})
+
+        return {'total': total,\
+            'gates': [dict(gate=k, **v) for k, v in\
+                sorted(gates.items(), key=lambda kv: -kv[1]['seconds'])],\
+            'position': [dict(gate=k[0], qubit=k[1], **v) for k, v in\
+                sorted(position.items(), key=lambda kv: -kv[1]['seconds'])],\
+            'overhead': overhead}
+
+def table(stats, position=False):
+    '''
+    A profiling report (see profiler.report()) as lines of text, per gate
+    name, or per gate name and highest qubit if position is True.
+    '''
+    lines = ["gate      qubit   calls   seconds  share     GB/s"]
+    total = max(stats['total']['seconds'], 1e-300)
+    for row in stats['position' if position else 'gates']:
+        lines.append("%-8s %6s %7d %9.4f %5.1f%% %8.2f" % (row['gate'],\
+            row.get('qubit', '-'), row['calls'], row['seconds'],\
+            100*row['seconds']/total, row['bandwidth']/1e9))
+    return lines
@@ -0,0 +1,165 @@
+import numpy as np
+from .circuit import circuit
+
+# Instructions that do not act on the statevector, and are skipped
+ignored = ['barrier', 'measure', 'delay', 'id']
+
+class growbuf():
+    '''
+    Array of rows that doubles its capacity as rows are appended,
+    so that the number of rows need not be known in advance.
+    '''
+    def __init__(self, shape, dtype, fill=0):
+        self.fill = fill
+        self.data = np.full((64,) + shape, fill, dtype=dtype)
+        self.size = 0
+
+    def reserve(self, n):
+        if self.size + n>len(self.data):
+            new = np.full((max(2*len(self.data), self.size + n),) + self.data.shape[1:],\
+                self.fill, dtype=self.data.dtype)
+            new[:self.size] = self.data[:self.size]
+            self.data = new
+
+    def widen(self, width):
+        '''
+        Make rows (of a 2D buffer) at least width entries long.
+        '''
+        if self.data.shape[1]<width:
+            new = np.full((len(self.data), width), self.fill, dtype=self.data.dtype)
+            new[:,:self.data.shape[1]] = self.data
+            self.data = new
+
+    def append(self, row):
+        self.reserve(1)
+        self.data[self.size] = row
+        self.size += 1
+
+    def extend(self, rows):
+        self.reserve(len(rows))
+        self.data[self.size:self.size + len(rows)] = rows
+        self.size += len(rows)
+
+    def array(self):
+        return self.data[:self.size]
+
+def native_form(op):
+    '''
+    Opcode and parameters of a Qiskit gate without a dedicated kernel,
+    from its matrix. Qiskit orders matrix indices little-endian over the
+    gate's qubits, as pqsim does, and lists the target of a controlled
+    gate last. A gate that acts as a 1-qubit U on its last qubit when all
+    others are set, and as the identity otherwise, becomes 'phase' if
+    U = diag(1, f) and 'cu' if U is not diagonal. Otherwise, a diagonal
+    gate becomes 'diag', any other 1-qubit gate 'u', and larger gates
+    'unitary'.
+    '''
+    try:
+        mat = np.asarray(op.to_matrix(), dtype=complex)
+    except Exception:
+        mat = None
+    if mat is None:
+        # Multi-controlled gates such as mcx have no to_matrix()
+        nc = getattr(op, 'num_ctrl_qubits', 0)
+        if nc==0 or op.ctrl_state!=2**nc - 1 or op.base_gate.num_qubits!=1:
+            raise ValueError("Unsupported instruction: " + op.name)
+        mat = np.eye(2**(nc+1), dtype=complex)
+        mat[2**nc-1::2**nc, 2**nc-1::2**nc] = op.base_gate.to_matrix()
+    dim = len(mat)
+    diagonal = np.count_nonzero(mat - np.diag(np.diag(mat)))==0
+
+    if dim>2:
+        on = dim//2 - 1
+        sub = mat[on::dim//2, on::dim//2].copy()
+        rest = mat.copy()
+        rest[on::dim//2, on::dim//2] = np.eye(2)
+        if np.count_nonzero(rest - np.eye(dim))==0:
+            if sub[0,1]==0 and sub[1,0]==0 and sub[0,0]==1:
+                return 9, sub[1,1:] # phase
+            if not diagonal:
+                return 8, sub.reshape(-1) # cu
+
+    if diagonal:
+        return 5, np.diag(mat) # diag
+    if dim==2:
+        return 1, mat.reshape(-1) # u
+    return 6, mat.reshape(-1) # unitary
+
+class importer():
+    '''
+    Single-pass converter of Qiskit circuits into compiled circuits.
+
+    Qubits are looked up in a dictionary, and the opcodes, qubits and
+    parameters are written into growing buffers as the circuit is read.
+    h, cz, rz and swap map to their own kernels. Other gates are converted
+    by native_form(): controlled gates such as cx, ccx or cp map to the
+    'cu' and 'phase' kernels, and the rest to 'u', 'diag' or 'unitary'.
+    Conversions of standard gates are cached per gate name, number of
+    qubits and parameters, so repeated gates such as x, cx, s, t or
+    rotations by the same angle are only converted once.
+    '''
+    def __init__(self):
+        self.cache = {}
+
+    def lookup(self, inst):
+        if inst.is_standard_gate():
+            key = (inst.name, len(inst.qubits), tuple(inst.params))
+            if key in self.cache:
+                return self.cache[key]
+        # Other gates, such as a UnitaryGate, are defined by more than
+        # their name and parameters, and are converted every time
+        form = native_form(inst.operation)
+        if inst.is_standard_gate():
+            self.cache[key] = form
+        return form
+
+    def run(self, qc):
+        '''
+        Convert the Qiskit circuit qc. Measurements and barriers are
+        skipped; other non-unitary instructions raise a ValueError.
+        Returns the number of qubits and the compiled circuit.
+        '''
+        index = {qb: i for i, qb in enumerate(qc.qubits)}
+        ops = growbuf((), np.int8)
+        qubits = growbuf((2,), np.int64, fill=-1)
+        poffs = growbuf((), np.int64)
+        pbuf = growbuf((), complex)
+        poffs.append(0)
+
+        def emit(op, qbs, p=()):
+            ops.append(op)
+            qubits.reserve(1)
+            qubits.data[qubits.size,:len(qbs)] = qbs
+            qubits.size += 1
+            pbuf.extend(p)
+            poffs.append(pbuf.size)
+
+        # The gate name and parameters are read from the instruction itself,
+        # as building its operation object is slow in recent Qiskit versions.
+        for inst in qc.data:
+            name = inst.name
+            qbs = [index[qb] for qb in inst.qubits]
+            if name in ignored:
+                continue
+            elif name=='h':
+                emit(0, qbs)
+            elif name=='cz':
+                emit(2, qbs)
+            elif name=='rz':
+                emit(4, qbs, [float(inst.params[0])])
+            elif name=='swap':
+                emit(7, qbs)
+            else:
+                code, p = self.lookup(inst)
+                qubits.widen(len(qbs))
+                emit(code, qbs, p)
+
+        return len(index), circuit(ops.array(), qubits.array(), poffs.array(), pbuf.array())
+
+def from_qiskit(qc):
+    '''
+    Convert a Qiskit circuit into a compiled circuit, which can be passed
+    to qsim.run() in place of the names list.
+    Returns the number of qubits and the compiled circuit.
+    '''
+    return importer().run(qc)
@@ -0,0 +1,229 @@
+import numpy as np
+from numba import njit, prange, get_num_threads
+
+# Amplitudes per chunk in the parallel cumulative pass
+chunk_size = 2**14
+
+# Largest qubit subset for which we sample from the marginal distribution
+marginal_qubits = 20
+
+def sample(vec, shots, qubits=None, method='sorted', seed=None, shuffle=True):
+    '''
+    Draw measurement outcomes from a statevector, without building the
+    full probability vector.
+    Args:
+        vec:     A statevector (need not be normalized).
+        shots:   Number of outcomes to draw.
+        qubits:  Optional list of qubits to measure; defaults to all qubits.
+        method:  'sorted' walks the cumulative distribution once with sorted
+                 uniform draws; 'alias' builds an alias table and draws each shot
+                 in constant time (only for qubit subsets up to marginal_qubits).
+        seed:    Optional seed for the random number generator.
+        shuffle: If False, outcomes are returned in ascending order.
+    Returns an int64 array of outcomes. Bit j of an outcome is the value
+    of qubits[j] (or of qubit j when measuring all qubits).
+    '''
+    if seed is not None:
+        seed_rng(seed)
+
+    if qubits is not None:
+        qubits = np.asarray(qubits, dtype=np.int64)
+
+    if qubits is not None and len(qubits)<=marginal_qubits:
+        probs = marginal(vec, qubits)
+        if method=='alias':
+            prob, alias = alias_table(probs)
+            out = alias_draw(prob, alias, shots)
+        else:
+            draws = sorted_uniforms(shots, probs.sum())
+            out = np.searchsorted(np.cumsum(probs), draws, side='right')
+            out = np.minimum(out, len(probs)-1)
+    else:
+        if method=='alias':
+            raise ValueError("Alias sampling requires a subset of at most "\
+                + str(marginal_qubits) + " qubits.")
+        sums = chunk_sums(vec, chunk_size)
+        draws = sorted_uniforms(shots, sums.sum())
+        out = sample_sorted(vec, draws, chunk_size, sums)
+        if qubits is not None:
+            out = pack_bits(out, qubits)
+
+    if shuffle:
+        shuffle_rng(out)
+    return out
+
+def counts(vec, shots, qubits=None, method='sorted', seed=None):
+    '''
+    Like sample(), but returns a histogram: an array of distinct
+    outcomes in ascending order, and an array of how often each occurred.
+    '''
+    out = sample(vec, shots, qubits=qubits, method=method, seed=seed, shuffle=False)
+    return np.unique(out, return_counts=True)
+
+@njit(cache=True)
+def seed_rng(seed):
+    '''
+    Seed the random number generator used by Numba-compiled code.
+    '''
+    np.random.seed(seed)
+
+@njit(cache=True)
+def shuffle_rng(arr):
+    '''
+    Shuffle arr in place with the Numba random number generator.
+    '''
+    np.random.shuffle(arr)
+
+@njit(parallel=True, cache=True)
+def chunk_sums(vec, size):
+    '''
+    Total probability held by each chunk of "size" amplitudes of vec.
+    '''
+    nchunk = (len(vec) + size - 1)//size
+    sums = np.zeros(nchunk)
+    for c in prange(nchunk):
+        acc = 0.
+        for i in range(c*size, min((c+1)*size, len(vec))):
+            acc += vec[i].real**2 + vec[i].imag**2
+        sums[c] = acc
+
+    return sums
+
+@njit(cache=True)
+def sorted_uniforms(shots, total):
+    '''
+    Draw "shots" uniform numbers on [0,total) in ascending order, in linear
+    time, from normalized partial sums of exponential variates.
+    '''
+    spacing = np.random.exponential(1., shots+1)
+    cum = np.cumsum(spacing)
+    return cum[:shots]*(total/cum[shots])
+
+@njit(parallel=True, cache=True)
+def sample_sorted(vec, draws, size, sums):
+    '''
+    Map sorted uniform draws to basis states of vec, in one pass over the
+    amplitudes. Each chunk of "size" amplitudes is walked in parallel,
+    using the chunk totals in sums to find which draws land in it.
+    '''
+    bounds = np.zeros(len(sums)+1)
+    bounds[1:] = np.cumsum(sums)
+    first = np.searchsorted(draws, bounds)
+    first[-1] = len(draws)
+    out = np.empty(len(draws), dtype=np.int64)
+
+    for c in prange(len(sums)):
+        d = first[c]
+        stop = first[c+1]
+        acc = bounds[c]
+        last = c*size
+        for i in range(c*size, min((c+1)*size, len(vec))):
+            if d==stop:
+                break
+            p = vec[i].real**2 + vec[i].imag**2
+            if p>0:
+                last = i
+            acc += p
+            while d<stop and draws[d]<acc:
+                out[d] = i
+                d += 1
+
+        # Draws lost to rounding go to the last non-zero amplitude
+        while d<stop:
+            out[d] = last
+            d += 1
+
+    return out
+
+def marginal(vec, qubits):
+    '''
+    Marginal probability distribution of vec over the listed qubits,
+    computed in one pass without building the full probability vector.
+    Entry m of the result has bit j equal to the value of qubits[j].
+    '''
+    qubits = np.asarray(qubits, dtype=np.int64)
+    return marginal_blocks(vec, qubits, get_num_threads())
+
+@njit(parallel=True, cache=True)
+def marginal_blocks(vec, qubits, nblock):
+    '''
+    Computes marginal(), splitting vec into nblock blocks that are
+    histogrammed in parallel.
+    '''
+    k = len(qubits)
+    size = (len(vec) + nblock - 1)//nblock
+    hist = np.zeros((nblock, 2**k))
+
+    for b in prange(nblock):
+        for i in range(b*size, min((b+1)*size, len(vec))):
+            m = 0
+            for j in range(k):
+                m += ((i >> qubits[j]) & 1) << j
+            hist[b,m] += vec[i].real**2 + vec[i].imag**2
+
+    return hist.sum(axis=0)
+
+@njit(parallel=True, cache=True)
+def pack_bits(outcomes, qubits):
+    '''
+    Keep only the listed qubits of each outcome; bit j of the
+    result is bit qubits[j] of the outcome.
+    '''
+    out = np.zeros(len(outcomes), dtype=np.int64)
+    for s in prange(len(outcomes)):
+        for j in range(len(qubits)):
+            out[s] += ((outcomes[s] >> qubits[j]) & 1) << j
+
+    return out
+
+@njit(cache=True)
+def alias_table(probs):
+    '''
+    Build a Walker/Vose alias table for the (unnormalized) distribution probs.
+    '''
+    n = len(probs)
+    scaled = probs*(n/probs.sum())
+    prob = np.ones(n)
+    alias = np.arange(n)
+
+    small = np.empty(n, dtype=np.int64)
+    large = np.empty(n, dtype=np.int64)
+    ns = 0
+    nl = 0
+    for i in range(n):
+        if scaled[i]<1.:
+            small[ns] = i
+            ns += 1
+        else:
+            large[nl] = i
+            nl += 1
+
+    while ns>0 and nl>0:
+        ns -= 1
+        s = small[ns]
+        l = large[nl-1]
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] = scaled[l] + scaled[s] - 1.
+        if scaled[l]<1.:
+            nl -= 1
+            small[ns] = l
+            ns += 1
+
+    return prob, alias
+
+@njit(parallel=True, cache=True)
+def alias_draw(prob, alias, shots):
+    '''
+    Draw "shots" outcomes from an alias table built by alias_table().
+    '''
+    u = np.random.random(shots)*len(prob)
+    out = np.empty(shots, dtype=np.int64)
+    for s in prange(shots):
+        i = int(u[s])
+        if u[s] - i < prob[i]:
+            out[s] = i
+        else:
+            out[s] = alias[i]
+
+    return out
@@ -0,0 +1,114 @@
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+class snapshots():
+    '''
+    Cache of intermediate statevectors, for re-running circuits that share a
+    prefix with earlier runs, e.g. in optimisation loops where only the
+    parameters of the last layers change.
+
+    States are stored at checkpoints: gate positions spread over the circuit,
+    and its end. Each is keyed by a hash of the circuit prefix up to the
+    checkpoint (the opcodes, qubits and parameters of its gates, with the
+    number of qubits and the precision), computed incrementally, one slice of
+    the compiled circuit per checkpoint. A run starting from the zero state
+    resumes from the deepest checkpoint whose prefix is cached, and stores
+    the states it reaches at later checkpoints. The least recently used
+    states are evicted to keep the cache within its memory budget.
+    '''
+    def __init__(self, budget=2**30, every=None, checkpoints=None):
+        '''
+        Args:
+            budget:      Memory budget of the cached statevectors, in bytes.
+            every:       Checkpoint every "every" gates. Defaults to 8
+                         checkpoints per circuit.
+            checkpoints: Optional list of gate positions to use as checkpoints
+                         instead; position i holds the state after the first
+                         i gates.
+        '''
+        self.budget = budget
+        self.every = every
+        self.checkpoints = checkpoints
+        self.states = OrderedDict()
+        self.nbytes = 0
+        self.stats = {}
+
+    def positions(self, ngates):
+        '''
+        Checkpoint positions for a circuit of ngates gates, in increasing order.
+        '''
+        if self.checkpoints is not None:
+            pos = [int(c) for c in self.checkpoints if 0<c<=ngates]
+        else:
+            every = self.every if self.every is not None else max(1, -(-ngates//8))
+            pos = list(range(every, ngates, every))
+        return sorted(set(pos + [ngates])) if ngates>0 else []
+
+    @staticmethod
+    def keys(nq, circ, pos):
+        '''
+        Hashes of the prefixes of a compiled circuit ending at each position in pos.
+        '''
+        h = hashlib.blake2b(digest_size=16)
+        h.update(np.array([nq, circ.qubits.shape[1]], dtype=np.int64).tobytes())
+        h.update(circ.pbuf.dtype.str.encode())
+        keys = []
+        prev = 0
+        for p in pos:
+            h.update(circ.ops[prev:p].tobytes())
+            h.update(circ.qubits[prev:p].tobytes())
+            h.update(circ.pbuf[circ.poffs[prev]:circ.poffs[p]].tobytes())
+            keys.append(h.hexdigest())
+            prev = p
+        return keys
+
+    def store(self, key, vec):
+        '''
+        Cache a copy of vec under key, evicting the least recently used
+        states as needed. States larger than the budget are not cached.
+        Returns whether vec was cached.
+        '''
+        if vec.nbytes>self.budget:
+            return False
+        while self.nbytes + vec.nbytes>self.budget:
+            k, old = self.states.popitem(last=False)
+            self.nbytes -= old.nbytes
+            self.stats['evictions'] += 1
+        self.states[key] = vec.copy()
+        self.nbytes += vec.nbytes
+        return True
+
+    def run(self, nq, circ, vec, nQC):
+        '''
+        Run a compiled circuit on vec, which must hold the zero state, with
+        backend module nQC, resuming from the deepest cached prefix.
+        '''
+        pos = self.positions(len(circ))
+        keys = self.keys(nq, circ, pos)
+        self.stats = {'gates_run': 0, 'stored': 0, 'evictions': 0}
+
+        start = 0
+        for p, k in reversed(list(zip(pos, keys))):
+            if k in self.states:
+                self.states.move_to_end(k)
+                vec[:] = self.states[k]
+                start = p
+                break
+
+        for p, k in zip(pos, keys):
+            if p<=start:
+                continue
+            nQC.do_ops(nq, circ.ops[start:p], circ.qubits[start:p], circ.poffs[start:p+1],\
+                circ.pbuf, vec)
+            self.stats['gates_run'] += p - start
+            start = p
+            if k not in self.states and self.store(k, vec):
+                self.stats['stored'] += 1
+
+        self.stats.update(resumed_at=len(circ) - self.stats['gates_run'],\
+            entries=len(self.states), bytes=self.nbytes)
+
+    def clear(self):
+        self.states.clear()
+        self.nbytes = 0
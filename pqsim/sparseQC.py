@@ -0,0 +1,240 @@
+import numpy as np
+from .circuit import circuit, batch_params
+
+# Amplitudes smaller than this in magnitude, e.g. left over where a gate
+# makes amplitudes cancel, are dropped from sparse states
+drop_tol = 1e-14
+
+def do_circ(nq, names, qargs, parms, vec):
+    '''
+    Runner function. Converts the gate lists to a compiled circuit
+    and calls do_ops() to effect gates as listed in names, qargs, and parms.
+
+    Args:
+        names: List of strings indicating which gate to perform.
+        qargs: List of integer 2-tuples, indicating which qubit(s) the gate is acting on.
+        parms: List of parameter(s) where required, i.e. when a gate is parameterized.
+        vec:   An input statevector.
+    '''
+    circ = circuit.from_lists(names, qargs, parms)
+    do_ops(nq, circ.ops, circ.qubits, circ.poffs, circ.pbuf.astype(vec.dtype), vec)
+
+def do_ops(nq, ops, qubits, poffs, pbuf, vec):
+    '''
+    Runner function for a compiled circuit (see circuit.py), on a dense
+    statevector vec: its non-zero amplitudes are run as a sparse state,
+    which falls back to dense kernels if it fills up (see state), and the
+    result is written back into vec.
+
+    Args:
+        ops:    Integer opcodes, indexing gatelut in circuit.py.
+        qubits: Qubit(s) each gate is acting on, padded with -1.
+        poffs:  Offsets of each gate's parameters in pbuf.
+        pbuf:   Contiguous buffer of gate parameters.
+        vec:    An input statevector.
+    '''
+    st = state(nq, dtype=vec.dtype)
+    st.set_dense(vec)
+    st.run(circuit(ops, qubits, poffs, pbuf, dtype=vec.dtype))
+    if st.vec is not None:
+        vec[:] = st.vec
+    else:
+        vec[:] = 0
+        vec[st.idx] = st.amp
+
+class state():
+    '''
+    Sparse statevector: sorted arrays of the indices of the non-zero
+    amplitudes, and of those amplitudes.
+
+    Diagonal gates rescale the amplitudes in place. Other gates group the
+    non-zero amplitudes by the bits of the indices outside the gate's qubits,
+    gather each group into a row of 2**k amplitudes, and multiply the rows by
+    the gate's operator, so the work scales with the number of non-zero
+    amplitudes rather than with 2**nq.
+
+    Once the fill ratio (non-zero amplitudes over 2**nq) exceeds dense_fill,
+    sparse gates cost more than dense ones, and the state is converted to a
+    dense statevector run by the dense backend from then on.
+    '''
+    def __init__(self, nq, dtype=complex, dense_fill=1/64, max_dense_qubits=30,\
+        dense='numba'):
+        '''
+        Args:
+            nq:         Number of qubits; up to 62. The state starts as the zero state.
+            dtype:      Precision of the amplitudes.
+            dense_fill: Fill ratio above which the state is made dense.
+            max_dense_qubits: States of more qubits always stay sparse.
+            dense:      Backend used once dense, 'numba' or 'numpy'.
+        '''
+        if nq>62:
+            raise ValueError("Sparse states hold at most 62 qubits.")
+        self.nq = nq
+        self.dtype = np.dtype(dtype)
+        self.dense_fill = dense_fill
+        self.max_dense_qubits = max_dense_qubits
+        self.dense = dense
+        self.idx = np.zeros(1, dtype=np.int64)
+        self.amp = np.ones(1, dtype=self.dtype)
+        self.vec = None
+        self.stats = {}
+
+    @property
+    def fill(self):
+        '''
+        Fraction of the 2**nq amplitudes that are stored.
+        '''
+        if self.vec is not None:
+            return 1.
+        return len(self.idx)/2.**self.nq
+
+    def set_dense(self, vec):
+        '''
+        Set the state to the non-zero amplitudes of a dense statevector.
+        '''
+        self.idx = np.nonzero(vec)[0].astype(np.int64)
+        self.amp = vec[self.idx].astype(self.dtype)
+        self.vec = None
+
+    def todense(self):
+        '''
+        The state as a dense statevector.
+        '''
+        if self.vec is not None:
+            return self.vec
+        vec = np.zeros(2**self.nq, dtype=self.dtype)
+        vec[self.idx] = self.amp
+        return vec
+
+    def make_dense(self):
+        self.vec = self.todense()
+        self.idx = None
+        self.amp = None
+
+    def run(self, circ):
+        '''
+        Apply a compiled circuit, switching to the dense backend when the
+        state fills up. Gates run sparse and dense, the largest number of
+        non-zero amplitudes and the gate at which the state was made dense
+        are reported in self.stats.
+        '''
+        circ = circ.astype(self.dtype)
+        self.stats = {'sparse_gates': 0, 'dense_gates': 0, 'max_nonzero': 0, 'switched_at': None}
+        start = len(circ)
+        if self.vec is None:
+            for idx in range(len(circ)):
+                p = circ.pbuf[circ.poffs[idx]:circ.poffs[idx+1]]
+                self.apply(circ.ops[idx], circ.qubits[idx], p)
+                self.stats['max_nonzero'] = max(self.stats['max_nonzero'], len(self.idx))
+                self.stats['sparse_gates'] += 1
+                if self.fill>self.dense_fill and self.nq<=self.max_dense_qubits\
+                    and idx+1<len(circ):
+                    self.make_dense()
+                    self.stats['switched_at'] = idx + 1
+                    start = idx + 1
+                    break
+        else:
+            start = 0
+
+        if start<len(circ):
+            if self.dense=='numba':
+                from . import numbaQC as nQC
+            else:
+                from . import numpyQC as nQC
+            nQC.do_ops(self.nq, circ.ops[start:], circ.qubits[start:], circ.poffs[start:],\
+                circ.pbuf, self.vec)
+            self.stats['dense_gates'] = len(circ) - start
+
+    def apply(self, op, qargs, p):
+        '''
+        Apply one gate, given its opcode, row of qubits and parameters.
+        '''
+        qbs = qargs[qargs>=0]
+        if op==0: # h
+            sq2d = 1/np.sqrt(2.)
+            self.apply_dense(qbs[:1], np.array([[sq2d, sq2d], [sq2d, -sq2d]]), 0)
+        elif op==1: # u
+            self.apply_dense(qbs[:1], p.reshape(2,2), 0)
+        elif op==2: # cz
+            self.amp[bits(self.idx, qbs[:2])==3] *= -1
+        elif op==3: # mod2qb
+            self.amp *= p[bits(self.idx, qbs[:2])]
+        elif op==4: # rz
+            mod = np.exp(np.array([-0.5j, 0.5j])*p[0].real).astype(self.dtype)
+            self.amp *= mod[bits(self.idx, qbs[:1])]
+        elif op==5: # diag
+            self.amp *= p[bits(self.idx, qbs)]
+        elif op==6: # unitary
+            dim = 2**len(qbs)
+            self.apply_dense(qbs, p.reshape(dim,dim), 0)
+        elif op==7: # swap
+            flip = ((self.idx >> qbs[0]) ^ (self.idx >> qbs[1])) & 1
+            idx = self.idx ^ ((flip << qbs[0]) | (flip << qbs[1]))
+            order = np.argsort(idx)
+            self.idx = idx[order]
+            self.amp = self.amp[order]
+        elif op==8: # cu
+            ctrl = int(np.sum(1 << qbs[:-1]))
+            self.apply_dense(qbs[-1:], p.reshape(2,2), ctrl)
+        elif op==9: # phase
+            self.amp[bits(self.idx, qbs)==2**len(qbs)-1] *= p[0]
+
+    def apply_dense(self, qbs, op, ctrl):
+        '''
+        Apply a dense operator "op" on the qubits listed in qbs, to the
+        amplitudes whose indices have all bits in the mask ctrl set.
+        Rows and columns of op are indexed little-endian over qbs.
+        '''
+        mask = int(np.sum(1 << qbs.astype(np.int64)))
+        sel = (self.idx & ctrl)==ctrl
+        idx = self.idx[sel]
+
+        # One row of 2**k amplitudes per distinct value of the other bits
+        rest, row = np.unique(idx & ~mask, return_inverse=True)
+        rows = np.zeros((len(rest), len(op)), dtype=self.dtype)
+        rows[row.reshape(-1), bits(idx, qbs)] = self.amp[sel]
+        rows = rows @ op.T.astype(self.dtype)
+
+        new_idx = (rest[:,None] | deposit(np.arange(len(op)), qbs)[None,:]).reshape(-1)
+        new_amp = rows.reshape(-1)
+        keep = np.abs(new_amp)>drop_tol
+
+        idx = np.concatenate([self.idx[~sel], new_idx[keep]])
+        amp = np.concatenate([self.amp[~sel], new_amp[keep]])
+        order = np.argsort(idx)
+        self.idx = idx[order]
+        self.amp = amp[order]
+
+def bits(idx, qbs):
+    '''
+    For each index, the integer whose bit j is the bit of the index at qbs[j].
+    '''
+    out = np.zeros(len(idx), dtype=np.int64)
+    for j, q in enumerate(qbs):
+        out |= ((idx >> q) & 1) << j
+    return out
+
+def deposit(vals, qbs):
+    '''
+    Inverse of bits(): for each value, the index whose bit at qbs[j]
+    is bit j of the value, and whose other bits are 0.
+    '''
+    out = np.zeros(len(vals), dtype=np.int64)
+    for j, q in enumerate(qbs):
+        out |= ((vals >> j) & 1) << q
+    return out
+
+def do_circ_batch(nq, names, qargs, parms, vecs):
+    '''
+    Batched runner function. Applies the same circuit, with different
+    parameters, to each statevector of a batch.
+
+    Args:
+        names: List of strings indicating which gate to perform.
+        qargs: List of integer 2-tuples, indicating which qubit(s) the gate is acting on.
+        parms: Array of shape (batch, nparams, 2, 2), one parameter list per batch element.
+        vecs:  Input statevectors, an array of shape (batch, 2**nq).
+    '''
+    circ, pbufs = batch_params(names, qargs, parms)
+    for b in range(len(vecs)):
+        do_ops(nq, circ.ops, circ.qubits, circ.poffs, pbufs[b].astype(vecs.dtype), vecs[b])
@@ -0,0 +1,139 @@
+import os
+import sys
+import json
+import time
+import contextlib
+import tempfile
+import subprocess
+import numpy as np
+
+def sample_circuit():
+    '''
+    A 3-qubit circuit using every gate in gatelut, used to compile
+    all branches of the runners.
+    '''
+    from .compiler import pack_circ
+    u = np.array([[0,1],[1,0]], dtype=complex).reshape(1,2,2)
+    gates = [('h', (0,), None), ('u', (1,), u), ('cz', (0,1), None),\
+        ('mod2qb', (1,2), np.ones((1,2,2), dtype=complex)),\
+        ('rz', (2,), np.zeros((1,2,2), dtype=complex)),\
+        ('diag', (0,1,2), np.ones((2,2,2), dtype=complex)),\
+        ('unitary', (0,2), np.eye(4, dtype=complex).reshape(4,2,2)),\
+        ('unitary', (0,1,2), np.eye(8, dtype=complex).reshape(16,2,2)),\
+        ('swap', (1,2), None), ('cu', (0,2,1), u),\
+        ('phase', (0,1), -np.ones((1,2,2), dtype=complex))]
+    return pack_circ(gates)
+
+def warmup(dtypes=(np.complex128,), backends=('numba',), extras=True, stabilizer=False):
+    '''
+    Compile the standard kernels for their standard argument types, so that
+    the first real run does not pay for JIT compilation. Kernels are cached
+    on disk by Numba, so after the first warmup on a machine this mostly
+    loads machine code from the cache.
+    Args:
+        dtypes:     Statevector precisions to compile for.
+        backends:   Backends to compile ('numba' and/or 'numpy').
+        extras:     Also compile the blocked and batched runners, sampling and
+                    expectation values (numba backend).
+        stabilizer: Also compile experimental.stabilizerQC and frameQC.
+    Returns a dictionary of seconds spent per component.
+    '''
+    from .circuit import circuit
+    from .blocking import blocker
+    timings = {}
+    names, qargs, parms = sample_circuit()
+    circ = circuit.from_lists(names, qargs, parms)
+
+    for dtype in dtypes:
+        c = circ.astype(dtype)
+        tag = np.dtype(dtype).name
+
+        for backend in backends:
+            start = time.time()
+            if backend=='numba':
+                from . import numbaQC as nQC
+            else:
+                from . import numpyQC as nQC
+            nQC.do_ops(3, c.ops, c.qubits, c.poffs, c.pbuf, np.ones(8, dtype=dtype))
+            timings[backend + ':' + tag] = time.time() - start
+
+        if extras and 'numba' in backends:
+            from . import numbaQC, sampling, observables
+            start = time.time()
+            bc, segs = blocker(block_qubits=3).run(3, c)
+            numbaQC.do_ops_blocked(3, 3, bc.ops, bc.qubits, bc.poffs, bc.pbuf, segs,\
+                np.ones(8, dtype=dtype))
+            numbaQC.do_ops_batch_parallel(3, c.ops, c.qubits, c.poffs,\
+                np.stack([c.pbuf, c.pbuf]), np.ones((2,8), dtype=dtype))
+            numbaQC.modulate_offset(2, 4, c.qubits[0,:1], c.pbuf[:2], np.ones(4, dtype=dtype))
+            timings['blocked:' + tag] = time.time() - start
+
+            start = time.time()
+            vec = np.ones(8, dtype=dtype)
+            sampling.sample(vec, 4)
+            sampling.sample(vec, 4, qubits=[0])
+            sampling.sample(vec, 4, qubits=[0], method='alias')
+            observables.expectation(vec, ['XZ'])
+            timings['measure:' + tag] = time.time() - start
+
+    if stabilizer:
+        from .experimental import stabilizerQC, frameQC
+        start = time.time()
+        ints = np.zeros(2, dtype=np.int64)
+        pairs = np.array([[0,1],[0,1]], dtype=np.int64)
+        args = (2, 1, np.zeros((2,2), dtype=np.int64), np.array([0,1], dtype=np.int64),\
+            np.ones(2, dtype=np.bool_), ints, ints, pairs, pairs, pairs)
+        stabilizerQC.propagate_all_samples(*args)
+        frameQC.unpack_frames(*frameQC.propagate_frames(*args), 2)
+        timings['stabilizer'] = time.time() - start
+
+    return timings
+
+# Run in a fresh interpreter by latency()
+probe = '''
+import time, json
+start = time.time()
+import pqsim
+t_import = time.time() - start
+import numpy as np
+names, qargs, parms = pqsim.startup.sample_circuit()
+start = time.time()
+pqsim.qsim().run(3, names, qargs, parms)
+t_first = time.time() - start
+start = time.time()
+pqsim.qsim().run(3, names, qargs, parms)
+t_second = time.time() - start
+print(json.dumps({'import': t_import, 'first_run': t_first, 'second_run': t_second}))
+'''
+
+def latency(repeats=3, cold=True):
+    '''
+    Measure, in fresh interpreters, the time to "import pqsim" and the time of
+    the first and second qsim.run of a small circuit using every gate.
+    Args:
+        repeats: Number of fresh interpreters to time.
+        cold:    If True, the interpreters share a new, empty on-disk kernel
+                 cache (NUMBA_CACHE_DIR) in a temporary directory, so the first
+                 row shows a cold start and later rows a warm one. The user's
+                 own cache is neither read nor modified.
+    Returns a list of dictionaries of seconds, one per repeat.
+    '''
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = root + os.pathsep + env.get('PYTHONPATH', '')
+
+    with tempfile.TemporaryDirectory() if cold else contextlib.nullcontext() as cache:
+        if cold:
+            env['NUMBA_CACHE_DIR'] = cache
+        results = []
+        for r in range(repeats):
+            out = subprocess.run([sys.executable, '-c', probe], env=env,\
+                capture_output=True, text=True, check=True)
+            results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    return results
+
+if __name__=='__main__':
+    print("repeat   import  first_run  second_run   (seconds)")
+    for r, res in enumerate(latency()):
+        print("%6d  %7.3f  %9.3f  %10.4f" % (r, res['import'], res['first_run'], res['second_run']))
@@ -0,0 +1,415 @@
+import time
+import threading
+import multiprocessing as mp
+from multiprocessing.pool import ThreadPool
+import numpy as np
+from .circuit import circuit
+from .compiler import pack_circ
+
+# Pauli operators, indexed by the code 2*z + x used in stabilizerQC.py
+pauli_ops = np.array([[[1,0],[0,1]], [[0,1],[1,0]], [[1,0],[0,-1]], [[0,-1j],[1j,0]]],\
+    dtype=complex)
+
+# Per-thread (and so per-worker) reusable statevectors
+buffers = threading.local()
+
+def gate(qubits, op):
+    '''
+    A compiled circuit of one gate, applying the operator op to qubits.
+    '''
+    name = 'u' if len(qubits)==1 else 'unitary'
+    return circuit.from_lists(*pack_circ([(name, tuple(qubits), op)]))
+
+class channel():
+    def __init__(self, at, qubits, ops, probs=None):
+        '''
+        A noise channel inserted into a circuit.
+        Args:
+            at:     Position in the circuit; the channel acts after the first "at" gates.
+            qubits: Qubits the channel acts on. Rows and columns of each operator are
+                    indexed little-endian, i.e. bit j of the index is qubits[j].
+            ops:    List of Kraus operators, of shape (2**k, 2**k) for k qubits.
+            probs:  If given, the channel is mixed-unitary: ops are unitaries, and
+                    op k is applied with probability probs[k], whatever the state.
+                    Otherwise ops are general Kraus operators, and op k is picked
+                    per trajectory with probability ||K_k psi||**2.
+        '''
+        self.at = int(at)
+        self.qubits = tuple(int(qb) for qb in qubits)
+        dim = 2**len(self.qubits)
+        self.ops = [np.asarray(op, dtype=complex) for op in ops]
+        for op in self.ops:
+            if op.shape!=(dim, dim):
+                raise ValueError("Kraus operators on " + str(len(self.qubits))\
+                    + " qubits must have shape " + str((dim, dim)) + ".")
+
+        self.probs = None
+        if probs is not None:
+            self.probs = np.asarray(probs, dtype=float)
+            if len(self.probs)!=len(self.ops):
+                raise ValueError("Each Kraus operator needs one probability.")
+        elif not np.allclose(sum(op.conj().T @ op for op in self.ops), np.eye(dim)):
+            raise ValueError("Kraus operators must satisfy sum_k K_k^dag K_k = 1.")
+
+        # Identities are skipped; other operators are applied as one gate
+        self.identity = [np.allclose(op, np.eye(dim)) for op in self.ops]
+        self.gates = [None if ident else gate(self.qubits, op)\
+            for ident, op in zip(self.identity, self.ops)]
+
+    def pick(self, nq, vec, rng):
+        '''
+        Draw a Kraus operator of a general channel for the state vec.
+        Returns its index and probability.
+        '''
+        rho = reduced_density(nq, self.qubits, vec)
+        probs = np.array([np.real(np.trace(op @ rho @ op.conj().T)) for op in self.ops])
+        probs = np.maximum(probs, 0)
+        k = min(np.searchsorted(np.cumsum(probs), rng.random()*probs.sum(), side='right'),\
+            len(probs) - 1)
+        return k, probs[k]
+
+def pauli_string(codes):
+    '''
+    Operator of a Pauli string, given one code (0=I, 1=X, 2=Z, 3=Y) per qubit,
+    indexed little-endian like the operators of a channel.
+    '''
+    op = np.ones((1,1), dtype=complex)
+    for c in codes:
+        op = np.kron(pauli_ops[c], op)
+    return op
+
+def pauli_channel(at, qubits, probs):
+    '''
+    Pauli channel on the listed qubits. Entry i of probs is the probability of
+    the Pauli string whose code on qubits[j] is (i >> 2*j) & 3, so that entry 0
+    is the identity.
+    '''
+    k = len(qubits)
+    ops = [pauli_string([(i >> 2*j) & 3 for j in range(k)]) for i in range(4**k)]
+    return channel(at, qubits, ops, probs)
+
+def depolarizing(at, qubits, p):
+    '''
+    Depolarizing channel: with probability p, one of the 4**k - 1
+    non-identity Pauli strings on the k listed qubits, uniformly.
+    '''
+    n = 4**len(qubits)
+    return pauli_channel(at, qubits, [1 - p] + [p/(n - 1)]*(n - 1))
+
+def amplitude_damping(at, qubit, gamma):
+    '''
+    Amplitude damping of one qubit, decaying from 1 to 0 with probability gamma.
+    This is a general Kraus channel, sampled per trajectory.
+    '''
+    k0 = np.array([[1,0],[0,np.sqrt(1 - gamma)]])
+    k1 = np.array([[0,np.sqrt(gamma)],[0,0]])
+    return channel(at, [qubit], [k0, k1])
+
+def reduced_density(nq, qubits, vec):
+    '''
+    Reduced density matrix of the listed qubits of vec, an nq-qubit
+    statevector, indexed little-endian over qubits. It is accumulated one
+    slab of vec at a time (see numpyQC.slabs()), so vec is not copied.
+    '''
+    from .numpyQC import slabs
+    k = len(qubits)
+    rho = np.zeros((2**k, 2**k), dtype=complex)
+    for slab, axis in slabs(nq, list(qubits), [], vec):
+        m = np.moveaxis(slab, [axis(q) for q in qubits[::-1]], range(k)).reshape(2**k, -1)
+        rho += m @ m.conj().T
+    return rho
+
+def backend_module(backend):
+    if backend=='numba':
+        from . import numbaQC
+        return numbaQC
+    elif backend=='numpy':
+        from . import numpyQC
+        return numpyQC
+    elif backend=='jax':
+        from . import jaxQC
+        return jaxQC
+    raise ValueError("Unknown backend: " + str(backend))
+
+def statevector(nq, dtype):
+    '''
+    The calling thread's statevector buffer, reset to the zero state.
+    It is allocated once, and reused by every trajectory of the thread.
+    '''
+    vec = getattr(buffers, 'vec', None)
+    if vec is None or len(vec)!=2**nq or vec.dtype!=dtype:
+        vec = np.zeros(2**nq, dtype=dtype)
+        buffers.vec = vec
+    vec[:] = 0
+    vec[0] = 1
+    return vec
+
+def init_worker(backend, workers):
+    '''
+    Initializer of process pools: worker processes share the cores.
+    '''
+    if backend=='numba':
+        import numba
+        numba.set_num_threads(max(1, numba.get_num_threads()//workers))
+
+def simulate(job, nQC, pattern, rng):
+    '''
+    Run one trajectory: the circuit of a job, with the Kraus operators of its
+    mixed-unitary channels given by pattern, and those of its general channels
+    drawn with rng. Returns the final state, in the thread's reusable buffer.
+    Numba's parallel kernels cannot be entered from pool threads, so there
+    the numba backend runs the serial kernels, over the whole statevector as
+    one chunk (see numbaQC.do_ops_chunk()).
+    '''
+    nq, circ = job['nq'], job['circ']
+    vec = statevector(nq, job['dtype'])
+    serial = job['threaded'] and job['backend']=='numba'
+
+    def run_gates(c, start, stop):
+        if stop<=start:
+            return
+        if serial:
+            nQC.do_ops_chunk(nq, 0, c.ops[start:stop], c.qubits[start:stop],\
+                c.poffs[start:stop+1], c.pbuf, vec)
+        else:
+            nQC.do_ops(nq, c.ops[start:stop], c.qubits[start:stop],\
+                c.poffs[start:stop+1], c.pbuf, vec)
+
+    start = 0
+    for ch, slot in zip(job['channels'], job['slots']):
+        run_gates(circ, start, ch.at)
+        start = ch.at
+        if slot>=0:
+            g = ch.gates[pattern[slot]]
+        else:
+            k, p = ch.pick(nq, vec, rng)
+            g = gate(ch.qubits, ch.ops[k]/np.sqrt(p))
+        if g is not None:
+            run_gates(g.astype(vec.dtype), 0, 1)
+    run_gates(circ, start, len(circ))
+    return vec
+
+def new_part(job):
+    part = {'expectation': None, 'counts': {}, 'runs': 0, 'states': []}
+    if job['paulis'] is not None:
+        part['expectation'] = np.zeros(len(job['paulis']))
+    return part
+
+def accumulate(job, part, vec, weight, seed):
+    '''
+    Add the weighted expectation values of the final state vec of a
+    trajectory, and "weight" samples of its measured qubits, to part.
+    '''
+    if job['paulis'] is not None:
+        from .observables import expectation
+        part['expectation'] += weight*expectation(vec, job['paulis'], job['coeffs'])
+    if job['measure'] is not None:
+        from .sampling import counts as sample_counts
+        outs, cnts = sample_counts(vec, weight, qubits=job['measure'], seed=seed)
+        for o, c in zip(outs, cnts):
+            part['counts'][int(o)] = part['counts'].get(int(o), 0) + int(c)
+
+def run_task(args):
+    '''
+    Simulate a chunk of patterns, and return the partial sums of the
+    weighted expectation values and the sample counts over their shots.
+    These use Numba's parallel kernels, so in pool threads the final states
+    are returned instead, in part['states'], and summed by the calling thread.
+    '''
+    job, patterns, counts, seed = args
+    nQC = backend_module(job['backend'])
+    rng = np.random.default_rng(seed)
+    general = min(job['slots'], default=0)<0
+
+    part = new_part(job)
+    for pattern, count in zip(patterns, counts):
+        # With general channels every shot is a distinct trajectory
+        for weight in ([1]*count if general else [count]):
+            vec = simulate(job, nQC, pattern, rng)
+            part['runs'] += 1
+            sample_seed = int(rng.integers(2**31)) if job['measure'] is not None else None
+            if job['threaded']:
+                part['states'].append((vec.copy(), weight, sample_seed))
+            else:
+                accumulate(job, part, vec, weight, sample_seed)
+    return part
+
+class trajectories():
+    '''
+    Monte Carlo simulation of noisy circuits by statevector trajectories.
+
+    Noise channels (see channel) are inserted between the gates of a circuit.
+    The Kraus operators of mixed-unitary channels, such as Pauli channels, do
+    not depend on the state, so they are sampled for all shots up front with
+    experimental.noise, and each distinct error pattern is simulated once,
+    weighted by the number of shots showing it. General Kraus channels are
+    sampled per trajectory from the state, so each of their shots is its own
+    trajectory.
+
+    Patterns are split into tasks of about "chunk" trajectories, which run on
+    a pool of worker processes or threads, each reusing one statevector
+    buffer. Expectation values and sample counts are summed as tasks
+    complete, so no final states are kept beyond those of a task. Numba's
+    parallel kernels hang the interpreter at exit once entered from pool
+    threads, so thread workers only simulate, and return the final states
+    of their task to the calling thread, which sums over them.
+    '''
+    def __init__(self, backend='numba', workers=1, pool='process', chunk=16, sparse=True,\
+        dtype=complex):
+        '''
+        Args:
+            backend: Statevector backend: 'numba', 'numpy' or 'jax'.
+            workers: Number of workers. With 1, trajectories run in the calling process.
+            pool:    'process' for a pool of (spawned) worker processes, or 'thread'
+                     for threads, which suits the numpy backend, whose kernels
+                     release the GIL. In threads, the numba backend runs its
+                     serial kernels, which hold the GIL, one thread at a time.
+            chunk:   Number of trajectories per task.
+            sparse:  Sample patterns by geometric skipping over the errors (see
+                     noise.histogram()), when operator 0 of every mixed-unitary
+                     channel is the identity.
+            dtype:   Precision of the statevectors.
+        '''
+        self.backend = backend
+        self.workers = workers
+        self.pool_kind = pool
+        self.chunk = chunk
+        self.sparse = sparse
+        self.dtype = np.dtype(dtype)
+        self.pool = None
+        self.stats = {}
+
+        if pool not in ['process', 'thread']:
+            raise ValueError("pool must be 'process' or 'thread'.")
+        backend_module(backend)
+
+    def start(self):
+        '''
+        Start the worker pool, which is kept for later runs.
+        Process workers are spawned rather than forked, so that they do not
+        inherit the state of Numba's thread pool; their kernels are loaded
+        from the on-disk cache.
+        '''
+        if self.pool is None and self.workers>1:
+            if self.pool_kind=='thread':
+                self.pool = ThreadPool(self.workers)
+            else:
+                self.pool = mp.get_context('spawn').Pool(self.workers,\
+                    initializer=init_worker, initargs=(self.backend, self.workers))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def patterns(self, channels, shots, seed):
+        '''
+        Distinct Kraus operators of the mixed-unitary channels over all shots,
+        and the number of shots showing each (see noise.histogram()).
+        '''
+        from .experimental.noise import noise
+        if len(channels)==0:
+            return np.zeros((1,0), dtype=np.int64), np.array([shots])
+        sparse = self.sparse and all(ch.identity[0] for ch in channels)
+        nz = noise(len(channels), [len(ch.ops) for ch in channels], shots,\
+            probs=[ch.probs for ch in channels], seed=seed)
+        return nz.histogram(sparse=sparse)
+
+    def tasks(self, patterns, counts, general):
+        '''
+        Group patterns into tasks of about self.chunk trajectories. Patterns
+        run as one trajectory each, or, with general channels, as one per
+        shot, in which case their shots may be split over several tasks.
+        '''
+        entries = []
+        for idx, c in enumerate(counts):
+            if general:
+                for start in range(0, c, self.chunk):
+                    entries.append((idx, min(self.chunk, c - start)))
+            else:
+                entries.append((idx, c))
+
+        groups = []
+        runs = self.chunk
+        for idx, c in entries:
+            if runs>=self.chunk:
+                groups.append([])
+                runs = 0
+            groups[-1].append((idx, c))
+            runs += c if general else 1
+        return groups
+
+    def run(self, nq, names, qargs=None, parms=None, channels=[], shots=1000, paulis=None,\
+        coeffs=None, measure=None, seed=None):
+        '''
+        Run shots noisy trajectories of a circuit, from the zero state.
+
+        The circuit is given either as the names, qargs and parms lists,
+        or as a compiled circuit object passed in place of names.
+        Args:
+            channels: List of noise channels (see channel).
+            paulis:   Optional list of Pauli strings, whose expectation values
+                      (with coeffs, see observables.expectation()) are averaged
+                      over the shots.
+            measure:  Optional list of qubits, measured once per shot.
+            seed:     Seed for the noise, Kraus operators and measurement outcomes.
+        Returns a dictionary holding
+            expectation: the averaged expectation values, if paulis are given.
+            counts:      distinct outcomes and their counts (as sampling.counts()),
+                         if measure is given.
+        '''
+        start_time = time.perf_counter()
+        if isinstance(names, circuit):
+            circ = names
+        else:
+            circ = circuit.from_lists(names, qargs, parms)
+        circ = circ.astype(self.dtype)
+
+        channels = sorted(channels, key=lambda ch: ch.at)
+        for ch in channels:
+            if ch.at<0 or ch.at>len(circ) or max(ch.qubits)>=nq:
+                raise ValueError("Channel outside the circuit.")
+        mixed = [ch for ch in channels if ch.probs is not None]
+        slots = [mixed.index(ch) if ch.probs is not None else -1 for ch in channels]
+        general = len(mixed)<len(channels)
+
+        if measure is not None:
+            measure = np.asarray(measure, dtype=np.int64)
+        job = {'nq': nq, 'backend': self.backend, 'dtype': self.dtype, 'circ': circ,\
+            'channels': channels, 'slots': slots, 'paulis': paulis, 'coeffs': coeffs,\
+            'measure': measure, 'threaded': self.workers>1 and self.pool_kind=='thread'}
+
+        seeds = np.random.SeedSequence(seed)
+        patterns, counts = self.patterns(mixed, shots, seeds.spawn(1)[0])
+        groups = self.tasks(patterns, counts, general)
+        tasks = [(job, patterns[[i for i, c in g]], [c for i, c in g], s)\
+            for g, s in zip(groups, seeds.spawn(len(groups)))]
+
+        self.start()
+        if self.pool is None:
+            parts = map(run_task, tasks)
+        else:
+            parts = self.pool.imap_unordered(run_task, tasks)
+
+        total = new_part(job)
+        for part in parts:
+            for vec, weight, sample_seed in part['states']:
+                accumulate(job, total, vec, weight, sample_seed)
+            if paulis is not None:
+                total['expectation'] += part['expectation']
+            for o, c in part['counts'].items():
+                total['counts'][o] = total['counts'].get(o, 0) + c
+            total['runs'] += part['runs']
+
+        result = {}
+        if paulis is not None:
+            result['expectation'] = total['expectation']/shots
+        if measure is not None:
+            outs = np.array(sorted(total['counts']), dtype=np.int64)
+            result['counts'] = (outs, np.array([total['counts'][o] for o in outs],\
+                dtype=np.int64))
+
+        self.stats = {'shots': shots, 'patterns': len(counts), 'trajectories': total['runs'],\
+            'tasks': len(tasks), 'seconds': time.perf_counter() - start_time}
+        return result
@@ -1,75 +1,277 @@
 import numpy as np
-from . import numbaQC
-from . import numpyQC
+from .compiler import fuser
+from .circuit import circuit
+from .blocking import blocker
 
 class qsim():
-    def __init__(self, backend='numba'):
+    def __init__(self, backend='numba', fuse=0, block_qubits=0, dtype=complex,\
+        chunk_qubits=24, global_qubits=2, transport='shm', profile=False,\
+        snapshots=None, max_bond=64, cutoff=1e-12):
         '''
         Initialize the convenience class.
+        Args:
+            backend: Which numerical backend to use ('numba', 'numpy', 'jax'
+                     for whole-circuit XLA programs (see jaxQC.py), 'sparse' for
+                     states with few non-zero amplitudes (see sparseQC.py), 'mps'
+                     for matrix product states (see mpsQC.py), or 'distributed'
+                     for a statevector split over worker processes).
+            fuse:    Gate fusion level applied before each run. If 0, gates are
+                     run as given. If 1, runs of 1-qubit gates and of diagonal
+                     gates are fused. If k>=2, gates touching at most k qubits
+                     are also fused into dense k-qubit operators.
+            block_qubits: If non-zero (numba backend only), run cache-blocked:
+                     gates are applied to chunks of 2**block_qubits amplitudes
+                     at a time (see blocking.py).
+            dtype:   Precision of statevectors and gate parameters, either
+                     np.complex128 (default) or np.complex64.
+            chunk_qubits: For statevectors passed as an np.memmap (numba backend
+                     only), the number of qubits per chunk held in memory
+                     (see outofcore.py).
+            global_qubits: For the distributed backend, the statevector is split
+                     over 2**global_qubits worker processes (see distributed.py).
+            transport: For the distributed backend, 'shm' (shared memory) or
+                     'socket' (stand-in for exchanges between nodes).
+            profile: If True, gates are run and timed one at a time, and calls,
+                     time and bytes touched per gate type and qubit are
+                     reported in qsim.profile_stats (see profiling.py).
+            snapshots: Optional snapshots object (see snapshots.py). Runs from the
+                     zero state resume from the deepest cached circuit prefix,
+                     and report where they resumed in qsim.snapshot_stats.
+            max_bond: For the mps backend, the largest bond dimension kept when
+                     truncating (see mpsQC.py).
+            cutoff:  For the mps backend, the largest relative weight of singular
+                     values dropped by one truncation.
         '''
+        # Backends are imported here, so that only the one in use is loaded
         self.backend = backend
         if backend=='numba':
+            from . import numbaQC
             self.nQC = numbaQC
         elif backend=='numpy':
+            from . import numpyQC
             self.nQC = numpyQC
+        elif backend=='jax':
+            from . import jaxQC
+            self.nQC = jaxQC
+        elif backend=='sparse':
+            from . import sparseQC
+            self.nQC = sparseQC
+            self.sparse_stats = {}
+        elif backend=='mps':
+            from . import mpsQC
+            self.nQC = mpsQC
+            self.max_bond = max_bond
+            self.cutoff = cutoff
+            self.mps_stats = {}
+        elif backend=='distributed':
+            from . import numbaQC
+            self.nQC = numbaQC
+            self.global_qubits = global_qubits
+            self.transport = transport
+            self.engine = None
+            self.distributed_stats = {}
+
+        self.fuse = fuse
+        self.fusion_stats = {}
+
+        if block_qubits>0 and backend!='numba':
+            raise ValueError("Cache blocking requires the numba backend.")
+        self.block_qubits = block_qubits
+        self.blocking_stats = {}
+
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in [np.complex64, np.complex128]:
+            raise ValueError("dtype must be np.complex64 or np.complex128.")
+
+        self.chunk_qubits = chunk_qubits
+        self.io_stats = {}
+
+        if profile and (block_qubits>0 or backend=='distributed'):
+            raise ValueError("Profiling runs gates one at a time, without cache "\
+                "blocking or distribution.")
+        self.profile = profile
+        self.profile_stats = {}
+
+        if snapshots is not None and (block_qubits>0 or profile or backend=='distributed'):
+            raise ValueError("Snapshots cannot be combined with cache blocking, "\
+                "profiling or the distributed backend.")
+        self.snapshots = snapshots
+        self.snapshot_stats = {}
+
+    def close(self):
+        '''
+        Release the worker processes and shared memory of the distributed
+        backend. A qsim object can also be used as a context manager, which
+        closes it on exit.
+        '''
+        if self.backend=='distributed' and self.engine is not None:
+            self.engine.close()
+            self.engine = None
 
-    def run(self, nq, names, qargs, parms, vec=[]):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def run(self, nq, names, qargs=None, parms=None, vec=[]):
         '''
         Initiate run of a circuit. If no statevector
         is provided, initialize a fresh statevector in
         the zero state.
+
+        The circuit is given either as the names, qargs and parms
+        lists, or as a compiled circuit object passed in place of names.
+
+        With snapshots, only runs from a fresh statevector use the cache.
+
+        If vec is an np.memmap (see outofcore.open_state()), the circuit
+        is run out-of-core, a few chunks of vec at a time.
+
+        With the sparse or mps backend and no statevector provided, the
+        final sparseQC.state or mpsQC.state is returned instead of a statevector.
         '''
         returnstate = False
 
+        if self.fuse>0:
+            if isinstance(names, circuit):
+                names, qargs, parms = names.to_lists()
+            fz = fuser(max_qubits=self.fuse)
+            names, qargs, parms = fz.run(names, qargs, parms)
+            self.fusion_stats = fz.stats
+
+        if self.backend in ['sparse', 'mps'] and len(vec)!=2**nq:
+            return self.run_state(nq, names, qargs, parms)
+
         if len(vec)!=2**nq:
-            vec = np.zeros(2**nq, dtype=complex)
+            vec = np.zeros(2**nq, dtype=self.dtype)
             vec[0] = 1.
             returnstate = True
 
-        self.nQC.do_circ(nq, names, qargs, parms, vec)
+        if isinstance(vec, np.memmap):
+            if self.backend!='numba':
+                raise ValueError("Out-of-core runs require the numba backend.")
+            if isinstance(names, circuit):
+                names, qargs, parms = names.to_lists()
+            from .outofcore import outofcore
+            ooc = outofcore(chunk_qubits=self.chunk_qubits)
+            ooc.run(nq, names, qargs, parms, vec)
+            self.io_stats = ooc.stats
+            return
+
+        if self.backend=='distributed':
+            if isinstance(names, circuit):
+                names, qargs, parms = names.to_lists()
+            self.run_distributed(nq, names, qargs, parms, vec, returnstate)
+            if returnstate:
+                return vec
+            return
+
+        if isinstance(names, circuit):
+            circ = names
+        else:
+            circ = circuit.from_lists(names, qargs, parms)
+        circ = circ.astype(vec.dtype)
+
+        if self.block_qubits>0 and nq>self.block_qubits:
+            bl = blocker(block_qubits=self.block_qubits)
+            circ, segs = bl.run(nq, circ)
+            self.blocking_stats = bl.stats
+            self.nQC.do_ops_blocked(nq, self.block_qubits, circ.ops, circ.qubits,\
+                circ.poffs, circ.pbuf, segs, vec)
+        elif self.profile:
+            from .profiling import profiler
+            prof = profiler()
+            prof.run(nq, circ, vec, self.nQC)
+            self.profile_stats = prof.stats
+        elif self.snapshots is not None and returnstate:
+            self.snapshots.run(nq, circ, vec, self.nQC)
+            self.snapshot_stats = self.snapshots.stats
+        else:
+            self.nQC.do_ops(nq, circ.ops, circ.qubits, circ.poffs, circ.pbuf, vec)
 
         if returnstate:
             return vec
 
+    def run_state(self, nq, names, qargs, parms):
+        '''
+        Run a circuit from the zero state with the sparse or mps backend, and
+        return the final sparseQC.state or mpsQC.state, which need not fit in
+        memory as a dense statevector. Its state.todense() gives the statevector.
+        '''
+        if isinstance(names, circuit):
+            circ = names
+        else:
+            circ = circuit.from_lists(names, qargs, parms)
+        if self.backend=='mps':
+            st = self.nQC.state(nq, dtype=self.dtype, max_bond=self.max_bond,\
+                cutoff=self.cutoff)
+            st.run(circ)
+            self.mps_stats = st.stats
+        else:
+            st = self.nQC.state(nq, dtype=self.dtype)
+            st.run(circ)
+            self.sparse_stats = st.stats
+        return st
+
+    def run_distributed(self, nq, names, qargs, parms, vec, fresh):
+        '''
+        Run a circuit with the distributed backend, and copy the result into vec.
+        Worker processes are kept alive between runs on the same number of qubits.
+        '''
+        from .distributed import distributed
+        # An engine closed after a worker failed is replaced
+        if self.engine is None or len(self.engine.procs)==0 or self.engine.nq!=nq\
+            or self.engine.dtype!=vec.dtype:
+            if self.engine is not None:
+                self.engine.close()
+            self.engine = distributed(nq, global_qubits=self.global_qubits,\
+                transport=self.transport, dtype=vec.dtype)
+
+        if fresh:
+            self.engine.reset()
+        else:
+            self.engine.set_state(vec)
+        self.engine.run(names, qargs, parms)
+        vec[:] = self.engine.get_state()
+        self.distributed_stats = self.engine.stats
+
+    def run_batch(self, nq, names, qargs, parms, vecs=None):
+        '''
+        Run one circuit structure over a batch of parameter sets.
+        Args:
+            parms: Array of shape (batch, nparams, 2, 2); one parms list per run.
+            vecs:  Optional array of shape (batch, 2**nq) of input statevectors,
+                   updated in place. If omitted, every run starts from the zero
+                   state, and the resulting statevectors are returned.
+        Gate fusion and cache blocking are not applied to batched runs.
+        '''
+        returnstate = False
+
+        if vecs is None:
+            vecs = np.zeros((len(parms), 2**nq), dtype=self.dtype)
+            vecs[:,0] = 1.
+            returnstate = True
+
+        self.nQC.do_circ_batch(nq, names, qargs, parms, vecs)
+
+        if returnstate:
+            return vecs
+
     @staticmethod
-    def get_circ_data(circ, gate_dict):
+    def get_circ_data(circ, gate_dict=None):
         '''
         This is a compatibility layer for QISkit.
         Given a QISkit circuit, return the lists of instructions
-        and parameters necessary to call do_circ().
+        and parameters necessary to call do_circ(). The circuit
+        is converted in a single pass (see qiskit_import.py).
         Args:
             circ:      A QISkit circuit object.
-            gate_dict: A dictionary enumerating all types / count of gates in circ.
-        '''
-        lut = circ.qubits
-        nqb = len(lut)
-        ngates = len(circ)
-        try:
-            nugate = gate_dict['u']
-        except:
-            nugate = 0
-
-        names = np.repeat(['aa'],ngates)
-        qargs = np.zeros((ngates,2),dtype=int)-1
-        parms = np.empty((nugate,2,2),dtype=complex)
-        idx = 0
-        idx_p = 0
-        for dat in circ:
-            if dat[0].name in ['cz', 'h', 'u', 'rz']:
-                names[idx] = dat[0].name
-                for qarg,qb in enumerate(dat[1]):
-                    qargs[idx,qarg] = lut.index(qb)
-
-                idx += 1
-
-                if dat[0].name=='u':
-                    parms[idx_p] = dat[0].to_matrix()
-                    idx_p += 1
-                if dat[0].name=='rz':
-                    parms[idx_p,0,0] = dat[0].params[0]
-                    idx_p += 1
-
-        return names, qargs, parms
+            gate_dict: Unused; kept for compatibility with get_circ_stat().
+        '''
+        from .qiskit_import import from_qiskit
+        nq, compiled = from_qiskit(circ)
+        return compiled.to_lists()
 
     @staticmethod
     def get_circ_stat(circ):
@@ -0,0 +1,35 @@
+import numpy as np
+from pqsim import qsim
+from pqsim.compiler import pack_circ
+
+def random_unitary(rng, dim):
+    q, r = np.linalg.qr(rng.normal(size=(dim,dim)) + 1j*rng.normal(size=(dim,dim)))
+    return q
+
+def test_gate_wider_than_block():
+    # A 3-qubit unitary cannot fit in a block of 2 qubits
+    rng = np.random.default_rng(1234)
+    gates = [('h', (qb,), None) for qb in range(5)]
+    gates.append(('unitary', (0, 3, 4), random_unitary(rng, 8).reshape(16,2,2)))
+    gates.append(('u', (4,), random_unitary(rng, 2).reshape(1,2,2)))
+    names, qargs, parms = pack_circ(gates)
+
+    ref = qsim().run(5, names, qargs, parms)
+    sim = qsim(block_qubits=2)
+    vec = sim.run(5, names, qargs, parms)
+    assert np.allclose(vec, ref)
+    assert sim.blocking_stats['unblocked']==1
+
+def test_fused_gates_wider_than_block():
+    rng = np.random.default_rng(1234)
+    gates = []
+    for layer in range(3):
+        for qb in range(6):
+            gates.append(('u', (qb,), random_unitary(rng, 2).reshape(1,2,2)))
+        for qb in range(layer%2, 5, 2):
+            gates.append(('cz', (qb, qb+1), None))
+    names, qargs, parms = pack_circ(gates)
+
+    ref = qsim().run(6, names, qargs, parms)
+    vec = qsim(fuse=3, block_qubits=2).run(6, names, qargs, parms)
+    assert np.allclose(vec, ref)
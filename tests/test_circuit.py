@@ -0,0 +1,153 @@
+import numpy as np
+import pytest
+from pqsim import numbaQC, numpyQC
+from pqsim.circuit import circuit
+from pqsim.compiler import pack_circ, param_slots
+
+nq = 4
+
+def random_unitary(rng, dim):
+    q, r = np.linalg.qr(rng.normal(size=(dim,dim)) + 1j*rng.normal(size=(dim,dim)))
+    return q
+
+def random_state(rng, nq):
+    vec = rng.normal(size=2**nq) + 1j*rng.normal(size=2**nq)
+    return vec/np.linalg.norm(vec)
+
+def phases(rng, n):
+    return np.exp(2j*np.pi*rng.random(n))
+
+def slots(name, qbs, entries):
+    # Pack the entries of a gate's parameters into its 2x2 slots of parms
+    data = np.zeros(4*param_slots(name, len(qbs)), dtype=complex)
+    data[:len(entries)] = entries
+    return data.reshape(-1,2,2)
+
+def operator(name, qbs, data):
+    '''
+    Reference operator of a gate on its own qubits, indexed little-endian
+    over qbs, built from the definition of each gate.
+    '''
+    k = len(qbs)
+    flat = None if data is None else data.reshape(-1)
+    if name=='h':
+        return np.array([[1,1],[1,-1]])/np.sqrt(2.)
+    elif name=='u':
+        return data[0]
+    elif name=='cz':
+        return np.diag([1,1,1,-1])
+    elif name=='mod2qb':
+        return np.diag(flat[:4])
+    elif name=='rz':
+        theta = flat[0].real
+        return np.diag([np.exp(-0.5j*theta), np.exp(0.5j*theta)])
+    elif name=='diag':
+        return np.diag(flat[:2**k])
+    elif name=='unitary':
+        return flat[:4**k].reshape(2**k,2**k)
+    elif name=='swap':
+        return np.eye(4)[[0,2,1,3]]
+    elif name=='cu':
+        # Controls are bits 0..k-2, all set; the target is bit k-1
+        op = np.eye(2**k, dtype=complex)
+        on = [2**(k-1) - 1, 2**k - 1]
+        op[np.ix_(on, on)] = data[0]
+        return op
+    elif name=='phase':
+        d = np.ones(2**k, dtype=complex)
+        d[-1] = flat[0]
+        return np.diag(d)
+
+def full_operator(nq, qbs, op):
+    '''
+    Embed op, acting on qubits qbs, into the full 2**nq operator, as the
+    sum of op[a,b] times the Kronecker product of |a_j><b_j| on qubit qbs[j]
+    and identities on the other qubits. Qubit 0 is the last factor.
+    '''
+    full = np.zeros((2**nq, 2**nq), dtype=complex)
+    for a in range(len(op)):
+        for b in range(len(op)):
+            term = np.ones((1,1))
+            for q in range(nq-1, -1, -1):
+                if q in qbs:
+                    j = qbs.index(q)
+                    e = np.zeros((2,2))
+                    e[(a >> j) & 1, (b >> j) & 1] = 1
+                else:
+                    e = np.eye(2)
+                term = np.kron(term, e)
+            full += op[a,b]*term
+    return full
+
+def gate_cases():
+    rng = np.random.default_rng(42)
+    cases = [('h', (2,), None), ('h', (0,), None)]
+    for qbs in [(0,), (3,)]:
+        cases.append(('u', qbs, random_unitary(rng, 2).reshape(1,2,2)))
+        cases.append(('rz', qbs, slots('rz', qbs, [rng.normal()])))
+    for qbs in [(0, 1), (3, 1)]:
+        cases.append(('cz', qbs, None))
+        cases.append(('swap', qbs, None))
+        cases.append(('mod2qb', qbs, slots('mod2qb', qbs, phases(rng, 4))))
+    for qbs in [(2,), (3, 0), (1, 3, 2)]:
+        k = len(qbs)
+        cases.append(('diag', qbs, slots('diag', qbs, phases(rng, 2**k))))
+        cases.append(('unitary', qbs, slots('unitary', qbs, random_unitary(rng, 2**k).reshape(-1))))
+        cases.append(('phase', qbs, slots('phase', qbs, phases(rng, 1))))
+    for qbs in [(0, 2), (3, 1, 0), (1, 3, 0, 2)]:
+        cases.append(('cu', qbs, random_unitary(rng, 2).reshape(1,2,2)))
+    return cases
+
+@pytest.mark.parametrize('backend', [numbaQC, numpyQC])
+@pytest.mark.parametrize('dtype', [np.complex128, np.complex64])
+@pytest.mark.parametrize('gate', gate_cases(), ids=lambda g: g[0] + str(g[1]))
+def test_opcode(backend, dtype, gate):
+    name, qbs, data = gate
+    vec = random_state(np.random.default_rng(7), nq)
+    ref = full_operator(nq, list(qbs), operator(name, qbs, data)) @ vec
+
+    circ = circuit.from_lists(*pack_circ([gate])).astype(dtype)
+    out = vec.astype(dtype)
+    backend.do_ops(nq, circ.ops, circ.qubits, circ.poffs, circ.pbuf, out)
+    tol = 1e-12 if dtype==np.complex128 else 1e-5
+    assert np.allclose(out, ref, atol=tol)
+
+def test_lists_round_trip():
+    names, qargs, parms = pack_circ(gate_cases())
+    circ = circuit.from_lists(names, qargs, parms)
+    assert len(circ)==len(names)
+    names2, qargs2, parms2 = circ.to_lists()
+    assert (names2==names).all()
+    assert (qargs2==qargs).all()
+    assert np.array_equal(parms2, parms)
+
+def test_astype():
+    circ = circuit.from_lists(*pack_circ(gate_cases()))
+    assert circ.astype(np.complex128) is circ
+    c64 = circ.astype(np.complex64)
+    assert c64.pbuf.dtype==np.complex64
+    assert (c64.ops==circ.ops).all() and (c64.qubits==circ.qubits).all()
+    assert (c64.poffs==circ.poffs).all()
+    assert np.allclose(c64.pbuf, circ.pbuf, atol=1e-6)
+
+def test_inverse():
+    circ = circuit.from_lists(*pack_circ(gate_cases()))
+    inv = circ.inverse()
+    assert (inv.ops==circ.ops[::-1]).all()
+    twice = inv.inverse()
+    assert (twice.poffs==circ.poffs).all() and np.allclose(twice.pbuf, circ.pbuf)
+
+    vec = random_state(np.random.default_rng(3), nq)
+    out = vec.copy()
+    for c in [circ, inv]:
+        numbaQC.do_ops(nq, c.ops, c.qubits, c.poffs, c.pbuf, out)
+    assert np.allclose(out, vec)
+
+@pytest.mark.parametrize('gate', [('mod2qb', (0, 1), np.array([1, 1, 2, 1])),\
+    ('diag', (0, 2, 1), np.full(8, 0.5)), ('phase', (1, 3), np.array([1j + 1]))],\
+    ids=lambda g: g[0])
+def test_inverse_needs_unit_modulus(gate):
+    name, qbs, entries = gate
+    circ = circuit.from_lists(*pack_circ([('h', (0,), None), (name, qbs, slots(name, qbs, entries))]))
+    with pytest.raises(ValueError):
+        circ.inverse()
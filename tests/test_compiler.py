@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+from pqsim import qsim
+from pqsim.compiler import pack_circ, unpack_circ, param_slots, fuser
+
+def random_unitary(rng, dim):
+    q, r = np.linalg.qr(rng.normal(size=(dim,dim)) + 1j*rng.normal(size=(dim,dim)))
+    return q
+
+def random_circuit(rng, nq, ngates):
+    '''
+    Random gates of every kind, mostly 1-qubit and diagonal gates on
+    neighbouring qubits, so that there are runs for the fuser to merge.
+    '''
+    kinds = ['h', 'u', 'rz', 'cz', 'mod2qb', 'phase', 'diag', 'swap', 'cu', 'unitary']
+    weights = np.array([3, 3, 3, 2, 2, 1, 1, 1, 1, 1], dtype=float)
+    gates = []
+    for g in range(ngates):
+        name = str(rng.choice(kinds, p=weights/weights.sum()))
+        k = {'h': 1, 'u': 1, 'rz': 1, 'cz': 2, 'mod2qb': 2, 'swap': 2}.get(name, rng.integers(1, 4))
+        if name=='cu':
+            k = max(k, 2)
+        first = rng.integers(0, nq - k + 1)
+        qbs = tuple(int(q) for q in rng.permutation(np.arange(first, first + k)))
+        if name in ['u', 'cu']:
+            entries = random_unitary(rng, 2).reshape(-1)
+        elif name=='unitary':
+            entries = random_unitary(rng, 2**k).reshape(-1)
+        elif name=='rz':
+            entries = [rng.normal()]
+        else:
+            entries = np.exp(2j*np.pi*rng.random(2**k))
+        data = None
+        if param_slots(name, k)>0:
+            data = np.zeros(4*param_slots(name, k), dtype=complex)
+            n = min(len(data), len(entries))
+            data[:n] = entries[:n]
+            data = data.reshape(-1,2,2)
+        gates.append((name, qbs, data))
+    return pack_circ(gates)
+
+@pytest.mark.parametrize('fuse', [1, 2, 3])
+def test_fusion_preserves_state(fuse):
+    nq = 6
+    rng = np.random.default_rng(fuse)
+    for trial in range(10):
+        names, qargs, parms = random_circuit(rng, nq, 60)
+        ref = qsim().run(nq, names, qargs, parms)
+        sim = qsim(fuse=fuse)
+        vec = sim.run(nq, names, qargs, parms)
+        assert np.allclose(vec, ref, atol=1e-12)
+
+        stats = sim.fusion_stats
+        fused = unpack_circ(*fuser(max_qubits=fuse).run(names, qargs, parms))
+        assert stats['gates']==len(names)
+        assert stats['sweeps']==len(fused)
+        assert stats['eliminated']==stats['gates'] - stats['sweeps']
+        assert stats['eliminated']>0
+        # Dense operators are no wider than fuse or the widest input gate,
+        # and diagonals no wider than max_diag
+        width = max(fuse, max(len(qbs) for n, qbs, d in unpack_circ(names, qargs, parms)))
+        for n, qbs, d in fused:
+            assert len(qbs)<=(max(width, 8) if n in ['diag', 'mod2qb'] else width)
+
+def test_fusion_merges_runs():
+    # h-h-h on one qubit is one sweep; cz, rz and mod2qb on two qubits are one diagonal
+    rng = np.random.default_rng(5)
+    gates = [('h', (0,), None)]*3 + [('cz', (0, 1), None),\
+        ('rz', (1,), np.array([0.3, 0, 0, 0]).reshape(1,2,2)),\
+        ('mod2qb', (1, 0), np.exp(2j*np.pi*rng.random(4)).reshape(1,2,2))]
+    names, qargs, parms = pack_circ(gates)
+    ref = qsim().run(2, names, qargs, parms)
+    sim = qsim(fuse=1)
+    assert np.allclose(sim.run(2, names, qargs, parms), ref)
+    assert sim.fusion_stats=={'gates': 6, 'sweeps': 2, 'eliminated': 4}
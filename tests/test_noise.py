@@ -0,0 +1,11 @@
+import numpy as np
+from pqsim.experimental.noise import noise
+
+def test_unseeded_stats_match_entropy():
+    nz = noise(3, 4, 1000, probs=[[0.7, 0.1, 0.1, 0.1]]*3, chunk=256)
+    ent = nz.entropy
+    assert np.array_equal(ent, nz.entropy)
+
+    rows, counts = np.unique(ent, axis=0, return_counts=True)
+    expected = {''.join(str(v) for v in row): int(c) for row, c in zip(rows, counts)}
+    assert nz.stats==expected
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+from pqsim import numbaQC, numpyQC
+from pqsim.compiler import pack_circ
+
+@pytest.mark.parametrize('qb0, qb1', [(0, 1), (1, 0), (2, 3), (3, 1), (0, 4)])
+def test_modulate_2qb(qb0, qb1):
+    # Entry 2*b1 + b0 of the modulator scales the amplitudes where qubit
+    # qb0 is b0 and qb1 is b1; the bits were once read as i%2**qb
+    nq = 5
+    mod = np.array([1, 2, 3, 4], dtype=complex)
+    vec = np.ones(2**nq, dtype=complex)
+    numbaQC.modulate_2qb(nq, qb0, qb1, mod, vec)
+    i = np.arange(2**nq)
+    assert np.array_equal(vec, mod[2*((i >> qb1) & 1) + ((i >> qb0) & 1)])
+
+@pytest.mark.parametrize('backend', [numbaQC, numpyQC])
+def test_mod2qb_keeps_parms(backend):
+    names, qargs, parms = pack_circ([('mod2qb', (2, 0), np.array([1, 2, 3, 4]).reshape(1,2,2))])
+    before = parms.copy()
+    vec = np.ones(8, dtype=complex)
+    backend.do_circ(3, names, qargs, parms, vec)
+    i = np.arange(8)
+    assert np.array_equal(vec, (1 + 2*((i >> 0) & 1) + ((i >> 2) & 1)).astype(complex))
+    assert np.array_equal(parms, before)
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from pqsim import numbaQC, numpyQC
+from pqsim.circuit import circuit
+from pqsim.compiler import pack_circ, param_slots
+
+def random_unitary(rng, dim):
+    q, r = np.linalg.qr(rng.normal(size=(dim,dim)) + 1j*rng.normal(size=(dim,dim)))
+    return q
+
+def random_state(rng, nq):
+    vec = rng.normal(size=2**nq) + 1j*rng.normal(size=2**nq)
+    return vec/np.linalg.norm(vec)
+
+def random_circuit(rng, nq, ngates):
+    '''
+    Random gates of every opcode, on up to 3 qubits, in random order.
+    '''
+    gates = []
+    for g in range(ngates):
+        name = rng.choice(['h', 'u', 'cz', 'mod2qb', 'rz', 'diag', 'unitary', 'swap', 'cu', 'phase'])
+        k = {'h': 1, 'u': 1, 'rz': 1, 'cz': 2, 'mod2qb': 2, 'swap': 2}.get(name, rng.integers(1, 4))
+        if name=='cu':
+            k = max(k, 2)
+        qbs = tuple(int(q) for q in rng.choice(nq, k, replace=False))
+        if name in ['u', 'cu']:
+            entries = random_unitary(rng, 2).reshape(-1)
+        elif name=='unitary':
+            entries = random_unitary(rng, 2**k).reshape(-1)
+        elif name=='rz':
+            entries = [rng.normal()]
+        elif name in ['mod2qb', 'diag', 'phase']:
+            entries = np.exp(2j*np.pi*rng.random(2**k))
+        data = None
+        if param_slots(name, k)>0:
+            data = np.zeros(4*param_slots(name, k), dtype=complex)
+            n = min(len(data), len(entries))
+            data[:n] = entries[:n]
+            data = data.reshape(-1,2,2)
+        gates.append((str(name), qbs, data))
+    return circuit.from_lists(*pack_circ(gates))
+
+def run(backend, nq, circ, vec):
+    out = vec.copy()
+    backend.do_ops(nq, circ.ops, circ.qubits, circ.poffs, circ.pbuf.astype(out.dtype), out)
+    return out
+
+@pytest.mark.parametrize('nq', [3, 5, 7])
+@pytest.mark.parametrize('dtype', [np.complex128, np.complex64])
+def test_matches_numba_multi_slab(monkeypatch, nq, dtype):
+    # Slabs of 8 amplitudes, so that most gates run over several slabs
+    monkeypatch.setattr(numpyQC, 'slab_qubits', 3)
+    rng = np.random.default_rng(nq)
+    for trial in range(5):
+        circ = random_circuit(rng, nq, 40)
+        vec = random_state(rng, nq).astype(dtype)
+        tol = 1e-12 if dtype==np.complex128 else 1e-5
+        assert np.allclose(run(numpyQC, nq, circ, vec), run(numbaQC, nq, circ, vec), atol=tol)
+
+def test_matches_numba_beyond_slab():
+    nq = numpyQC.slab_qubits + 1
+    rng = np.random.default_rng(0)
+    circ = random_circuit(rng, nq, 30)
+    vec = random_state(rng, nq)
+    assert np.allclose(run(numpyQC, nq, circ, vec), run(numbaQC, nq, circ, vec), atol=1e-12)
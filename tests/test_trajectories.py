@@ -0,0 +1,32 @@
+import os
+import sys
+import subprocess
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+script = '''
+import numpy as np
+from pqsim import trajectories as tr
+from pqsim.compiler import pack_circ
+names, qargs, parms = pack_circ([('h', (0,), None), ('cz', (0, 1), None),\\
+    ('h', (2,), None), ('cz', (1, 2), None)])
+channels = [tr.depolarizing(1, [0], 0.1), tr.amplitude_damping(3, 1, 0.2)]
+for backend in ['numpy', 'numba']:
+    res = []
+    for workers in [2, 1]:
+        sim = tr.trajectories(backend=backend, workers=workers, pool='thread', chunk=4)
+        res.append(sim.run(3, names, qargs, parms, channels=channels, shots=64, paulis=['ZZI'],\\
+            measure=[0, 1], seed=7))
+        sim.close()
+    assert np.allclose(res[0]['expectation'], res[1]['expectation'])
+    assert all((a==b).all() for a, b in zip(res[0]['counts'], res[1]['counts']))
+'''
+
+def test_thread_pool_exits():
+    # Parallel Numba kernels entered from pool threads hang the interpreter
+    # at exit; the threaded runs come first, as the hang needs Numba's thread
+    # pool to be started from a pool thread
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, os.environ.get('PYTHONPATH', '')]))
+    proc = subprocess.run([sys.executable, '-c', script], env=env, timeout=240,\
+        capture_output=True, text=True)
+    assert proc.returncode==0, proc.stderr